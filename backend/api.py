@@ -1,24 +1,29 @@
-from flask import Flask, send_file, jsonify, Response, request
-import os
-import psutil
+from flask import Flask, send_file, jsonify, Response, request, stream_with_context, g
 import logging
-from web3 import Web3
-from generate import generate_image  # Your image generation function
+from generate import render_token, save_token  # Your image generation function
+from chain import get_current_token_id
+from token_index import TokenIndex, NOT_MINTED, NEGATIVE_TTL, resolve_token
+from singleflight import SingleFlight
+from opensea import OPENSEA_API_KEY, RefreshQueue
+from metadata_cache import MetadataCache, serialize_metadata
+from variants import VARIANT_FORMATS, negotiate_variant, variant_key, ensure_variant
+from storage import open_storage, image_key, metadata_key, token_stored
+from render_pool import RenderPool, RenderQueueFull, RETRY_AFTER
 import json
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
-from redis.exceptions import RedisError
+import math
+from rate_limit import RateLimiter
+from metrics import REQUEST_SECONDS, RESPONSES, stage, sample_rss, render_latest
+from profiler import profiler
 import time
-import tempfile
-from functools import wraps
-import requests  # Add requests for OpenSea API calls
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache, wraps
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-REDIS_URL = "redis://localhost:6379/0"  # Local Redis instance
-
 app = Flask(__name__)
 
 # Ensure Flask logs to stdout (Gunicorn captures stdout)
@@ -26,179 +31,293 @@ gunicorn_logger = logging.getLogger('gunicorn.error')
 app.logger.handlers = gunicorn_logger.handlers
 app.logger.setLevel(gunicorn_logger.level)
 
-# Initialize limiter with fallback
-# try:
-#     limiter = Limiter(
-#         app=app,
-#         key_func=get_remote_address,
-#         storage_uri=REDIS_URL,
-#         storage_options={"socket_connect_timeout": 30},
-#         strategy="fixed-window",
-#         default_limits=["200 per day", "50 per hour"]
-#     )
-# except RedisError as e:
-#     logger.warning(f"Redis connection failed: {e}. Falling back to in-memory storage.")
-#     limiter = Limiter(
-#         app=app,
-#         key_func=get_remote_address,
-#         storage_uri="memory://",
-#         strategy="fixed-window",
-#         default_limits=["200 per day", "50 per hour"]
-#     )
-
-# Directory to save generated images
-OUTPUT_DIR = "./output"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-# Web3 configuration
-CONTRACT_ADDRESS = "0x262cA2E567315300CDdf389A0D2E37212F4DAEF4"  # Contract address
-
-# RPC URLs ordered by speed (fastest first)
-RPC_URLS = [
-    "https://base-rpc.publicnode.com", 
-    "https://base-mainnet.public.blastapi.io",  
-    "wss://0xrpc.io/base", 
-    "https://base.blockpi.network/v1/rpc/public",
-    "https://developer-access-mainnet.base.org",  
-    "https://mainnet.base.org",  
-    "https://base-pokt.nodies.app", 
-    "https://base.lava.build",  
-    "https://base.api.onfinality.io/public", 
-    "https://endpoints.omniatech.io/v1/base/mainnet/public", 
-    "https://0xrpc.io/base", 
-    "https://base.meowrpc.com",  
-    "https://rpc.therpc.io/base", 
-    "https://rpc.owlracle.info/base/70d38ce1826c4a60bb2a8e05a6c8b20f", 
-    "https://base.drpc.org", 
-    "https://base.rpc.subquery.network/public",  
-    "https://base.llamarpc.com", 
-    "https://api.zan.top/base-mainnet", 
-]
-
-def get_next_rpc():
-    """Get the next RPC URL in rotation."""
-    if not hasattr(get_next_rpc, "current_index"):
-        get_next_rpc.current_index = 0
-    
-    rpc_url = RPC_URLS[get_next_rpc.current_index]
-    get_next_rpc.current_index = (get_next_rpc.current_index + 1) % len(RPC_URLS)
-    return rpc_url
-
-# Load the contract ABI
-with open("Chanclas_ABI.json", "r") as f:
-    CONTRACT_ABI = json.load(f)
-
-def get_web3_contract():
-    """Get a new Web3 contract instance with retry logic."""
-    max_retries = len(RPC_URLS)
-    retry_delay = 1
-    
-    for attempt in range(max_retries):
-        try:
-            rpc_url = get_next_rpc()
-            web3 = Web3(Web3.HTTPProvider(rpc_url))
-            if web3.is_connected():
-                return web3.eth.contract(address=CONTRACT_ADDRESS, abi=CONTRACT_ABI)
-        except Exception as e:
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-                retry_delay *= 2
-            else:
-                raise e
-
-def is_token_minted(token_id):
-    """Check if a token is minted by querying the owner."""
+# Per-client limits, decided in process and shared between workers through Redis
+rate_limiter = RateLimiter()
+
+# Endpoints counted against the default budget; generating a token also costs a "cold" one
+RATE_LIMITED_ENDPOINTS = {"get_nft_metadata", "get_nft_image", "get_bulk_metadata"}
+
+class RateLimited(Exception):
+    """The client has used up its budget; retry_after is in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limited, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+# Browser/edge cache lifetime of generated tokens (they never change)
+IMMUTABLE_MAX_AGE = 31536000
+
+# Where generated images, metadata and variants are kept (see storage.py)
+storage = open_storage()
+
+# /bulk/metadata page limits: tokens returned, IDs examined and generations per request
+BULK_PAGE_SIZE = 100
+BULK_MAX_PAGE_SIZE = 1000
+BULK_MAX_IDS = 10000
+BULK_SCAN_FACTOR = 10
+BULK_MAX_GENERATE = 20
+# Seconds the chain's newest token ID is trusted for ranges without ?end=
+BULK_HEAD_TTL = 60
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+    # No-op unless profiling was switched on at /status/profiler
+    profiler.begin(f"{request.method} {request.path}")
+
+@app.teardown_request
+def end_profile(exc):
+    profiler.end()
+
+@app.after_request
+def record_request(response):
+    # Request latency and status per endpoint, plus this worker's memory now and then
+    endpoint = request.endpoint or "unknown"
+    started = g.get("request_started")
+    if started is not None:
+        REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+    RESPONSES.labels(endpoint, str(response.status_code)).inc()
+    sample_rss()
+    return response
+
+# OpenSea refreshes are queued here and sent by the notifier in indexer.py (not without an API key)
+refresh_queue = RefreshQueue() if OPENSEA_API_KEY else None
+
+# Token state from indexer.py and earlier lookups
+token_index = TokenIndex()
+
+# Serialized /id responses of this worker
+metadata_cache = MetadataCache()
+
+# Content-hash ETags of served images and variants kept per worker (artifacts never change)
+IMAGE_ETAG_CACHE_SIZE = 50000
+
+# Concurrent requests for the same token share one generation
+generation_flight = SingleFlight()
+
+# Renders and variant encodes run here, off the request threads
+render_pool = RenderPool()
+
+# Fresh renders are served from memory and written to storage in the background
+write_behind = ThreadPoolExecutor(max_workers=1, thread_name_prefix="write-behind")
+pending_writes = {}  # token_id -> (RenderedToken, Future) until the artifacts are stored
+pending_lock = threading.Lock()
+
+def persist_token(rendered):
+    """Write-behind step: save a fresh render, then queue its OpenSea refresh."""
     try:
-        contract = get_web3_contract()
-        owner = contract.functions.ownerOf(token_id).call()
-        return True
+        save_token(rendered, storage)
+        # Refresh OpenSea metadata after generating NEW image
+        if refresh_queue is not None:
+            logger.info(f"New image generated for token {rendered.token_id}, queueing OpenSea refresh")
+            with stage("opensea_enqueue"):
+                refresh_queue.enqueue(rendered.token_id)
     except Exception as e:
-        logger.error(f"Error checking token {token_id}: {e}")
-        return False
+        logger.error(f"Error saving token {rendered.token_id}: {e}")
+        raise
+    finally:
+        with pending_lock:
+            pending_writes.pop(rendered.token_id, None)
 
-# @app.before_request
-# def log_resources():
-#     process = psutil.Process(os.getpid())
-#     app.logger.info(f"Memory usage: {process.memory_info().rss / 1024 / 1024:.2f} MB")
+def pending_token(token_id):
+    """The in-memory render of a token whose files are still being written, or None."""
+    with pending_lock:
+        pending = pending_writes.get(token_id)
+    return pending[0] if pending else None
 
-def refresh_opensea_metadata(token_id):
-    """Refresh metadata on OpenSea for a specific token."""
-    try:
-        url = f"https://api.opensea.io/api/v2/chain/base/contract/{CONTRACT_ADDRESS}/nfts/{token_id}/refresh"
-        headers = {
-            'x-api-key': '164a9bc6683142c68001fb234c856ee2'
-        }
-        
-        logger.info(f"Attempting to refresh OpenSea metadata for token {token_id}")
-        response = requests.post(url, headers=headers, timeout=10)
-        
-        if response.status_code == 200:
-            logger.info(f"Successfully refreshed OpenSea metadata for token {token_id}")
-            return True
-        elif response.status_code == 429:
-            logger.warning(f"OpenSea rate limit hit for token {token_id}, but request was queued")
+def flush_writes():
+    """Wait for every queued write (called when the worker exits)."""
+    write_behind.shutdown(wait=True)
+
+def ensure_token_generated(token_id, client=None):
+    """Generate image and metadata for a token unless they already exist.
+
+    Concurrent calls for the same token, from any thread or worker, share a single
+    mint check and generation. Returns False if the token is not minted. A client
+    that needs a generation is charged against the "cold" budget and gets
+    RateLimited once it is used up.
+    """
+    def generate():
+        # Another worker (or node) may have finished while we waited for the lock
+        if pending_token(token_id) is not None or token_stored(storage, token_id):
             return True
-        else:
-            logger.warning(f"OpenSea refresh failed for token {token_id}: Status {response.status_code}, Response: {response.text}")
+
+        # Indexed tokens need no RPC at all; ask the chain if the index has no answer
+        token = resolve_token(token_index, token_id)
+        if token is None:
             return False
-            
-    except requests.exceptions.Timeout:
-        logger.warning(f"OpenSea refresh timed out for token {token_id}")
-        return False
-    except Exception as e:
-        logger.error(f"Error refreshing OpenSea metadata for token {token_id}: {e}")
+
+        logger.info(f"Generating new image and metadata for token {token_id}")
+        with stage("render"):
+            rendered = render_pool.run(render_token, token_id, token.period_id, token.seed, token.extraMints,
+                                       token.curveSteepness, token.maxRebate)
+        # Serve straight from memory; the files follow shortly
+        metadata_cache.put(token_id, serialize_metadata(rendered.metadata))
+        with pending_lock:
+            write = write_behind.submit(persist_token, rendered)
+            pending_writes[token_id] = (rendered, write)
+        # Other workers (and the indexer) wait for the files instead of rendering again
+        generation_flight.hold(write)
+        return True
+
+    # Recently probed unminted IDs are answered without locks or RPC
+    if token_index.get(token_id) is NOT_MINTED:
         return False
+    # Rendered here and still being written: the lock is held until the files are stored
+    if pending_token(token_id) is not None:
+        return True
+
+    if client is not None and pending_token(token_id) is None and not storage.exists(metadata_key(token_id)):
+        retry_after = rate_limiter.hit(client, "cold")
+        if retry_after:
+            raise RateLimited(retry_after)
+
+    return generation_flight.do(token_id, generate)
+
+def cache_forever(response):
+    """Generated tokens never change, so let browsers and edge caches keep them."""
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+def not_minted_response(token_id):
+    """404 that edge caches may keep briefly, matching the local negative cache."""
+    response = jsonify({"error": f"Token {token_id} is not minted"})
+    response.status_code = 404
+    response.cache_control.public = True
+    response.cache_control.max_age = NEGATIVE_TTL
+    return response
+
+def client_address():
+    """The client's IP; requests arriving through the local cloudflared tunnel carry it in a header."""
+    if request.remote_addr in ("127.0.0.1", "::1"):
+        return request.headers.get("CF-Connecting-IP", request.remote_addr)
+    return request.remote_addr
+
+def rate_limited_response(retry_after):
+    response = jsonify({"error": "Too many requests, slow down"})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+@app.before_request
+def limit_requests():
+    # Local bucket only: no network round trip on the request path
+    if request.endpoint in RATE_LIMITED_ENDPOINTS:
+        retry_after = rate_limiter.hit(client_address())
+        if retry_after:
+            return rate_limited_response(retry_after)
+
+def busy_response(message):
+    """503 telling clients when to come back, instead of holding the connection."""
+    response = jsonify({"error": message})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(RETRY_AFTER)
+    return response
+
+def metadata_response(cached):
+    """Build the /id response from cached bytes and their precomputed ETag."""
+    response = Response(cached.body, mimetype="application/json")
+    response.set_etag(cached.etag)
+    response.content_length = len(cached.body)
+    cache_forever(response)
+    # Answers If-None-Match with 304
+    return response.make_conditional(request)
+
+@lru_cache(maxsize=IMAGE_ETAG_CACHE_SIZE)
+def artifact_etag(key):
+    """Content-hash ETag of a stored image or variant, looked up once per worker while recently used."""
+    return storage.etag(key)
+
+def rendered_image_response(rendered):
+    """Send a PNG rendered in memory, with the same headers as one sent from disk."""
+    response = Response(rendered.png, mimetype="image/png")
+    response.set_etag(rendered.etag)
+    response.content_length = len(rendered.png)
+    if "format" not in request.args:
+        response.vary.add("Accept")
+    cache_forever(response)
+    return response.make_conditional(request)
+
+def image_response(token_id, size, fmt):
+    """Send an image variant picked by negotiate_variant()."""
+    rendered = pending_token(token_id)
+    if rendered is not None:
+        if size is None and fmt == "png":
+            return rendered_image_response(rendered)
+        # Variants are encoded from the stored PNG
+        with pending_lock:
+            pending = pending_writes.get(token_id)
+        if pending is not None:
+            pending[1].result()
+
+    key = variant_key(token_id, size, fmt)
+    path = storage.local_path(key)
+    if path is None and not storage.exists(key):
+        generation_flight.do(f"{token_id}:{size}:{fmt}", lambda: render_pool.run(ensure_variant, token_id, size, fmt))
+        path = storage.local_path(key)
+
+    if path is not None:
+        response = send_file(path, mimetype=VARIANT_FORMATS[fmt], etag=artifact_etag(key),
+                             conditional=True, max_age=IMMUTABLE_MAX_AGE)
+    else:
+        # Remote storage without a disk tier: send the bytes
+        data = storage.get(key)
+        response = Response(data, mimetype=VARIANT_FORMATS[fmt])
+        response.set_etag(artifact_etag(key))
+        response.content_length = len(data)
+        response = response.make_conditional(request)
+    if "format" not in request.args:
+        response.vary.add("Accept")
+    return cache_forever(response)
 
 @app.route("/id/<int:token_id>", methods=["GET"])
-#@limiter.limit("60 per minute")
 def get_nft_metadata(token_id):
     try:
-        logger.info(f"Reading metadata for token {token_id}")
-        # Metadata path
-        metadata_path = os.path.join(OUTPUT_DIR, f"{token_id}.json")
-        image_path = os.path.join(OUTPUT_DIR, f"{token_id}.png")
+        # Warm path: response bytes straight from memory, no disk or JSON work
+        cached = metadata_cache.get(token_id)
+        if cached is not None:
+            return metadata_response(cached)
 
-        # If both files exist, skip the mint check
-        if os.path.exists(metadata_path) and os.path.exists(image_path):
+        logger.info(f"Reading metadata for token {token_id}")
+        # If both artifacts exist, skip the mint check
+        if token_stored(storage, token_id):
             try:
-                with open(metadata_path, "r") as f:
-                    metadata = json.load(f)
+                cached = metadata_cache.load(token_id, storage.get(metadata_key(token_id)))
                 logger.info(f"Metadata read successfully for token {token_id}")
-                return Response(json.dumps(metadata), mimetype="application/json")
+                return metadata_response(cached)
             except Exception as e:
                 logger.error(f"Error reading metadata for token {token_id}: {e}")
                 return jsonify({"error": "Failed to read metadata"}), 500
 
-        # Check if the token is minted
-        if not is_token_minted(token_id):
-            return jsonify({"error": f"Token {token_id} is not minted"}), 404
-
-        
-
         # Generate metadata if missing
-        if not os.path.exists(metadata_path):
-            try:
-                logger.info(f"Generating new image and metadata for token {token_id}")
-                # Query the blockchain for token data
-                contract = get_web3_contract()
-                token_data = contract.functions.getTokenData(token_id).call()
-                seed, period_id, extraMints, curveSteepness, maxRebate = token_data
-                generate_image(token_id, period_id, seed, extraMints, curveSteepness, maxRebate, OUTPUT_DIR)
-                
-                # Refresh OpenSea metadata after generating NEW image
-                logger.info(f"New image generated for token {token_id}, triggering OpenSea refresh")
-                refresh_opensea_metadata(token_id)
-                
-            except Exception as e:
-                logger.error(f"Error generating image for token {token_id}: {e}")
-                return jsonify({"error": "Failed to generate metadata"}), 500
+        try:
+            if not ensure_token_generated(token_id, client_address()):
+                return not_minted_response(token_id)
+        except RateLimited as e:
+            return rate_limited_response(e.retry_after)
+        except (RenderQueueFull, BrokenProcessPool) as e:
+            logger.warning(f"Shedding generation of token {token_id}: {e}")
+            return busy_response("Server busy, retry shortly")
+        except TimeoutError as e:
+            logger.warning(f"Timed out waiting for generation of token {token_id}: {e}")
+            return busy_response("Generation in progress, retry shortly")
+        except Exception as e:
+            logger.error(f"Error generating image for token {token_id}: {e}")
+            return jsonify({"error": "Failed to generate metadata"}), 500
 
-        # Return metadata
+        # Return metadata, from memory when this worker just generated it
         try:
-            with open(metadata_path, "r") as f:
-                metadata = json.load(f)
-                logger.info(f"Metadata read successfully AFTER GENERATION for token {token_id}")
-            return Response(json.dumps(metadata), mimetype="application/json")
+            cached = metadata_cache.get(token_id)
+            if cached is None:
+                rendered = pending_token(token_id)
+                if rendered is not None:
+                    cached = metadata_cache.put(token_id, serialize_metadata(rendered.metadata))
+                else:
+                    cached = metadata_cache.load(token_id, storage.get(metadata_key(token_id)))
+            logger.info(f"Metadata read successfully AFTER GENERATION for token {token_id}")
+            return metadata_response(cached)
         except Exception as e:
             logger.error(f"Error reading metadata for token {token_id}: {e}")
             return jsonify({"error": "Failed to read metadata"}), 500
@@ -208,98 +327,251 @@ def get_nft_metadata(token_id):
         return jsonify({"error": str(e)}), 500
 
 @app.route("/image/<int:token_id>", methods=["GET"])
-#@limiter.limit("60 per minute")
 def get_nft_image(token_id):
     logger.info(f"Reading image for token {token_id}")
+    # The variant the client asked for (?size=, ?format= or Accept), checked before any generation
     try:
-        # Image path
-        image_path = os.path.join(OUTPUT_DIR, f"{token_id}.png")
-        metadata_path = os.path.join(OUTPUT_DIR, f"{token_id}.json")
-
-        # If both files exist, skip the mint check
-        if os.path.exists(image_path):
+        size, fmt = negotiate_variant(request)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        # If the image exists, skip the mint check
+        if storage.exists(image_key(token_id)):
             logger.info(f"Image read successfully for token {token_id}")
-            return send_file(image_path, mimetype="image/png")
-
-        # Check if the token is minted
-        if not is_token_minted(token_id):
-            return jsonify({"error": f"Token {token_id} is not minted"}), 404
-
-        
+            return image_response(token_id, size, fmt)
 
         # Generate image if missing
-        if not os.path.exists(image_path):
-            try:
-                logger.info(f"Generating new image for token {token_id}")
-                # Query the blockchain for token data
-                contract = get_web3_contract()
-                token_data = contract.functions.getTokenData(token_id).call()
-                seed, period_id, extraMints, curveSteepness, maxRebate = token_data
-                generate_image(token_id, period_id, seed, extraMints, curveSteepness, maxRebate, OUTPUT_DIR)
-                
-                # Refresh OpenSea metadata after generating NEW image
-                logger.info(f"New image generated for token {token_id}, triggering OpenSea refresh")
-                refresh_opensea_metadata(token_id)
-                
-            except Exception as e:
-                logger.error(f"Error generating image for token {token_id}: {e}")
-                return jsonify({"error": "Failed to generate image"}), 500
+        try:
+            if not ensure_token_generated(token_id, client_address()):
+                return not_minted_response(token_id)
+        except RateLimited as e:
+            return rate_limited_response(e.retry_after)
+        except (RenderQueueFull, BrokenProcessPool) as e:
+            logger.warning(f"Shedding generation of token {token_id}: {e}")
+            return busy_response("Server busy, retry shortly")
+        except TimeoutError as e:
+            logger.warning(f"Timed out waiting for generation of token {token_id}: {e}")
+            return busy_response("Generation in progress, retry shortly")
+        except Exception as e:
+            logger.error(f"Error generating image for token {token_id}: {e}")
+            return jsonify({"error": "Failed to generate image"}), 500
         logger.info(f"Image read successfully AFTER GENERATION for token {token_id}")
-        return send_file(image_path, mimetype="image/png")
+        return image_response(token_id, size, fmt)
+    except (RenderQueueFull, BrokenProcessPool) as e:
+        # Variant encodes share the render queue
+        logger.warning(f"Shedding variant encode for token {token_id}: {e}")
+        return busy_response("Server busy, retry shortly")
+    except TimeoutError as e:
+        logger.warning(f"Timed out waiting for a variant of token {token_id}: {e}")
+        return busy_response("Encoding in progress, retry shortly")
     except Exception as e:
         logger.error(f"Unexpected error for token {token_id}: {e}")
         return jsonify({"error": str(e)}), 500
 
+def stored_metadata(token_id):
+    """Response bytes of a generated token's metadata, or None if it was never generated.
+
+    Bulk reads are not added to the metadata cache, so a crawl cannot evict hot tokens.
+    """
+    cached = metadata_cache.get(token_id)
+    if cached is not None:
+        return cached.body
+    rendered = pending_token(token_id)
+    if rendered is not None:
+        return serialize_metadata(rendered.metadata)
+    data = storage.get(metadata_key(token_id))
+    return serialize_metadata(json.loads(data)) if data is not None else None
+
+_newest_token = (0.0, None)  # (monotonic time of the chain lookup, newest token ID)
+
+def newest_token_id():
+    """Highest token ID minted so far, from the index or (at most every BULK_HEAD_TTL) the chain."""
+    global _newest_token
+    looked_up, newest = _newest_token
+    if newest is None or time.monotonic() - looked_up > BULK_HEAD_TTL:
+        try:
+            with stage("rpc_lookup"):
+                newest = get_current_token_id() - 1
+            _newest_token = (time.monotonic(), newest)
+        except Exception as e:
+            logger.warning(f"Could not look up the newest token ID: {e}")
+    indexed = token_index.max_token_id()
+    if newest is None:
+        return indexed
+    return max(newest, indexed) if indexed is not None else newest
+
+def bulk_token_ids():
+    """Token IDs of a /bulk/metadata request in ascending order, resuming after ?cursor=."""
+    cursor = request.args.get("cursor", type=int)
+    if "ids" in request.args:
+        try:
+            ids = sorted({int(i) for i in request.args["ids"].split(",") if i.strip()})
+        except ValueError:
+            raise ValueError("ids must be a comma-separated list of token IDs")
+        if len(ids) > BULK_MAX_IDS:
+            raise ValueError(f"At most {BULK_MAX_IDS} ids per request")
+        if cursor is not None:
+            ids = [i for i in ids if i > cursor]
+        return iter(ids)
+    start = request.args.get("start", 0, type=int)
+    end = request.args.get("end", type=int)
+    if cursor is not None:
+        start = max(start, cursor + 1)
+    if end is None:
+        # Open-ended ranges stop at the newest token, so the last page has a null cursor
+        end = newest_token_id()
+        if end is None:
+            raise LookupError("Newest token ID unknown")
+    return iter(range(start, end + 1))
+
+def bulk_lines(token_ids, limit, generate, client=None):
+    """NDJSON lines for one page of tokens, ending with the cursor of the next page.
+
+    At most limit tokens are returned and limit * BULK_SCAN_FACTOR IDs examined, so
+    memory and time per page stay constant however large the requested range is.
+    """
+    returned = generated = scanned = 0
+    last = None
+    for token_id in token_ids:
+        if returned >= limit or scanned >= limit * BULK_SCAN_FACTOR:
+            break
+        body = stored_metadata(token_id)
+        if body is None and generate and generated < BULK_MAX_GENERATE:
+            try:
+                generated += 1
+                if ensure_token_generated(token_id, client):
+                    body = stored_metadata(token_id)
+            except (RateLimited, RenderQueueFull, BrokenProcessPool, TimeoutError) as e:
+                # Stop here and let the client resume from this token later (never a null cursor,
+                # which would end the crawl)
+                logger.warning(f"Bulk generation of token {token_id} deferred: {e}")
+                retry_after = math.ceil(e.retry_after) if isinstance(e, RateLimited) else RETRY_AFTER
+                yield json.dumps({"cursor": token_id - 1, "retry_after": retry_after}) + "\n"
+                return
+        scanned += 1
+        last = token_id
+        if body is not None:
+            returned += 1
+            yield b'{"token_id": %d, "metadata": %s}\n' % (token_id, body)
+    else:
+        # Every requested ID has been examined
+        last = None
+    yield json.dumps({"cursor": last}) + "\n"
+
+@app.route("/bulk/metadata", methods=["GET"])
+def get_bulk_metadata():
+    """Stream metadata of many tokens as NDJSON.
+
+    Select tokens with ?start=&end= (inclusive) or ?ids=1,2,3. Only generated
+    tokens are returned unless ?generate=1. Each page holds up to ?limit= tokens
+    and ends with {"cursor": N}; pass ?cursor=N with the same selection to get
+    the next page, until the cursor is null.
+    """
+    try:
+        token_ids = bulk_token_ids()
+        limit = min(max(request.args.get("limit", BULK_PAGE_SIZE, type=int), 1), BULK_MAX_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except LookupError as e:
+        logger.warning(f"Bulk metadata without an end: {e}")
+        return busy_response("Chain unavailable, retry shortly")
+    generate = request.args.get("generate", "0").lower() in ("1", "true", "yes")
+    return Response(stream_with_context(bulk_lines(token_ids, limit, generate, client_address())), mimetype="application/x-ndjson")
+
+# Set by cloudflared (and other proxies) on requests relayed from the internet
+TUNNEL_HEADERS = ("CF-Connecting-IP", "CF-Ray", "X-Forwarded-For", "Forwarded")
+
 def localhost_only(f):
     """Decorator to ensure requests only come from localhost"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if request.remote_addr not in ['127.0.0.1', 'localhost']:
+        # Tunnel traffic also arrives from 127.0.0.1, so proxied requests are refused too
+        tunneled = any(header in request.headers for header in TUNNEL_HEADERS)
+        if request.remote_addr not in ['127.0.0.1', '::1', 'localhost'] or tunneled:
             return jsonify({"error": "Access denied - localhost only"}), 403
         return f(*args, **kwargs)
     return decorated_function
 
+@app.route("/status/render", methods=["GET"])
+@localhost_only
+def render_status():
+    """Render queue depth and wait times of this worker."""
+    return jsonify(render_pool.stats())
+
+@app.route("/metrics", methods=["GET"])
+@localhost_only
+def metrics():
+    """Prometheus metrics of all workers and render processes."""
+    body, content_type = render_latest()
+    return Response(body, content_type=content_type)
+
+@app.route("/status/storage", methods=["GET"])
+@localhost_only
+def storage_status():
+    """Artifact storage backend and cache tiers of this worker."""
+    return jsonify(storage.stats())
+
+@app.route("/status/rate-limit", methods=["GET"])
+@localhost_only
+def rate_limit_status():
+    """Rate limiter counters of this worker."""
+    return jsonify(rate_limiter.stats())
+
+@app.route("/status/profiler", methods=["GET", "POST"])
+@localhost_only
+def profiler_status():
+    """Profiler settings and recent profiles; POST enabled, threshold_ms or sample_rate to change them."""
+    if request.method == "POST":
+        settings = request.get_json(silent=True) or request.form or request.args
+        try:
+            enabled = settings.get("enabled")
+            profiler.configure(
+                enabled=None if enabled is None else str(enabled).lower() in ("1", "true", "yes", "on"),
+                threshold_ms=settings.get("threshold_ms"),
+                sample_rate=settings.get("sample_rate"),
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": f"Invalid profiler settings: {e}"}), 400
+    status = profiler.stats()
+    status["profiles"] = profiler.profiles()[:request.args.get("limit", 20, type=int)]
+    return jsonify(status)
+
+@app.route("/status/profiler/<name>", methods=["GET"])
+@localhost_only
+def profiler_profile(name):
+    """One stored profile in collapsed-stack format (feed it to flamegraph.pl or speedscope)."""
+    path = profiler.profile_path(name)
+    if path is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_file(path, mimetype="text/plain")
+
 # Test endpoint for stress testing
 @app.route("/test/generate/<int:token_id>", methods=["GET"])
 @localhost_only
 def test_generate(token_id):
-    """Test endpoint that bypasses web3 checks and uses temporary directory"""
+    """Test endpoint that bypasses web3 checks and renders in memory only"""
     try:
         logger.info(f"Test generating token {token_id}")
-        
-        # Create temporary directory for this request
-        temp_dir = tempfile.mkdtemp(prefix=f'chanclas_test_{token_id}_')
-        try:
-            # Generate with test parameters
-            period = 0  # Use period 0 for testing
-            nft_seed = token_id  # Use token_id as seed for consistency
-            extraMints = 0
-            curveSteepness = 1
-            maxRebate = 0
-            
-            # Generate image
-            image_path, metadata_path = generate_image(
-                token_id=token_id,
-                period=period,
-                nft_seed=nft_seed,
-                extraMints=extraMints,
-                curveSteepness=curveSteepness,
-                maxRebate=maxRebate,
-                output_dir=temp_dir
-            )
-            
-            # Read metadata
-            with open(metadata_path, "r") as f:
-                metadata = json.load(f)
-            
-            # Send response
-            return Response(json.dumps(metadata), mimetype="application/json")
-            
-        finally:
-            # Clean up temporary directory
-            import shutil
-            shutil.rmtree(temp_dir)
-            
+
+        # Generate with test parameters
+        period = 0  # Use period 0 for testing
+        nft_seed = token_id  # Use token_id as seed for consistency
+        extraMints = 0
+        curveSteepness = 1
+        maxRebate = 0
+
+        # Generate image and metadata without writing anything
+        rendered = render_pool.run(render_token, token_id, period, nft_seed, extraMints, curveSteepness, maxRebate)
+
+        # Send response
+        return Response(serialize_metadata(rendered.metadata), mimetype="application/json")
+
+    except (RenderQueueFull, BrokenProcessPool) as e:
+        logger.warning(f"Shedding test generation of token {token_id}: {e}")
+        return busy_response("Server busy, retry shortly")
+    except TimeoutError as e:
+        logger.warning(f"Timed out waiting for test generation of token {token_id}: {e}")
+        return busy_response("Generation in progress, retry shortly")
     except Exception as e:
         logger.error(f"Error in test generation for token {token_id}: {e}")
         return jsonify({"error": str(e)}), 500
@@ -310,36 +582,26 @@ def test_image(token_id):
     """Test endpoint for getting generated image"""
     try:
         logger.info(f"Test getting image for token {token_id}")
-        
-        # Create temporary directory for this request
-        temp_dir = tempfile.mkdtemp(prefix=f'chanclas_test_{token_id}_')
-        try:
-            # Generate with test parameters
-            period = 0  # Use period 0 for testing
-            nft_seed = token_id  # Use token_id as seed for consistency
-            extraMints = 0
-            curveSteepness = 1
-            maxRebate = 0
-            
-            # Generate image
-            image_path, _ = generate_image(
-                token_id=token_id,
-                period=period,
-                nft_seed=nft_seed,
-                extraMints=extraMints,
-                curveSteepness=curveSteepness,
-                maxRebate=maxRebate,
-                output_dir=temp_dir
-            )
-            
-            # Send image
-            return send_file(image_path, mimetype="image/png")
-            
-        finally:
-            # Clean up temporary directory
-            import shutil
-            shutil.rmtree(temp_dir)
-            
+
+        # Generate with test parameters
+        period = 0  # Use period 0 for testing
+        nft_seed = token_id  # Use token_id as seed for consistency
+        extraMints = 0
+        curveSteepness = 1
+        maxRebate = 0
+
+        # Generate image without writing anything
+        rendered = render_pool.run(render_token, token_id, period, nft_seed, extraMints, curveSteepness, maxRebate)
+
+        # Send image
+        return Response(rendered.png, mimetype="image/png")
+
+    except (RenderQueueFull, BrokenProcessPool) as e:
+        logger.warning(f"Shedding test image of token {token_id}: {e}")
+        return busy_response("Server busy, retry shortly")
+    except TimeoutError as e:
+        logger.warning(f"Timed out waiting for test image of token {token_id}: {e}")
+        return busy_response("Generation in progress, retry shortly")
     except Exception as e:
         logger.error(f"Error in test image for token {token_id}: {e}")
         return jsonify({"error": str(e)}), 500
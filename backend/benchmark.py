@@ -0,0 +1,360 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from PIL import Image, ImageDraw
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+# Fixtures are kept here between runs, one workspace per canvas size
+WORKSPACE_ROOT = os.path.join(tempfile.gettempdir(), "chanclas_bench")
+CANVAS_SIZE = 1024
+MICRO_REPEAT = 50
+ENDPOINT_REPEAT = 30
+REGRESSION_THRESHOLD = 0.10  # Median slowdown reported as a regression
+
+# Where each layer's artwork sits on the canvas, as (left, top, right, bottom) fractions
+LAYER_REGIONS = {
+    "02_Quad_UL": (0.05, 0.05, 0.45, 0.45),
+    "03_Quad_UR": (0.55, 0.05, 0.95, 0.45),
+    "04_Quad_DL": (0.05, 0.55, 0.45, 0.95),
+    "05_Quad_DR": (0.55, 0.55, 0.95, 0.95),
+    "06_Base": (0.25, 0.45, 0.75, 0.95),
+    "07_ToeGuards": (0.25, 0.80, 0.75, 0.95),
+    "08_Hats": (0.30, 0.10, 0.70, 0.35),
+    "09_Eyewear": (0.32, 0.30, 0.68, 0.42),
+}
+
+
+def fixture_layer(layer, name, size):
+    """A synthetic layer: opaque for backgrounds, otherwise translucent shapes in
+    the layer's usual region on a transparent canvas, like the real artwork."""
+    rng = random.Random(f"{layer}/{name}")
+    colour = tuple(rng.randrange(256) for _ in range(3))
+    if layer not in LAYER_REGIONS:
+        image = Image.new("RGBA", (size, size), colour + (255,))
+        draw = ImageDraw.Draw(image)
+        for _ in range(20):
+            x, y = rng.randrange(size), rng.randrange(size)
+            draw.ellipse((x, y, x + size // 8, y + size // 8), fill=tuple(rng.randrange(256) for _ in range(3)) + (255,))
+        return image
+
+    image = Image.new("RGBA", (size, size))
+    draw = ImageDraw.Draw(image)
+    left, top, right, bottom = (int(edge * size) for edge in LAYER_REGIONS[layer])
+    draw.rectangle((left, top, right, bottom), fill=colour + (255,))
+    for _ in range(12):
+        x, y = rng.randrange(left, right), rng.randrange(top, bottom)
+        radius = rng.randrange(size // 64, size // 12)
+        fill = tuple(rng.randrange(256) for _ in range(3)) + (rng.choice((96, 160, 255)),)
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=fill)
+    return image
+
+
+def make_fixtures(workspace, size=CANVAS_SIZE):
+    """Build a workspace with synthetic layers for every file named in the real
+    rarities files, plus the rarities and ABI the backend expects to find."""
+    from generate import directories
+
+    marker = os.path.join(workspace, ".fixtures")
+    if os.path.exists(marker):
+        return
+    os.makedirs(workspace, exist_ok=True)
+    shutil.copytree(os.path.join(BACKEND_DIR, "rarities"), os.path.join(workspace, "rarities"), dirs_exist_ok=True)
+    shutil.copy(os.path.join(BACKEND_DIR, "Chanclas_ABI.json"), workspace)
+
+    files = {layer: set() for layer in directories}
+    for name in sorted(os.listdir(os.path.join(BACKEND_DIR, "rarities"))):
+        with open(os.path.join(BACKEND_DIR, "rarities", name), "r") as f:
+            for layer, options in json.load(f).items():
+                names = {item["file"] for item in options if item["file"] != "EMPTY"}
+                files.setdefault(layer, set()).update(names)
+                # ToeGuards are not in the rarities files, they always follow the Base
+                if layer == "06_Base":
+                    files["07_ToeGuards"].update(names)
+
+    count = 0
+    for layer, names in files.items():
+        directory = os.path.join(workspace, directories.get(layer, f"./layers/{layer}/"))
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(names):
+            fixture_layer(layer, name, size).save(os.path.join(directory, name))
+            count += 1
+    with open(marker, "w") as f:
+        f.write(str(size))
+    logger.info(f"Generated {count} fixture layers of {size}x{size} in {workspace}")
+
+
+def measure(fn, repeat, warmup=2):
+    """Call fn() warmup + repeat times and return the timed durations in seconds."""
+    for i in range(warmup):
+        fn(i)
+    samples = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        fn(warmup + i)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "n": len(samples),
+        "median_ms": round(statistics.median(ordered) * 1000, 4),
+        "p90_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))] * 1000, 4),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 4),
+        "min_ms": round(ordered[0] * 1000, 4),
+    }
+
+
+def micro_benchmarks(repeat=MICRO_REPEAT):
+    """Time each stage of generate.py on its own."""
+    import rarity
+    import generate
+    from compositor import get_compositor, COMPOSITORS
+    from layer_cache import layer_paths_by_weight
+    from storage import LocalStorage
+
+    results = {}
+    paths = layer_paths_by_weight(generate.directories)
+
+    def load_rarities_cold(i):
+        rarity._rarities.clear()
+        rarity.load_rarities(0)
+    results["load_rarities_cold"] = measure(load_rarities_cold, repeat)
+    results["load_rarities_warm"] = measure(lambda i: rarity.load_rarities(0), repeat)
+
+    def compile_rarity_cold(i):
+        rarity.compile_rarity.cache_clear()
+        rarity.compile_rarity(0, (i % 50) / 100.0)
+    results["compile_rarity_cold"] = measure(compile_rarity_cold, repeat)
+
+    def decode(i):
+        with Image.open(paths[i % len(paths)]) as layer_image:
+            return layer_image.convert("RGBA")
+    results["layer_decode"] = measure(decode, repeat)
+
+    # Fixed random stacks, the same for every compositor
+    rng = random.Random(0)
+    paths_by_layer = [
+        [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith(".png")]
+        for directory in generate.directories.values() if os.path.isdir(directory)
+    ]
+    decoded = {path: decode(paths.index(path)) for path in paths}
+    stacks = [[decoded[rng.choice(layer_paths)] for layer_paths in paths_by_layer if layer_paths]
+              for _ in range(repeat + 2)]
+    for name in COMPOSITORS:
+        compositor = get_compositor(name)
+        prepared = [[compositor.prepare(image) for image in stack] for stack in stacks]
+        results[f"composite_{name}"] = measure(lambda i: compositor.composite(prepared[i]), repeat)
+
+    generate.preload_layers()
+    results["randomizing"] = measure(
+        lambda i: generate.randomizing(i, i * 7919, 0, (i % 50) / 100.0, generate.directories), repeat)
+
+    composed = [generate.randomizing(i, i * 7919, 0, 0.0, generate.directories)[0] for i in range(repeat + 2)]
+    results["png_encode"] = measure(lambda i: composed[i].save(io.BytesIO(), format="PNG"), repeat)
+
+    rendered = [generate.render_token(i, 0, i * 7919, i % 7, 1 + i % 3, (i % 5) * 10) for i in range(repeat + 2)]
+    results["render_token"] = measure(lambda i: generate.render_token(i, 0, i * 7919, i % 7, 1 + i % 3, (i % 5) * 10), repeat)
+    output_dir = tempfile.mkdtemp(prefix="chanclas_bench_out_")
+    try:
+        storage = LocalStorage(output_dir)
+        results["save_token"] = measure(lambda i: generate.save_token(rendered[i], storage), repeat)
+    finally:
+        shutil.rmtree(output_dir)
+
+    return {name: summarize(samples) for name, samples in results.items()}
+
+
+def wait_for_writes(api):
+    """Block until write-behind has put every rendered token on disk."""
+    with api.pending_lock:
+        futures = [future for _, future in api.pending_writes.values()]
+    for future in futures:
+        future.result()
+
+
+def endpoint_benchmarks(repeat=ENDPOINT_REPEAT):
+    """Time API requests end to end against the in-process app and a stub RPC."""
+    from stub_rpc import StubChain, start_stub_rpc
+
+    chain_stub = StubChain()
+    url, server = start_stub_rpc(chain_stub)
+    import chain
+    import api
+    from rate_limit import RateLimiter, Budget
+
+    chain.provider_pool.endpoints = [chain.Endpoint(url)]
+    # Benchmarks measure serving, not limiting; no Redis either
+    api.rate_limiter = RateLimiter({"default": Budget(1e9, 1e9), "cold": Budget(1e9, 1e9)}, sync_interval=None)
+    api.render_pool.wait_ready()
+    client = api.app.test_client()
+    local = {"REMOTE_ADDR": "127.0.0.1"}
+    results = {}
+
+    def get(path, expected=200, **kwargs):
+        response = client.get(path, **kwargs)
+        if response.status_code != expected:
+            raise RuntimeError(f"GET {path} returned {response.status_code}, expected {expected}")
+        return response
+
+    cold_ids = iter(range(1000, chain_stub.minted))
+    results["id_cold"] = measure(lambda i: get(f"/id/{next(cold_ids)}"), repeat)
+    results["image_cold"] = measure(lambda i: get(f"/image/{next(cold_ids)}"), repeat)
+    wait_for_writes(api)
+
+    # Every variant the warm benchmarks ask for is encoded once up front
+    for token_id in range(1000, 1000 + repeat):
+        get(f"/image/{token_id}?size=256&format=webp")
+    results["id_warm"] = measure(lambda i: get("/id/1000"), repeat)
+
+    def id_disk(i):
+        api.metadata_cache.invalidate(1000 + i % repeat)
+        get(f"/id/{1000 + i % repeat}")
+    results["id_disk"] = measure(id_disk, repeat)
+
+    results["image_png_warm"] = measure(lambda i: get(f"/image/{1000 + i % repeat}"), repeat)
+    results["image_webp_thumb_warm"] = measure(lambda i: get(f"/image/{1000 + i % repeat}?size=256&format=webp"), repeat)
+    etag = get("/image/1000").headers["ETag"]
+    results["image_not_modified"] = measure(lambda i: get("/image/1000", 304, headers={"If-None-Match": etag}), repeat)
+
+    unminted_ids = iter(range(chain_stub.minted, chain_stub.minted + 10 * repeat))
+    results["unminted_probe"] = measure(lambda i: get(f"/id/{next(unminted_ids)}", 404), repeat)
+    results["unminted_cached"] = measure(lambda i: get(f"/id/{chain_stub.minted}", 404), repeat)
+    results["bulk_metadata_50"] = measure(lambda i: get("/bulk/metadata?start=1000&end=1059&limit=50").data, repeat)
+    results["test_generate"] = measure(lambda i: get(f"/test/generate/{i}", environ_base=local), repeat)
+
+    api.flush_writes()
+    api.render_pool.shutdown()
+    server.shutdown()
+    return {name: summarize(samples) for name, samples in results.items()}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    workspace = os.path.join(args.workspace, str(args.size))
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(BACKEND_DIR)
+    make_fixtures(workspace, args.size)
+
+    # The backend resolves layers, rarities and its databases relative to the working directory
+    os.chdir(workspace)
+    for name in ("output", "token_index.db", "opensea_queue.db"):
+        path = os.path.join(workspace, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+    if args.atlas:
+        # Built before generate is imported here, which maps the atlas at import time
+        subprocess.run([sys.executable, os.path.join(BACKEND_DIR, "layer_atlas.py")], check=True)
+    else:
+        for path in ("layers.atlas", "layers.atlas.json"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "canvas_size": args.size,
+            "compositor": os.getenv("COMPOSITOR", "numpy"),
+            "atlas": args.atlas,
+        },
+        "results": {},
+    }
+    if args.suite in ("all", "micro"):
+        logger.info("Running micro-benchmarks")
+        report["results"].update({f"micro.{k}": v for k, v in micro_benchmarks(args.repeat or MICRO_REPEAT).items()})
+    if args.suite in ("all", "endpoints"):
+        logger.info("Running endpoint benchmarks")
+        report["results"].update(
+            {f"endpoint.{k}": v for k, v in endpoint_benchmarks(args.repeat or ENDPOINT_REPEAT).items()})
+
+    for name, summary in report["results"].items():
+        logger.info(f"{name:40} median {summary['median_ms']:10.3f} ms  p90 {summary['p90_ms']:10.3f} ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Results written to {args.output}")
+    return 0
+
+
+def compare(args):
+    """Compare medians of two result files; exit 1 if any benchmark got slower than the threshold."""
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    with open(args.current, "r") as f:
+        current = json.load(f)
+
+    for key in ("canvas_size", "compositor", "atlas", "cpu_count"):
+        if baseline["meta"].get(key) != current["meta"].get(key):
+            logger.warning(f"Runs differ in {key}: {baseline['meta'].get(key)} vs {current['meta'].get(key)}")
+    logger.info(f"Comparing {baseline['meta'].get('commit')} with {current['meta'].get('commit')}")
+
+    regressions = 0
+    logger.info(f"{'benchmark':40} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name in sorted(set(baseline["results"]) | set(current["results"])):
+        before, after = baseline["results"].get(name), current["results"].get(name)
+        if before is None or after is None:
+            logger.info(f"{name:40} {'only in ' + ('current' if before is None else 'baseline'):>34}")
+            continue
+        change = after["median_ms"] / before["median_ms"] - 1 if before["median_ms"] else 0.0
+        flag = ""
+        if change > args.threshold:
+            regressions += 1
+            flag = "  REGRESSION"
+        logger.info(f"{name:40} {before['median_ms']:12.3f} {after['median_ms']:12.3f} {change:+8.1%}{flag}")
+    logger.info(f"{regressions} regressions above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the generation pipeline and API on synthetic layers")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run benchmarks and optionally write JSON results")
+    run_parser.add_argument("--suite", choices=("all", "micro", "endpoints"), default="all")
+    run_parser.add_argument("--size", type=int, default=CANVAS_SIZE, help="Fixture canvas size in pixels")
+    run_parser.add_argument("--repeat", type=int, help="Timed iterations per benchmark")
+    run_parser.add_argument("--atlas", action="store_true", help="Serve layers from a layer atlas")
+    run_parser.add_argument("--workspace", default=WORKSPACE_ROOT, help="Where fixtures are generated and kept")
+    run_parser.add_argument("--output", "-o", help="Write results as JSON to this file")
+
+    compare_parser = commands.add_parser("compare", help="Compare two JSON result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                                help="Median slowdown counted as a regression (default 0.10)")
+
+    args = parser.parse_args()
+    return run(args) if args.command == "run" else compare(args)
+
+
+if __name__ == "__main__":
+    # Per-request INFO logs of the backend would drown the results
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    sys.exit(main())
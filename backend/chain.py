@@ -0,0 +1,246 @@
+from web3 import Web3
+from web3.exceptions import ContractLogicError
+import os
+import json
+import time
+import random
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import RPC_REQUESTS, RPC_SECONDS, rpc_label
+
+logger = logging.getLogger(__name__)
+
+# Web3 configuration
+CONTRACT_ADDRESS = "0x262cA2E567315300CDdf389A0D2E37212F4DAEF4"  # Contract address
+
+# RPC URLs ordered by speed (fastest first)
+RPC_URLS = [
+    "https://base-rpc.publicnode.com", 
+    "https://base-mainnet.public.blastapi.io",  
+    "wss://0xrpc.io/base", 
+    "https://base.blockpi.network/v1/rpc/public",
+    "https://developer-access-mainnet.base.org",  
+    "https://mainnet.base.org",  
+    "https://base-pokt.nodies.app", 
+    "https://base.lava.build",  
+    "https://base.api.onfinality.io/public", 
+    "https://endpoints.omniatech.io/v1/base/mainnet/public", 
+    "https://0xrpc.io/base", 
+    "https://base.meowrpc.com",  
+    "https://rpc.therpc.io/base", 
+    "https://rpc.owlracle.info/base/70d38ce1826c4a60bb2a8e05a6c8b20f", 
+    "https://base.drpc.org", 
+    "https://base.rpc.subquery.network/public",  
+    "https://base.llamarpc.com", 
+    "https://api.zan.top/base-mainnet", 
+]
+# Comma-separated override, e.g. a local stub_rpc.py for load tests
+if os.getenv("RPC_URLS"):
+    RPC_URLS = [url.strip() for url in os.getenv("RPC_URLS").split(",") if url.strip()]
+
+# Load the contract ABI
+with open("Chanclas_ABI.json", "r") as f:
+    CONTRACT_ABI = json.load(f)
+
+# Provider pool tuning
+RPC_TIMEOUT = 10  # Seconds per RPC request
+RPC_MAX_ATTEMPTS = 4  # Endpoints tried per call before giving up
+EWMA_ALPHA = 0.2  # Weight of the newest sample in latency/error averages
+BREAKER_FAILURES = 3  # Consecutive failures that open an endpoint's circuit
+BREAKER_COOLDOWN = 30  # Seconds before a quarantined endpoint gets a trial call
+BREAKER_MAX_COOLDOWN = 600
+
+
+class Endpoint:
+    """One RPC endpoint with a persistent session, cached contract and health stats."""
+
+    def __init__(self, url):
+        self.url = url
+        self.label = rpc_label(url)  # Metrics label, without any API key in the path
+        self.latency = None  # EWMA seconds, None until the first sample
+        self.error_rate = 0.0  # EWMA of failures (0..1)
+        self.failures = 0  # Consecutive failures
+        self.open_until = 0.0  # Quarantined until this monotonic time
+        self.cooldown = BREAKER_COOLDOWN
+        self.trial = False  # A half-open trial call is in progress
+        self._session = None
+        self._contract = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=16)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._session = session
+        return self._session
+
+    @property
+    def contract(self):
+        if self._contract is None:
+            provider = Web3.HTTPProvider(
+                self.url,
+                request_kwargs={"timeout": RPC_TIMEOUT},
+                session=self.session,
+                exception_retry_configuration=None,  # The pool fails over instead
+            )
+            web3 = Web3(provider)
+            # Read-only use: skip the per-call eth_chainId lookup of the validation middleware
+            web3.middleware_onion.remove("validation")
+            self._contract = web3.eth.contract(address=CONTRACT_ADDRESS, abi=CONTRACT_ABI)
+        return self._contract
+
+    def score(self):
+        """Lower is better: expected latency plus a timeout's worth per recent error."""
+        latency = self.latency if self.latency is not None else 0.0
+        return latency + self.error_rate * RPC_TIMEOUT
+
+
+class ProviderPool:
+    """Long-lived pool of RPC endpoints that routes calls to the fastest healthy one.
+
+    Each endpoint keeps an EWMA of latency and error rate. Calls go to the better of
+    two random healthy endpoints (unmeasured endpoints win, so every endpoint gets
+    measured). After BREAKER_FAILURES consecutive failures an endpoint is quarantined
+    with exponential cooldown, then receives a single trial call before rejoining.
+    """
+
+    def __init__(self, urls):
+        self.endpoints = [Endpoint(url) for url in urls if url.startswith("http")]
+        self._lock = threading.Lock()
+        for url in urls:
+            if not url.startswith("http"):
+                logger.info(f"Skipping non-HTTP RPC endpoint {url}")
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        # Never share pooled connections with a forked child
+        self._lock = threading.Lock()
+        for endpoint in self.endpoints:
+            endpoint._session = None
+            endpoint._contract = None
+
+    def pick(self, exclude=()):
+        now = time.monotonic()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e not in exclude]
+            # A quarantined endpoint whose cooldown expired gets one trial call
+            for endpoint in candidates:
+                if endpoint.open_until and endpoint.open_until <= now and not endpoint.trial:
+                    endpoint.trial = True
+                    return endpoint
+            # Endpoints on trial rejoin only once their trial call succeeds
+            healthy = [e for e in candidates if e.open_until <= now and not e.trial]
+            if not healthy:
+                # Everything is quarantined: fall back to whichever recovers soonest
+                return min(candidates, key=lambda e: e.open_until) if candidates else None
+            if len(healthy) == 1:
+                return healthy[0]
+            first, second = random.sample(healthy, 2)
+            return first if first.score() <= second.score() else second
+
+    def _record(self, endpoint, elapsed, ok):
+        RPC_REQUESTS.labels(endpoint.label, "ok" if ok else "error").inc()
+        RPC_SECONDS.labels(endpoint.label).observe(elapsed)
+        with self._lock:
+            endpoint.trial = False
+            if endpoint.latency is None:
+                endpoint.latency = elapsed
+            else:
+                endpoint.latency += EWMA_ALPHA * (elapsed - endpoint.latency)
+            endpoint.error_rate += EWMA_ALPHA * ((0.0 if ok else 1.0) - endpoint.error_rate)
+            if ok:
+                endpoint.failures = 0
+                endpoint.open_until = 0.0
+                endpoint.cooldown = BREAKER_COOLDOWN
+                return
+            endpoint.failures += 1
+            if endpoint.failures >= BREAKER_FAILURES:
+                endpoint.open_until = time.monotonic() + endpoint.cooldown
+                logger.warning(f"Quarantining RPC {endpoint.url} for {endpoint.cooldown}s after {endpoint.failures} failures")
+                endpoint.cooldown = min(endpoint.cooldown * 2, BREAKER_MAX_COOLDOWN)
+
+    def call(self, fn):
+        """Run fn(contract) on the best endpoint, failing over to others on errors.
+
+        Contract reverts are answers, not endpoint failures, and are raised at once.
+        """
+        return self.call_endpoint(lambda endpoint: fn(endpoint.contract))
+
+    def call_endpoint(self, fn):
+        """Like call(), but fn receives the Endpoint itself (for raw JSON-RPC)."""
+        tried = []
+        last_error = None
+        for _ in range(min(RPC_MAX_ATTEMPTS, len(self.endpoints))):
+            endpoint = self.pick(tried)
+            if endpoint is None:
+                break
+            tried.append(endpoint)
+            start = time.monotonic()
+            try:
+                result = fn(endpoint)
+            except ContractLogicError:
+                self._record(endpoint, time.monotonic() - start, True)
+                raise
+            except Exception as e:
+                self._record(endpoint, time.monotonic() - start, False)
+                logger.warning(f"RPC call failed on {endpoint.url}: {e}")
+                last_error = e
+                continue
+            self._record(endpoint, time.monotonic() - start, True)
+            return result
+        raise last_error or RuntimeError("No RPC endpoints available")
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "url": e.url,
+                    "latency_ms": round(e.latency * 1000, 1) if e.latency is not None else None,
+                    "error_rate": round(e.error_rate, 3),
+                    "quarantined": e.open_until > now,
+                }
+                for e in self.endpoints
+            ]
+
+
+# Shared by every request in this process
+provider_pool = ProviderPool(RPC_URLS)
+
+def rpc_request(method, params):
+    """Send a raw JSON-RPC request through the provider pool and return its result."""
+    def send(endpoint):
+        payload = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params}
+        response = endpoint.session.post(endpoint.url, json=payload, timeout=RPC_TIMEOUT)
+        response.raise_for_status()
+        reply = response.json()
+        if "error" in reply:
+            raise RuntimeError(f"{method} failed: {reply['error']}")
+        return reply["result"]
+
+    return provider_pool.call_endpoint(send)
+
+def is_token_minted(token_id):
+    """Check if a token is minted by querying the owner."""
+    try:
+        provider_pool.call(lambda contract: contract.functions.ownerOf(token_id).call())
+        return True
+    except ContractLogicError:
+        # ownerOf reverts for tokens that do not exist
+        return False
+    except Exception as e:
+        logger.error(f"Error checking token {token_id}: {e}")
+        return False
+
+
+def get_token_data(token_id):
+    """Read (seed, period_id, extraMints, curveSteepness, maxRebate) for a token."""
+    return provider_pool.call(lambda contract: contract.functions.getTokenData(token_id).call())
+
+def get_current_token_id():
+    """Next token ID to be minted; every ID below it has been minted."""
+    return provider_pool.call(lambda contract: contract.functions.currentTokenId().call())
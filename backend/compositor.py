@@ -0,0 +1,242 @@
+import os
+import sys
+import random
+import logging
+import threading
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Compositing backend used by generate.py ("numpy" or "pil")
+COMPOSITOR = os.getenv("COMPOSITOR", "numpy")
+
+
+class PILCompositor:
+    """Reference backend: alpha-paste each layer onto the first with Pillow."""
+
+    name = "pil"
+
+    def prepare(self, image):
+        return image
+
+    def nbytes(self, layer):
+        return layer.width * layer.height * 4
+
+    def composite(self, layers):
+        base_image = None
+        for layer_image in layers:
+            if base_image is None:
+                base_image = layer_image.copy()
+            else:
+                base_image.paste(layer_image, (0, 0), layer_image)
+        return base_image
+
+
+class NumpyLayer:
+    """A layer cropped to its visible rectangle and pre-multiplied by its own alpha.
+
+    Every pixel outside the box (top, left, height, width) is (0, 0, 0, 0) in all
+    four channels. A paste leaves the destination unchanged wherever the source
+    alpha is 0, so only the box needs blending. The canvas size is kept to
+    rebuild the full frame when the layer is the bottom of a stack.
+    """
+
+    __slots__ = ("rgba", "premul", "inv_alpha", "top", "left", "canvas")
+
+    def __init__(self, image):
+        full = np.asarray(image, dtype=np.uint8)
+        self.canvas = full.shape[:2]
+        rows = np.flatnonzero(full.any(axis=(1, 2)))
+        cols = np.flatnonzero(full.any(axis=(0, 2)))
+        if rows.size:
+            self.top, self.left = int(rows[0]), int(cols[0])
+            self.rgba = np.ascontiguousarray(full[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1])
+        else:
+            # Fully transparent layer: nothing to blend
+            self.top = self.left = 0
+            self.rgba = full[:0, :0]
+        alpha = self.rgba[..., 3:4].astype(np.uint16)
+        # +128 is the rounding term of Pillow's divide-by-255
+        self.premul = self.rgba.astype(np.uint16) * alpha + 128
+        self.inv_alpha = 255 - alpha
+
+    @classmethod
+    def from_arrays(cls, top, left, canvas, rgba, premul, inv_alpha):
+        """Wrap already prepared arrays (e.g. views into a layer atlas)."""
+        layer = cls.__new__(cls)
+        layer.top, layer.left, layer.canvas = top, left, canvas
+        layer.rgba, layer.premul, layer.inv_alpha = rgba, premul, inv_alpha
+        return layer
+
+    @property
+    def box(self):
+        """Slices of the canvas covered by the layer."""
+        height, width = self.rgba.shape[:2]
+        return slice(self.top, self.top + height), slice(self.left, self.left + width)
+
+    @property
+    def nbytes(self):
+        return self.rgba.nbytes + self.premul.nbytes + self.inv_alpha.nbytes
+
+
+class NumpyCompositor:
+    """Vectorised backend producing the exact same pixels as PILCompositor.
+
+    Pillow blends every channel (alpha included) of a masked paste as
+    (dst * (255 - a) + src * a + 128) / 255 with an integer shift-divide. Layers
+    keep src * a + 128 and 255 - a precomputed, so each layer costs one multiply,
+    one add and the divide, all in uint16 (the sum never exceeds 65407). Only the
+    layer's bounding box is blended: with a = 0 the formula returns dst unchanged.
+    Working buffers are reused per thread and per canvas size.
+    """
+
+    name = "numpy"
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def prepare(self, image):
+        return NumpyLayer(image)
+
+    def nbytes(self, layer):
+        return layer.nbytes
+
+    def _buffers(self, shape):
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None or buffers[0].shape != shape:
+            buffers = (np.empty(shape, dtype=np.uint16), np.empty(shape, dtype=np.uint16))
+            self._local.buffers = buffers
+        return buffers
+
+    def composite(self, layers):
+        if not layers:
+            return None
+        base = layers[0]
+        out, acc = self._buffers(base.canvas + (4,))
+        if base.rgba.shape[:2] != base.canvas:
+            out.fill(0)
+        out[base.box] = base.rgba
+        for layer in layers[1:]:
+            if not layer.rgba.size:
+                continue
+            box = layer.box
+            dst, tmp = out[box], acc[box]
+            np.multiply(dst, layer.inv_alpha, out=tmp)
+            tmp += layer.premul
+            np.right_shift(tmp, 8, out=dst)
+            dst += tmp
+            dst >>= 8
+        return Image.fromarray(out.astype(np.uint8), "RGBA")
+
+
+def sparse_stats(layers):
+    """Fraction of canvas pixels the cropped layers actually store."""
+    stored = sum(layer.rgba.shape[0] * layer.rgba.shape[1] for layer in layers)
+    canvas = sum(layer.canvas[0] * layer.canvas[1] for layer in layers)
+    return stored / canvas if canvas else 0.0
+
+
+COMPOSITORS = {
+    PILCompositor.name: PILCompositor,
+    NumpyCompositor.name: NumpyCompositor,
+}
+
+
+def get_compositor(name=COMPOSITOR):
+    """Instantiate a compositing backend by name."""
+    if name not in COMPOSITORS:
+        raise ValueError(f"Unknown compositor '{name}', expected one of {sorted(COMPOSITORS)}")
+    return COMPOSITORS[name]()
+
+
+def edge_case_stacks(size=(64, 64)):
+    """Synthetic stacks covering the corners of the sparse representation: a
+    sparse bottom layer, fully transparent layers, single pixels on the canvas
+    edges and colour hidden under zero alpha."""
+    width, height = size
+    rng = random.Random(1)
+
+    def noise(alpha):
+        data = bytes(rng.randrange(256) if i % 4 < 3 else alpha(i // 4) for i in range(width * height * 4))
+        return Image.frombytes("RGBA", size, data)
+
+    opaque = noise(lambda i: 255)
+    translucent = noise(lambda i: rng.randrange(256))
+    blank = Image.new("RGBA", size)
+    hidden = noise(lambda i: 0)
+    corners = Image.new("RGBA", size)
+    for xy in ((0, 0), (width - 1, 0), (0, height - 1), (width - 1, height - 1)):
+        corners.putpixel(xy, (200, 10, 30, 128))
+    patch = Image.new("RGBA", size)
+    patch.paste(translucent.crop((0, 0, 9, 5)), (width // 3, height // 2))
+
+    return [
+        [opaque, patch, corners],
+        [patch, opaque, patch],
+        [corners, blank, patch],
+        [blank, blank],
+        [opaque, hidden, blank, translucent],
+        [hidden, corners],
+    ]
+
+
+def check_backends(paths_by_layer, samples=200, seed=0):
+    """Composite random layer stacks with every backend and compare against PIL.
+
+    The synthetic edge_case_stacks() are checked first. Returns the number of
+    stacks whose pixels differ from the reference.
+    """
+    rng = random.Random(seed)
+    reference = PILCompositor()
+    others = [COMPOSITORS[name]() for name in COMPOSITORS if name != reference.name]
+    decoded = {}
+    mismatches = 0
+
+    def compare(images, label):
+        if not images:
+            return 0
+        expected = reference.composite(images).tobytes()
+        differing = 0
+        for compositor in others:
+            result = compositor.composite([compositor.prepare(image) for image in images])
+            if result.tobytes() != expected:
+                differing += 1
+                logger.error(f"{compositor.name} differs from pil for stack {label}")
+        return differing
+
+    for index, images in enumerate(edge_case_stacks()):
+        mismatches += compare(images, f"edge case {index}")
+
+    for sample in range(samples):
+        stack = [rng.choice(paths) for paths in paths_by_layer if paths]
+        images = []
+        for path in stack:
+            if path not in decoded:
+                with Image.open(path) as layer_image:
+                    decoded[path] = layer_image.convert("RGBA")
+            images.append(decoded[path])
+        mismatches += compare(images, stack)
+
+    if decoded:
+        stored = sparse_stats([NumpyLayer(image) for image in decoded.values()])
+        logger.info(f"Cropped layers store {stored:.1%} of their full-canvas pixels")
+    return mismatches
+
+
+if __name__ == "__main__":
+    # Pixel-equality check of every backend against PIL using the real layers
+    logging.basicConfig(level=logging.INFO)
+    from generate import directories
+
+    paths_by_layer = [
+        [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith(".png")]
+        for directory in directories.values() if os.path.isdir(directory)
+    ]
+    if not any(paths_by_layer):
+        logger.error(f"No layers found in {', '.join(directories.values())}")
+        sys.exit(1)
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    mismatches = check_backends(paths_by_layer, samples)
+    logger.info(f"Checked {samples} layer stacks: {mismatches} mismatches")
+    sys.exit(1 if mismatches else 0)
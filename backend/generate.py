@@ -1,14 +1,28 @@
 import os
+import io
+import sys
 import json
+import hashlib
 import random
-from PIL import Image
 import re
+import time
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from layer_cache import LayerCache, LAYER_CACHE_MB, layer_paths_by_weight
+from compositor import get_compositor
+from layer_atlas import ATLAS_PATH, load_atlas
+from rarity import load_rarities, compile_rarity
+from metrics import stage, record_stage
+from storage import image_key, metadata_key, content_etag, atomic_write
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables from .env file
 load_dotenv()
 
-periods = [0]
+periods = (0,)
 
 # Define paths to directories
 directories = {
@@ -23,12 +37,18 @@ directories = {
     "09_Eyewear": "./layers/09_Eyewear/"
 }
 
-# Function to load rarities based on period
-def load_rarities(period):
-    #bypassing for now
-    with open(f"./rarities/rarities_4.json", "r") as f:
-        return json.load(f)
-    
+# Compositing backend and the decoded layers shared by every generation in this process.
+# Both are safe to use from any number of threads; nothing else here is shared between calls.
+compositor = get_compositor()
+# Layers packed by layer_atlas.py are mapped from disk instead of decoded per process
+layer_atlas = load_atlas(ATLAS_PATH, compositor)
+layer_cache = LayerCache(LAYER_CACHE_MB * 1024 * 1024, compositor, layer_atlas)
+
+# Function to decode the layers up front (called once per worker at startup)
+# Layers in the atlas are skipped, so with an up to date atlas this decodes nothing
+def preload_layers():
+    return layer_cache.preload(layer_paths_by_weight(directories))
+
 # Function to verify if files exist
 def verify_files_exist(period):
     rarities = load_rarities(period)
@@ -50,7 +70,28 @@ def verify_files_exist(period):
 
 
 
-def randomizing(token_id,nft_seed, rarity,d, directories, test = None):
+# Utility to format names (remove digits, dots, extensions, and replace `_`)
+def format_name(name):
+    # Remove file extension
+    name = name.replace('.png', '')
+
+    # Save any instances of 3D or 3d
+    has_3d = "3D" in name
+    has_3d_lowercase = "3d" in name
+
+    # Remove all digits and special characters
+    name = re.sub(r'[0-9.\-_]+', ' ', name)
+
+    # Restore 3D/3d if they were present
+    if has_3d:
+        name = name.replace('D', '3D', 1)
+    if has_3d_lowercase:
+        name = name.replace('d', '3D', 1)
+
+    # Clean up extra spaces and trim
+    return re.sub(r'\s+', ' ', name).strip()
+
+def randomizing(token_id,nft_seed, period,d, directories, test = None):
     
     # Retrieve the secret salt from the .env file
     secret_salt = os.getenv("NFT_SECRET_SALT", "default_salt_if_not_found")
@@ -58,8 +99,9 @@ def randomizing(token_id,nft_seed, rarity,d, directories, test = None):
     # Combine the token_id, nft_seed, and secret salt to create a unique seed
     combined_seed = f"{token_id}_{nft_seed}_{secret_salt}"
     
-    # Set the seed for determinism
-    random.seed(combined_seed)
+    # A private generator per call: same sequence as seeding the global one, but
+    # concurrent generations can no longer reseed each other
+    rng = random.Random(combined_seed)
 
 
     selected_layers = {}
@@ -75,54 +117,19 @@ def randomizing(token_id,nft_seed, rarity,d, directories, test = None):
    
     astronautBypass = False
 
-    # Utility to format names (remove digits, dots, extensions, and replace `_`)
-    def format_name(name):
-        # Remove file extension
-        name = name.replace('.png', '')
-        
-        # Save any instances of 3D or 3d
-        has_3d = "3D" in name
-        has_3d_lowercase = "3d" in name
-        
-        # Remove all digits and special characters
-        name = re.sub(r'[0-9.\-_]+', ' ', name)
-        
-        # Restore 3D/3d if they were present
-        if has_3d:
-            name = name.replace('D', '3D', 1)
-        if has_3d_lowercase:
-            name = name.replace('d', '3D', 1)
-            
-        # Clean up extra spaces and trim
-        return re.sub(r'\s+', ' ', name).strip()
-
-    # Select layers based on rarity and exclusions
-    for layer, options in rarity.items():
-
-        # Adjust weights based on d
-        adjusted_options = []
-        for item in options:
-            original_weight = item['weight']
-            if original_weight <= 0:
-                adjusted_weight = 0.0
-            else:
-                adjusted_weight = original_weight ** (-d)
-            # Create a new item with adjusted weight
-            adjusted_item = item.copy()
-            adjusted_item['weight'] = adjusted_weight
-            adjusted_options.append(adjusted_item)
-        
+    # Select layers based on rarity and exclusions (weights are already adjusted by d)
+    started = time.perf_counter()
+    for layer, sampler in compile_rarity(period, d).items():
+
         formatted_layer = format_name(layer)  # Format layer name
-        print("Layer:", formatted_layer)
+        logger.debug(f"Layer: {formatted_layer}")
         if test is not None:
             if layer == "01_Background" or layer == "02_Quad_UL" or layer == "03_Quad_UR" or layer == "04_Quad_DL" or layer == "05_Quad_DR":
                 continue
         
         # Special handling for 06_Base and 07_ToeGuards
         if layer == "06_Base":
-            choices = [item['file'] for item in adjusted_options]
-            weights = [item['weight'] for item in adjusted_options]
-            selected_base = random.choices(choices, weights=weights, k=1)[0]
+            selected_base = sampler.choice(rng)
             selected_layers[layer] = selected_base
             selected_layers["07_ToeGuards"] = selected_base  # Ensure matching ToeGuard
 
@@ -142,9 +149,7 @@ def randomizing(token_id,nft_seed, rarity,d, directories, test = None):
             continue
             
         # Regular layers
-        choices = [item['file'] for item in adjusted_options]
-        weights = [item['weight'] for item in adjusted_options]
-        selected = random.choices(choices, weights=weights, k=1)[0]
+        selected = sampler.choice(rng)
 
         # Handle EMPTY exclusions
         if layer in ["08_Hats", "09_Eyewear"] and "EMPTY" in selected:
@@ -161,40 +166,84 @@ def randomizing(token_id,nft_seed, rarity,d, directories, test = None):
         if layer == "08_Hats" and "Astronaut" in selected:
             astronautBypass = True
 
+    record_stage("select_traits", started)
+
     # Combine layers into a final image
-    base_image = None
-    for layer, file_name in selected_layers.items():
-        if layer is not None:
-            with Image.open(os.path.join(directories[layer], file_name)) as layer_image:  # Use context manager
-                layer_image = layer_image.convert("RGBA")
-                if base_image is None:
-                    base_image = layer_image.copy()
-                else:
-                    base_image.paste(layer_image, (0, 0), layer_image)
-                layer_image.close()  # Explicit cleanup
+    started = time.perf_counter()
+    layer_stack = [
+        layer_cache.get(os.path.join(directories[layer], file_name))  # Shared, do not modify
+        for layer, file_name in selected_layers.items()
+        if layer is not None
+    ]
+    record_stage("layer_load", started)
+    with stage("composite"):
+        base_image = compositor.composite(layer_stack)
 
     return base_image, metadata
 
-# Function to generate a single image
-def generate_image(token_id, period, nft_seed, extraMints, curveSteepness, maxRebate, output_dir,test = None):
-    rarity = load_rarities(period)
+# A generated token held in memory: encoded PNG, its ETag and the metadata dict
+RenderedToken = namedtuple("RenderedToken", ["token_id", "png", "etag", "metadata"])
+
+# Function to generate a single token without touching the filesystem
+def render_token(token_id, period, nft_seed, extraMints, curveSteepness, maxRebate, test = None):
     discount = (maxRebate * extraMints) / (extraMints + curveSteepness)
     d = discount / 100.0  # Convert to a decimal
 
-    base_image, metadata = randomizing(token_id, nft_seed, rarity, d, directories, test)
+    base_image, metadata = randomizing(token_id, nft_seed, period, d, directories, test)
 
-    # Save the final image
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    output_path = os.path.join(output_dir, f"{token_id}.png")
-    base_image.save(output_path)
-    print(f"Generated image for token {nft_seed}: {output_path}")
+    with stage("encode"):
+        buffer = io.BytesIO()
+        base_image.save(buffer, format="PNG")
+        png = buffer.getvalue()
+    # Content hash served as the image's ETag
+    return RenderedToken(token_id, png, content_etag(png), metadata)
+
+# Function to write a rendered token to artifact storage
+def save_token(rendered, storage):
+    started = time.perf_counter()
+    storage.put(image_key(rendered.token_id), rendered.png, rendered.etag)
+    logger.info(f"Generated image for token {rendered.token_id}: {image_key(rendered.token_id)}")
 
     # Save metadata as JSON
-    metadata_output = os.path.join(output_dir, f"{token_id}.json")
-    with open(metadata_output, "w") as f:
-        json.dump(metadata, f, indent=4)
-    print(f"Metadata saved for token {nft_seed}: {metadata_output}")
+    storage.put(metadata_key(rendered.token_id), json.dumps(rendered.metadata, indent=4).encode())
+    logger.info(f"Metadata saved for token {rendered.token_id}: {metadata_key(rendered.token_id)}")
+    record_stage("write", started)
 
-    return output_path, metadata_output
+    return image_key(rendered.token_id), metadata_key(rendered.token_id)
 
+# Function to generate a single image
+def generate_image(token_id, period, nft_seed, extraMints, curveSteepness, maxRebate, storage,test = None):
+    rendered = render_token(token_id, period, nft_seed, extraMints, curveSteepness, maxRebate, test)
+    return save_token(rendered, storage)
+
+# Function to fingerprint one generation (traits and pixels) without touching disk
+def generation_digest(token_id, nft_seed, period=0, d=0.0):
+    base_image, metadata = randomizing(token_id, nft_seed, period, d, directories)
+    return json.dumps(metadata, sort_keys=True), hashlib.sha1(base_image.tobytes()).hexdigest()
+
+# Function to check that concurrent generations match sequential ones
+def check_thread_safety(tokens=200, threads=16, rounds=5):
+    """Generate tokens one at a time, then again from a thread pool in shuffled
+    order several times, and count tokens whose traits or pixels changed."""
+    jobs = [(token_id, token_id * 7919 + 1, 0, (token_id % 50) / 100.0) for token_id in range(tokens)]
+    expected = {job: generation_digest(*job) for job in jobs}
+
+    mismatches = 0
+    shuffler = random.Random(0)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for round_number in range(rounds):
+            order = jobs * 2  # Every token twice per round, so equal seeds also race
+            shuffler.shuffle(order)
+            for job, digest in zip(order, executor.map(lambda job: generation_digest(*job), order)):
+                if digest != expected[job]:
+                    mismatches += 1
+                    logger.error(f"Token {job[0]} differs under concurrency in round {round_number}")
+    return mismatches
+
+if __name__ == "__main__":
+    # Multi-threaded stress check against the real layers
+    logging.basicConfig(level=logging.INFO)
+    tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    mismatches = check_thread_safety(tokens)
+    logger.info(f"Checked {tokens} tokens under concurrent generation: {mismatches} mismatches")
+    sys.exit(1 if mismatches else 0)
@@ -1,5 +1,11 @@
 import multiprocessing
 import os
+import shutil
+import tempfile
+
+# Metrics of every worker and render process are written here and merged by /metrics.
+# Must be set before the app imports prometheus_client.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "chanclas_metrics"))
 
 # Server socket
 bind = "0.0.0.0:3000"  # Listen on all interfaces
@@ -8,7 +14,7 @@ backlog = 2048
 # Worker processes
 workers = 1  # Reduced to 1 worker
 worker_class = "gthread"
-threads = 2
+threads = 8  # Renders run in the render pool, so threads mostly wait on I/O
 worker_connections = 1000
 timeout = 30
 keepalive = 2
@@ -39,6 +45,13 @@ def on_starting(server):
     Log server start
     """
     server.log.info("Starting Chanclas API server")
+    # Counters restart with the server, not with each recycled worker
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+    # Profiling switched on at runtime stays on only until the next restart
+    from profiler import profiler
+    profiler.reset()
 
 def on_exit(server):
     """
@@ -46,6 +59,31 @@ def on_exit(server):
     """
     server.log.info("Stopping Chanclas API server")
 
+def post_worker_init(worker):
+    """
+    Start the render processes (which preload all trait layers) before the worker takes traffic
+    """
+    from api import render_pool
+    render_pool.wait_ready()
+    worker.log.info(f"Started render pool: {render_pool.stats()}")
+
+def worker_exit(server, worker):
+    """
+    Finish pending writes, stop the worker's render processes and clean up resources
+    """
+    from api import render_pool, flush_writes
+    flush_writes()
+    render_pool.shutdown()
+    import gc
+    gc.collect()
+
+def child_exit(server, worker):
+    """
+    Drop live gauges (RSS, render queue depth) of a worker that exited
+    """
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
 def worker_int(worker):
     """
     Log worker interrupt
@@ -54,17 +92,14 @@ def worker_int(worker):
 
 def worker_abort(worker):
     """
-    Log worker abort
+    Log worker abort and save the profiles of the requests that were still running (usually a timeout)
     """
     worker.log.info("Worker received SIGABRT signal")
+    from profiler import profiler
+    for path in profiler.dump_active("aborted"):
+        if path:
+            worker.log.info(f"Saved profile of aborted request: {path}")
 
 # Memory management
 max_requests = 500
 max_requests_jitter = 50
-
-def worker_exit(server, worker):
-    """
-    Clean up resources when worker exits
-    """
-    import gc
-    gc.collect() 
\ No newline at end of file
@@ -0,0 +1,192 @@
+import os
+import re
+import time
+import queue
+import logging
+import argparse
+import threading
+from eth_utils import keccak
+from chain import CONTRACT_ADDRESS, rpc_request
+from rpc_batch import lookup_tokens
+from token_index import TokenIndex
+from singleflight import SingleFlight
+from opensea import OPENSEA_API_KEY, RefreshQueue, OpenSeaNotifier
+from storage import open_storage, token_stored
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MINTED_TOPIC = "0x" + keccak(text="Minted(address,uint256,uint256,uint256)").hex()
+# Only index blocks this far behind the head so reorgs cannot undo indexed mints
+CONFIRMATIONS = int(os.getenv("INDEXER_CONFIRMATIONS", "10"))
+# First block to scan when there is no checkpoint yet (the contract deployment block)
+START_BLOCK = int(os.getenv("INDEXER_START_BLOCK", "0"))
+LOG_PAGE_SIZE = 2000  # Blocks per eth_getLogs request
+MIN_LOG_PAGE_SIZE = 10
+POLL_INTERVAL = 5  # Seconds between polls once caught up
+
+CHECKPOINT_KEY = "last_indexed_block"
+
+# How providers word a refused eth_getLogs range or an oversized result
+RANGE_ERROR = re.compile(
+    r"block range|range (is )?too (large|big|wide)|exceed(s|ed)? .*range|more than \d+ (results|logs)"
+    r"|limited to .*range|ranges? over \d+ blocks|too many (results|logs|blocks)|response size|limit exceeded|-32005",
+    re.IGNORECASE,
+)
+
+
+def is_range_error(error):
+    """Whether an eth_getLogs failure means the block range was too large for the provider."""
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) == 413:
+        return True
+    return RANGE_ERROR.search(str(error)) is not None
+
+
+class MintIndexer:
+    """Follows Minted logs into the token index and renders new tokens.
+
+    Backfills from the persisted checkpoint (or START_BLOCK) to the confirmed head
+    in paginated eth_getLogs ranges, then tails new blocks. Token data for each
+    page is fetched with one batched lookup, stored in the index and queued for
+    rendering, so the API finds new tokens already indexed and stored.
+    """
+
+    def __init__(self, index, storage=None, render=True, refresh_queue=None):
+        self.index = index
+        self.storage = storage or open_storage()
+        self.render = render
+        self.refresh_queue = refresh_queue
+        self.page_size = LOG_PAGE_SIZE
+        self.jobs = queue.Queue()
+        self.flight = SingleFlight()
+
+    def checkpoint(self):
+        return int(self.index.get_meta(CHECKPOINT_KEY, START_BLOCK - 1))
+
+    def get_minted_logs(self, from_block, to_block):
+        return rpc_request("eth_getLogs", [{
+            "address": CONTRACT_ADDRESS,
+            "topics": [MINTED_TOPIC],
+            "fromBlock": hex(from_block),
+            "toBlock": hex(to_block),
+        }])
+
+    def index_range(self, from_block, to_block):
+        """Index every mint in [from_block, to_block] and advance the checkpoint."""
+        logs = self.get_minted_logs(from_block, to_block)
+        block_numbers = {int(log["topics"][2], 16): int(log["blockNumber"], 16) for log in logs}
+
+        if block_numbers:
+            tokens = lookup_tokens(block_numbers)
+            minted = {token_id: token for token_id, token in tokens.items() if token is not None}
+            self.index.put_many(tokens, block_numbers)
+            for token_id in sorted(minted):
+                self.enqueue(token_id)
+            logger.info(f"Indexed {len(minted)} mints in blocks {from_block}-{to_block}")
+
+        self.index.set_meta(CHECKPOINT_KEY, to_block)
+        return len(block_numbers)
+
+    def run_once(self):
+        """Index up to the confirmed head. Returns the number of mints found."""
+        safe_head = int(rpc_request("eth_blockNumber", []), 16) - CONFIRMATIONS
+        from_block = self.checkpoint() + 1
+        found = 0
+
+        while from_block <= safe_head:
+            to_block = min(from_block + self.page_size - 1, safe_head)
+            try:
+                found += self.index_range(from_block, to_block)
+            except Exception as e:
+                # Retry a refused range from the same start with a smaller page; anything else
+                # (node down, lookup failure) waits for the next poll
+                if not is_range_error(e) or self.page_size <= MIN_LOG_PAGE_SIZE:
+                    raise
+                self.page_size = max(self.page_size // 2, MIN_LOG_PAGE_SIZE)
+                logger.warning(f"eth_getLogs {from_block}-{to_block} failed ({e}), page size now {self.page_size}")
+                continue
+            from_block = to_block + 1
+            self.page_size = min(self.page_size * 2, LOG_PAGE_SIZE)
+
+        return found
+
+    def enqueue(self, token_id):
+        if self.render:
+            self.jobs.put(token_id)
+
+    def enqueue_missing(self):
+        """Queue indexed tokens whose files are missing (e.g. after a crash)."""
+        missing = [t for t in self.index.token_ids() if not self.is_rendered(t)]
+        for token_id in missing:
+            self.enqueue(token_id)
+        if missing:
+            logger.info(f"Queued {len(missing)} indexed tokens without rendered files")
+
+    def is_rendered(self, token_id):
+        return token_stored(self.storage, token_id)
+
+    def render_token(self, token_id):
+        from generate import generate_image
+
+        def generate():
+            # The API may already have rendered it on request
+            if self.is_rendered(token_id):
+                return
+            token = self.index.get(token_id)
+            generate_image(token_id, token.period_id, token.seed, token.extraMints,
+                           token.curveSteepness, token.maxRebate, self.storage)
+            logger.info(f"Rendered token {token_id}")
+            if self.refresh_queue is not None:
+                self.refresh_queue.enqueue(token_id)
+
+        self.flight.do(token_id, generate)
+
+    def render_loop(self):
+        from generate import preload_layers
+
+        preload_layers()
+        while True:
+            token_id = self.jobs.get()
+            try:
+                self.render_token(token_id)
+            except Exception as e:
+                logger.error(f"Error rendering token {token_id}: {e}")
+            finally:
+                self.jobs.task_done()
+
+    def run_forever(self):
+        if self.refresh_queue is not None:
+            OpenSeaNotifier(self.refresh_queue).start()
+        if self.render:
+            threading.Thread(target=self.render_loop, name="render", daemon=True).start()
+            self.enqueue_missing()
+
+        logger.info(f"Indexing Minted events from block {self.checkpoint() + 1}")
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Indexer poll failed: {e}")
+            time.sleep(POLL_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index Minted events and render new Chanclas tokens")
+    parser.add_argument("--db", default=None, help="Token index SQLite file")
+    parser.add_argument("--output-dir", help="Directory of the local storage backend (default ARTIFACT_DIR)")
+    parser.add_argument("--no-render", action="store_true", help="Only index, do not render")
+    parser.add_argument("--no-opensea", action="store_true", help="Do not send queued OpenSea refreshes")
+    args = parser.parse_args()
+
+    index = TokenIndex(args.db) if args.db else TokenIndex()
+    if not args.no_opensea and not OPENSEA_API_KEY:
+        logger.warning("OPENSEA_API_KEY is not set, not sending OpenSea refreshes")
+    refresh_queue = RefreshQueue() if OPENSEA_API_KEY and not args.no_opensea else None
+    storage = open_storage(directory=args.output_dir)
+    MintIndexer(index, storage, render=not args.no_render, refresh_queue=refresh_queue).run_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import os
+import sys
+import json
+import mmap
+import logging
+import argparse
+import numpy as np
+from PIL import Image
+from compositor import NumpyLayer
+from layer_cache import layer_paths_by_weight
+from storage import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Packed, pre-blended layers shared by every process through the page cache
+ATLAS_PATH = os.getenv("LAYER_ATLAS", "./layers.atlas")
+ATLAS_VERSION = 1
+ALIGNMENT = 64  # Byte alignment of every array in the atlas
+
+# Arrays stored per layer, in file order
+FIELDS = (("premul", np.uint16, 4), ("inv_alpha", np.uint16, 1), ("rgba", np.uint8, 4))
+
+
+def index_path(atlas_path):
+    return atlas_path + ".json"
+
+
+def source_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def build_atlas(paths, atlas_path=ATLAS_PATH):
+    """Decode and crop every layer in paths and pack them into one raw file.
+
+    The atlas holds each NumpyLayer's arrays back to back; the JSON index next
+    to it records where each one starts, its box on the canvas and the size and
+    mtime of the source PNG so stale atlases are detected. Both files are
+    replaced atomically, so running processes keep their old mapping.
+    """
+    entries = {}
+    offset = 0
+
+    def write_layers(f):
+        nonlocal offset
+        for path in paths:
+            if not os.path.exists(path):
+                logger.warning(f"Layer file missing, not packed: {path}")
+                continue
+            with Image.open(path) as layer_image:
+                layer = NumpyLayer(layer_image.convert("RGBA"))
+            height, width = layer.rgba.shape[:2]
+            fields = {}
+            for name, dtype, _ in FIELDS:
+                data = np.ascontiguousarray(getattr(layer, name), dtype=dtype).tobytes()
+                padding = -offset % ALIGNMENT
+                f.write(b"\0" * padding)
+                offset += padding
+                fields[name] = offset
+                f.write(data)
+                offset += len(data)
+            entries[path] = {
+                "top": layer.top,
+                "left": layer.left,
+                "height": height,
+                "width": width,
+                "canvas": list(layer.canvas),
+                "offsets": fields,
+                "source": source_signature(path),
+            }
+
+    atomic_write(atlas_path, write_layers)
+    index = {"version": ATLAS_VERSION, "size": offset, "layers": entries}
+    atomic_write(index_path(atlas_path), lambda f: f.write(json.dumps(index).encode()))
+    return index
+
+
+def atlas_is_stale(paths, atlas_path=ATLAS_PATH):
+    """True if the atlas is missing, outdated or does not cover paths."""
+    try:
+        with open(index_path(atlas_path), "r") as f:
+            index = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return True
+    if index.get("version") != ATLAS_VERSION:
+        return True
+    if not os.path.exists(atlas_path) or os.path.getsize(atlas_path) != index["size"]:
+        return True
+    layers = index["layers"]
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        if path not in layers or layers[path]["source"] != source_signature(path):
+            return True
+    return False
+
+
+class LayerAtlas:
+    """Read-only NumpyLayers backed by a memory-mapped atlas file.
+
+    Every process mapping the same file shares one physical copy, and nothing is
+    decoded at startup, so a recycled worker renders at full speed immediately.
+    Layers whose source PNG changed after the build are left out and fall back to
+    the regular decode path.
+    """
+
+    def __init__(self, atlas_path=ATLAS_PATH):
+        with open(index_path(atlas_path), "r") as f:
+            index = json.load(f)
+        if index.get("version") != ATLAS_VERSION:
+            raise ValueError(f"Unsupported atlas version {index.get('version')} in {atlas_path}")
+
+        with open(atlas_path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) != index["size"]:
+            raise ValueError(f"Atlas {atlas_path} does not match its index")
+        if hasattr(self._map, "madvise"):
+            # Ask the kernel to fault the atlas in ahead of the first render
+            self._map.madvise(mmap.MADV_WILLNEED)
+
+        self.path = atlas_path
+        self.stale = 0
+        self._layers = {}
+        for path, entry in index["layers"].items():
+            if not os.path.exists(path) or source_signature(path) != entry["source"]:
+                self.stale += 1
+                continue
+            self._layers[path] = self._view(entry)
+
+    def _view(self, entry):
+        height, width = entry["height"], entry["width"]
+        arrays = {
+            name: np.frombuffer(self._map, dtype=dtype, count=height * width * channels,
+                                offset=entry["offsets"][name]).reshape(height, width, channels)
+            for name, dtype, channels in FIELDS
+        }
+        return NumpyLayer.from_arrays(entry["top"], entry["left"], tuple(entry["canvas"]), **arrays)
+
+    def get(self, path):
+        return self._layers.get(path)
+
+    def __len__(self):
+        return len(self._layers)
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "layers": len(self._layers),
+            "stale": self.stale,
+            "size_mb": round(len(self._map) / 1024 / 1024, 2),
+        }
+
+
+def load_atlas(atlas_path=ATLAS_PATH, compositor=None):
+    """Map the atlas if it exists and suits the compositor, else return None."""
+    if compositor is not None and compositor.name != "numpy":
+        return None
+    if not os.path.exists(index_path(atlas_path)):
+        return None
+    try:
+        atlas = LayerAtlas(atlas_path)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Ignoring layer atlas {atlas_path}: {e}")
+        return None
+    if atlas.stale:
+        logger.warning(f"{atlas.stale} layers changed since {atlas_path} was built; run layer_atlas.py to rebuild it")
+    return atlas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack all trait layers into a memory-mappable atlas")
+    parser.add_argument("--output", default=ATLAS_PATH, help=f"Atlas file (default {ATLAS_PATH})")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the atlas is up to date")
+    args = parser.parse_args()
+
+    from generate import directories
+
+    paths = layer_paths_by_weight(directories)
+    if not args.force and not atlas_is_stale(paths, args.output):
+        logger.info(f"Layer atlas {args.output} is up to date")
+        return 0
+    index = build_atlas(paths, args.output)
+    logger.info(f"Packed {len(index['layers'])} layers into {args.output} "
+                f"({index['size'] / 1024 / 1024:.1f} MB)")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
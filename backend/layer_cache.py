@@ -0,0 +1,132 @@
+import os
+import json
+import glob
+import logging
+import threading
+from collections import OrderedDict
+from PIL import Image
+from metrics import cache_counters, stage
+
+logger = logging.getLogger(__name__)
+
+# Memory budget for decoded layers
+LAYER_CACHE_MB = int(os.getenv("LAYER_CACHE_MB", "512"))
+
+LAYER_HITS, LAYER_MISSES = cache_counters("layer")
+
+
+class LayerCache:
+    """Thread-safe LRU cache of decoded RGBA layers keyed by file path.
+
+    Each decoded image is handed to the compositor's prepare() so the cache holds
+    layers in whatever form the compositor blends fastest. Cached layers are
+    shared between requests and must be treated as read-only. Layers found in
+    the optional memory-mapped atlas are served from it and never decoded.
+    """
+
+    def __init__(self, budget_bytes, compositor, atlas=None):
+        self.budget_bytes = budget_bytes
+        self.compositor = compositor
+        self.atlas = atlas
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._layers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _decode(self, path):
+        with stage("layer_decode"), Image.open(path) as layer_image:
+            layer_image = layer_image.convert("RGBA")
+            return self.compositor.prepare(layer_image)
+
+    def _insert(self, path, layer, evict=True):
+        """Store a layer, evicting least recently used entries to stay in budget."""
+        nbytes = self.compositor.nbytes(layer)
+        with self._lock:
+            if path in self._layers:
+                return True
+            if nbytes > self.budget_bytes:
+                return False
+            while self.size_bytes + nbytes > self.budget_bytes:
+                if not evict or not self._layers:
+                    return False
+                _, old = self._layers.popitem(last=False)
+                self.size_bytes -= self.compositor.nbytes(old)
+            self._layers[path] = layer
+            self.size_bytes += nbytes
+            return True
+
+    def get(self, path):
+        """Return the prepared layer for path, decoding it on a miss."""
+        if self.atlas is not None:
+            layer = self.atlas.get(path)
+            if layer is not None:
+                LAYER_HITS.inc()
+                return layer
+
+        with self._lock:
+            layer = self._layers.get(path)
+            if layer is not None:
+                self._layers.move_to_end(path)
+                self.hits += 1
+                LAYER_HITS.inc()
+                return layer
+            self.misses += 1
+        LAYER_MISSES.inc()
+
+        layer = self._decode(path)
+        self._insert(path, layer)
+        return layer
+
+    def preload(self, paths):
+        """Decode paths in order until the memory budget is full.
+
+        Preloading never evicts, so callers should pass the most common layers first.
+        Returns the number of layers loaded.
+        """
+        loaded = 0
+        for path in paths:
+            if not os.path.exists(path):
+                logger.warning(f"Layer file missing, not preloaded: {path}")
+                continue
+            if self.atlas is not None and self.atlas.get(path) is not None:
+                continue
+            if not self._insert(path, self._decode(path), evict=False):
+                logger.info(f"Layer cache budget reached after {loaded} layers")
+                break
+            loaded += 1
+        return loaded
+
+    def stats(self):
+        with self._lock:
+            return {
+                "atlas_layers": len(self.atlas) if self.atlas is not None else 0,
+                "layers": len(self._layers),
+                "size_mb": round(self.size_bytes / 1024 / 1024, 2),
+                "budget_mb": round(self.budget_bytes / 1024 / 1024, 2),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def layer_paths_by_weight(directories, rarities_dir="./rarities"):
+    """List every layer file referenced by the rarities files, most common first."""
+    weights = {}
+    for rarities_file in sorted(glob.glob(os.path.join(rarities_dir, "rarities_*.json"))):
+        with open(rarities_file, "r") as f:
+            rarities = json.load(f)
+        for layer, options in rarities.items():
+            if layer not in directories:
+                continue
+            for item in options:
+                if item["file"] == "EMPTY":
+                    continue
+                layers = [layer]
+                # ToeGuards are not in the rarities files, they always follow the Base
+                if layer == "06_Base" and "07_ToeGuards" in directories:
+                    layers.append("07_ToeGuards")
+                for name in layers:
+                    path = os.path.join(directories[name], item["file"])
+                    weights[path] = max(weights.get(path, 0), item["weight"])
+
+    return sorted(weights, key=lambda path: weights[path], reverse=True)
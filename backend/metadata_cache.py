@@ -0,0 +1,71 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from metrics import cache_counters
+
+# Memory budget for cached metadata responses
+METADATA_CACHE_MB = int(os.getenv("METADATA_CACHE_MB", "16"))
+
+METADATA_HITS, METADATA_MISSES = cache_counters("metadata")
+
+
+class CachedMetadata:
+    """Final /id response body with its precomputed validator."""
+
+    __slots__ = ("body", "etag")
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+
+
+def serialize_metadata(metadata):
+    """Response bytes for a metadata dict (same format the endpoint always served)."""
+    return json.dumps(metadata).encode()
+
+
+class MetadataCache:
+    """Thread-safe LRU of ready-to-send metadata responses, bounded by total bytes.
+
+    Metadata for a minted token never changes, so entries only leave the cache
+    through eviction or an explicit invalidate() when a token is regenerated.
+    """
+
+    def __init__(self, budget_bytes=METADATA_CACHE_MB * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self.size_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token_id):
+        with self._lock:
+            entry = self._entries.get(token_id)
+            if entry is not None:
+                self._entries.move_to_end(token_id)
+        (METADATA_HITS if entry is not None else METADATA_MISSES).inc()
+        return entry
+
+    def put(self, token_id, body):
+        entry = CachedMetadata(body)
+        with self._lock:
+            old = self._entries.pop(token_id, None)
+            if old is not None:
+                self.size_bytes -= len(old.body)
+            self._entries[token_id] = entry
+            self.size_bytes += len(body)
+            while self.size_bytes > self.budget_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.size_bytes -= len(evicted.body)
+        return entry
+
+    def load(self, token_id, data):
+        """Parse a stored metadata file and cache its response bytes."""
+        return self.put(token_id, serialize_metadata(json.loads(data)))
+
+    def invalidate(self, token_id):
+        with self._lock:
+            old = self._entries.pop(token_id, None)
+            if old is not None:
+                self.size_bytes -= len(old.body)
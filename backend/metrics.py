@@ -0,0 +1,88 @@
+import os
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+# Set by gunicorn.conf.py: every worker and render process writes its samples to
+# files in this directory and /metrics merges them, so numbers survive recycling
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# From sub-millisecond cache work up to renders that hit the request timeout
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_SECONDS = Histogram(
+    "chanclas_stage_seconds", "Time spent in each stage of serving and generating tokens",
+    ["stage"], buckets=STAGE_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "chanclas_request_seconds", "HTTP request latency by endpoint", ["endpoint"], buckets=STAGE_BUCKETS,
+)
+RESPONSES = Counter("chanclas_responses_total", "HTTP responses by endpoint and status", ["endpoint", "status"])
+CACHE_REQUESTS = Counter("chanclas_cache_requests_total", "Cache lookups by cache and result", ["cache", "result"])
+RPC_REQUESTS = Counter("chanclas_rpc_requests_total", "RPC calls by endpoint host and outcome", ["endpoint", "outcome"])
+RPC_SECONDS = Histogram("chanclas_rpc_seconds", "RPC call latency by endpoint host", ["endpoint"], buckets=STAGE_BUCKETS)
+RENDER_QUEUE_DEPTH = Gauge(
+    "chanclas_render_queue_depth", "Renders queued or running", multiprocess_mode="livesum",
+)
+RENDER_QUEUE_WAIT = Histogram(
+    "chanclas_render_queue_wait_seconds", "Time renders wait for a render process", buckets=STAGE_BUCKETS,
+)
+RENDER_REJECTED = Counter("chanclas_render_rejected_total", "Renders shed because the render queue was full")
+RATE_LIMITED = Counter("chanclas_rate_limited_total", "Requests refused by the rate limiter", ["budget"])
+# Labelled so processes that never sample (render processes) export no series
+WORKER_RSS = Gauge("chanclas_worker_rss_bytes", "Resident memory of each process", ["role"], multiprocess_mode="liveall")
+
+RSS_INTERVAL = 10  # Seconds between RSS samples of a worker
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block into chanclas_stage_seconds{stage=name}."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, started)
+
+
+def record_stage(name, started):
+    """Record a stage that began at time.perf_counter() value started."""
+    STAGE_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+
+def cache_counters(cache):
+    """(hit, miss) counters of one cache, bound once for hot paths."""
+    return CACHE_REQUESTS.labels(cache, "hit"), CACHE_REQUESTS.labels(cache, "miss")
+
+
+def rpc_label(url):
+    """Endpoint label without paths, which may carry API keys."""
+    return urlparse(url).hostname or url
+
+
+_last_rss = 0.0
+
+
+def sample_rss(role="api"):
+    """Record this process's RSS, at most once per RSS_INTERVAL."""
+    global _last_rss
+    now = time.monotonic()
+    if now - _last_rss < RSS_INTERVAL:
+        return
+    _last_rss = now
+    import psutil
+
+    WORKER_RSS.labels(role).set(psutil.Process(os.getpid()).memory_info().rss)
+
+
+def render_latest():
+    """Prometheus text exposition of all processes (or just this one outside gunicorn)."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,176 @@
+import os
+import time
+import random
+import sqlite3
+import logging
+import threading
+import requests
+from chain import CONTRACT_ADDRESS
+from metrics import stage
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+OPENSEA_API_URL = os.getenv("OPENSEA_API_URL", "https://api.opensea.io")
+OPENSEA_API_KEY = os.getenv("OPENSEA_API_KEY", "")  # No refreshes are queued or sent without one
+# SQLite file holding pending refreshes, shared by the API workers and the notifier
+OPENSEA_QUEUE_DB = os.getenv("OPENSEA_QUEUE_DB", "./opensea_queue.db")
+
+REFRESH_RATE = 1.0  # Sustained refreshes per second
+REFRESH_BURST = 4  # Refreshes allowed back to back
+REFRESH_TIMEOUT = 10  # Seconds per OpenSea request
+MAX_ATTEMPTS = 8
+RETRY_BASE_DELAY = 5  # Seconds, doubled per attempt
+RETRY_MAX_DELAY = 900
+IDLE_INTERVAL = 1  # Seconds between queue polls when nothing is due
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS refresh_queue (
+    token_id INTEGER PRIMARY KEY,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+def refresh_opensea_metadata(token_id):
+    """Ask OpenSea to refresh a token's metadata.
+
+    Returns (ok, retry_after): ok is True on success, False on a failure worth
+    retrying; retry_after is the server-requested pause in seconds on a 429.
+    """
+    url = f"{OPENSEA_API_URL}/api/v2/chain/base/contract/{CONTRACT_ADDRESS}/nfts/{token_id}/refresh"
+    headers = {
+        'x-api-key': OPENSEA_API_KEY
+    }
+    try:
+        logger.info(f"Attempting to refresh OpenSea metadata for token {token_id}")
+        with stage("opensea_refresh"):
+            response = requests.post(url, headers=headers, timeout=REFRESH_TIMEOUT)
+
+        if response.status_code == 200:
+            logger.info(f"Successfully refreshed OpenSea metadata for token {token_id}")
+            return True, None
+        elif response.status_code == 429:
+            retry_after = response.headers.get("Retry-After", "")
+            retry_after = float(retry_after) if retry_after.replace(".", "", 1).isdigit() else RETRY_BASE_DELAY
+            logger.warning(f"OpenSea rate limit hit for token {token_id}, pausing {retry_after}s")
+            return False, retry_after
+        else:
+            logger.warning(f"OpenSea refresh failed for token {token_id}: Status {response.status_code}, Response: {response.text}")
+            return False, None
+
+    except requests.exceptions.Timeout:
+        logger.warning(f"OpenSea refresh timed out for token {token_id}")
+        return False, None
+    except Exception as e:
+        logger.error(f"Error refreshing OpenSea metadata for token {token_id}: {e}")
+        return False, None
+
+
+class RefreshQueue:
+    """Durable, de-duplicated queue of tokens waiting for an OpenSea refresh.
+
+    Request handlers only enqueue; OpenSeaNotifier drains the queue at a rate
+    OpenSea accepts, backing off on 429s and retrying failures with jitter.
+    """
+
+    def __init__(self, path=OPENSEA_QUEUE_DB):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    def enqueue(self, token_id):
+        """Queue a refresh; a token already waiting is not queued twice."""
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO refresh_queue (token_id, next_attempt_at, created_at) VALUES (?, ?, ?)",
+                (token_id, now, now),
+            )
+
+    def next_due(self):
+        """Return (token_id, attempts) of the oldest due refresh, or None."""
+        return self._connect().execute(
+            "SELECT token_id, attempts FROM refresh_queue WHERE next_attempt_at <= ? ORDER BY next_attempt_at LIMIT 1",
+            (time.time(),),
+        ).fetchone()
+
+    def done(self, token_id):
+        with self._connect() as db:
+            db.execute("DELETE FROM refresh_queue WHERE token_id = ?", (token_id,))
+
+    def retry_later(self, token_id, delay, count_attempt=True):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE refresh_queue SET attempts = attempts + ?, next_attempt_at = ? WHERE token_id = ?",
+                (1 if count_attempt else 0, time.time() + delay, token_id),
+            )
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM refresh_queue").fetchone()[0]
+
+
+class OpenSeaNotifier:
+    """Drains a RefreshQueue into OpenSea's refresh endpoint."""
+
+    def __init__(self, refresh_queue, rate=REFRESH_RATE, burst=REFRESH_BURST):
+        self.queue = refresh_queue
+        self.bucket = TokenBucket(rate, burst)
+
+    def process_one(self):
+        """Send the next due refresh. Returns False if nothing was due."""
+        item = self.queue.next_due()
+        if item is None:
+            return False
+        token_id, attempts = item
+
+        self.bucket.wait()
+        ok, retry_after = refresh_opensea_metadata(token_id)
+        if ok:
+            self.queue.done(token_id)
+        elif retry_after is not None:
+            # Rate limited: the refresh itself was fine, everything waits
+            self.bucket.pause(retry_after)
+            self.queue.retry_later(token_id, retry_after, count_attempt=False)
+        elif attempts + 1 >= MAX_ATTEMPTS:
+            logger.error(f"Giving up on OpenSea refresh for token {token_id} after {attempts + 1} attempts")
+            self.queue.done(token_id)
+        else:
+            delay = min(RETRY_BASE_DELAY * 2 ** attempts, RETRY_MAX_DELAY)
+            self.queue.retry_later(token_id, delay * random.uniform(0.5, 1.5))
+        return True
+
+    def run_forever(self):
+        if not OPENSEA_API_KEY:
+            logger.warning("OPENSEA_API_KEY is not set, not sending OpenSea refreshes")
+            return
+        logger.info(f"OpenSea notifier started with {len(self.queue)} queued refreshes")
+        while True:
+            try:
+                if not self.process_one():
+                    time.sleep(IDLE_INTERVAL)
+            except Exception as e:
+                logger.error(f"OpenSea notifier error: {e}")
+                time.sleep(IDLE_INTERVAL)
+
+    def start(self):
+        """Run the notifier on a daemon thread."""
+        thread = threading.Thread(target=self.run_forever, name="opensea", daemon=True)
+        thread.start()
+        return thread
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    OpenSeaNotifier(RefreshQueue()).run_forever()
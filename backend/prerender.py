@@ -0,0 +1,144 @@
+import os
+import time
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from storage import open_storage, token_stored
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 25  # Tokens handed to a worker at a time
+PROGRESS_INTERVAL = 5  # Seconds between progress reports
+
+
+def init_worker():
+    """Warm the layer cache once per worker process."""
+    from generate import preload_layers
+
+    preload_layers()
+
+
+def render_chunk(token_ids, output_dir=None, period=None, force=False, variants=False):
+    """Render a chunk of tokens and return a status for each one.
+
+    Statuses: rendered, skipped (already stored), other_period, unminted, error.
+    """
+    from generate import generate_image
+    from rpc_batch import lookup_tokens
+    from variants import render_all_variants
+
+    storage = open_storage(directory=output_dir)
+    results = []
+    pending = [t for t in token_ids if force or not token_stored(storage, t)]
+    results.extend((t, "skipped") for t in token_ids if t not in pending)
+    try:
+        # Token data for the whole chunk in one batched round trip
+        tokens = lookup_tokens(pending)
+    except Exception as e:
+        logger.error(f"Error fetching token data for tokens {pending[0]}-{pending[-1]}: {e}")
+        return results + [(t, "error") for t in pending]
+
+    for token_id in pending:
+        try:
+            token = tokens[token_id]
+            if token is None:
+                results.append((token_id, "unminted"))
+                continue
+            if period is not None and token.period_id != period:
+                results.append((token_id, "other_period"))
+                continue
+            generate_image(token_id, token.period_id, token.seed, token.extraMints,
+                           token.curveSteepness, token.maxRebate, storage)
+            if variants:
+                render_all_variants(token_id, storage)
+            results.append((token_id, "rendered"))
+        except Exception as e:
+            logger.error(f"Error rendering token {token_id}: {e}")
+            results.append((token_id, "error"))
+    return results
+
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def run_prerender(start, end, output_dir=None, period=None, workers=None, chunk_size=CHUNK_SIZE, force=False,
+                  variants=False):
+    """Pre-render tokens start..end (inclusive) across a process pool."""
+    workers = workers or os.cpu_count()
+
+    # Resume: drop finished tokens before any work is distributed
+    storage = open_storage(directory=output_dir)
+    token_ids = [t for t in range(start, end + 1) if force or not token_stored(storage, t)]
+    total = end - start + 1
+    logger.info(f"Pre-rendering tokens {start}-{end}: {total - len(token_ids)} already rendered, {len(token_ids)} to go")
+    if period is not None:
+        logger.info(f"Only rendering tokens from period {period}")
+
+    counts = {"rendered": 0, "skipped": 0, "other_period": 0, "unminted": 0, "error": 0}
+    done = 0
+    start_time = time.time()
+    last_report = start_time
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        futures = [
+            executor.submit(render_chunk, chunk, output_dir, period, force, variants)
+            for chunk in chunked(token_ids, chunk_size)
+        ]
+        for future in as_completed(futures):
+            for token_id, status in future.result():
+                counts[status] += 1
+                done += 1
+
+            now = time.time()
+            if now - last_report >= PROGRESS_INTERVAL or done == len(token_ids):
+                elapsed = now - start_time
+                rate = counts["rendered"] / elapsed if elapsed > 0 else 0.0
+                remaining = (len(token_ids) - done) / (done / elapsed) if done else 0.0
+                logger.info(
+                    f"Progress: {done}/{len(token_ids)} "
+                    f"({counts['rendered']} rendered, {counts['error']} errors) "
+                    f"{rate:.1f} tokens/s, ETA {remaining:.0f}s"
+                )
+                last_report = now
+
+    elapsed = time.time() - start_time
+    logger.info("\nPre-render Results:")
+    logger.info(f"Total time: {elapsed:.2f} seconds with {workers} workers")
+    for status, count in counts.items():
+        logger.info(f"{status}: {count}")
+    if elapsed > 0:
+        logger.info(f"Throughput: {counts['rendered'] / elapsed:.2f} tokens/s")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-render minted Chanclas tokens into the API's artifact storage")
+    parser.add_argument("--start", type=int, default=0, help="First token ID (default 0)")
+    parser.add_argument("--end", type=int, help="Last token ID, inclusive (default: last minted token)")
+    parser.add_argument("--period", type=int, help="Only render tokens minted in this period")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Tokens per work item")
+    parser.add_argument("--output-dir", help="Directory of the local storage backend (default ARTIFACT_DIR)")
+    parser.add_argument("--force", action="store_true", help="Re-render tokens that already exist")
+    parser.add_argument("--variants", action="store_true", help="Also encode WebP and thumbnail variants")
+    args = parser.parse_args()
+
+    from chain import get_current_token_id
+
+    # Tokens are minted sequentially and never burned, so everything below currentTokenId exists
+    last_minted = get_current_token_id() - 1
+    end = last_minted if args.end is None else min(args.end, last_minted)
+    if end < args.start:
+        logger.info(f"Nothing to render: last minted token is {last_minted}")
+        return
+
+    run_prerender(args.start, end, args.output_dir, args.period, args.workers, args.chunk_size, args.force,
+                  args.variants)
+
+
+if __name__ == "__main__":
+    main()
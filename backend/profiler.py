@@ -0,0 +1,263 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import logging
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from storage import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Profiles of slow requests and renders, shared by every worker and render process
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "chanclas_profiles"))
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "0").lower() in ("1", "true", "yes")
+PROFILE_THRESHOLD_MS = int(os.getenv("PROFILE_THRESHOLD_MS", "1000"))  # Profiles of faster requests are dropped
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "1.0"))  # Share of requests that are sampled
+PROFILE_INTERVAL = 0.01  # Seconds between stack samples (100 Hz)
+PROFILE_KEEP = 200  # Profiles kept in PROFILE_DIR, oldest removed first
+CONTROL_CHECK_INTERVAL = 1.0  # Seconds between checks of the control file
+MAX_STACK_DEPTH = 128
+
+# Written by configure(); every process follows it, so one toggle reaches all workers
+CONTROL_FILE = "profiler.json"
+PROFILE_SUFFIX = ".collapsed"
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def collapse(frame):
+    """The stack of frame, outermost call first, in collapsed-stack format."""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class Profile:
+    """Stack samples of one request or render."""
+
+    def __init__(self, label):
+        self.label = label
+        self.started = time.perf_counter()
+        self.stacks = Counter()
+
+    def collapsed(self):
+        """Lines of 'frame;frame;frame count', as read by flamegraph.pl and speedscope."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class SlowRequestProfiler:
+    """Statistical profiler that keeps only the profiles of slow requests.
+
+    While enabled, a sampled share of requests is registered with begin() and
+    end(). A background thread wakes every PROFILE_INTERVAL while any request is
+    registered and records the stack of each registered thread from
+    sys._current_frames(); nothing is traced, so the cost is one stack walk per
+    request per interval. Requests that took longer than the threshold have their
+    samples written to PROFILE_DIR in collapsed-stack format; the rest are
+    dropped. The directory is a ring of the last PROFILE_KEEP profiles.
+
+    Settings are shared through a control file in PROFILE_DIR that every process
+    rereads at most once per CONTROL_CHECK_INTERVAL.
+    """
+
+    def __init__(self, directory=PROFILE_DIR, enabled=PROFILE_ENABLED, threshold_ms=PROFILE_THRESHOLD_MS,
+                 sample_rate=PROFILE_SAMPLE_RATE, interval=PROFILE_INTERVAL, keep=PROFILE_KEEP):
+        self.directory = directory
+        self.enabled = enabled
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.keep = keep
+        self._active = {}  # Thread ident -> Profile
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self._control_checked = 0.0
+        self._control_mtime = None
+        self.profiled = 0
+        self.written = 0
+
+    @property
+    def control_path(self):
+        return os.path.join(self.directory, CONTROL_FILE)
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._control_checked < CONTROL_CHECK_INTERVAL:
+            return
+        self._control_checked = now
+        try:
+            mtime = os.stat(self.control_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._control_mtime:
+            return
+        try:
+            with open(self.control_path, "r") as f:
+                settings = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring profiler settings in {self.control_path}: {e}")
+            return
+        self._control_mtime = mtime
+        self.enabled = bool(settings.get("enabled", self.enabled))
+        self.threshold_ms = int(settings.get("threshold_ms", self.threshold_ms))
+        self.sample_rate = float(settings.get("sample_rate", self.sample_rate))
+
+    def configure(self, enabled=None, threshold_ms=None, sample_rate=None):
+        """Change settings here and, through the control file, in every other process."""
+        self._refresh()
+        if enabled is not None:
+            self.enabled = bool(enabled)
+        if threshold_ms is not None:
+            self.threshold_ms = max(0, int(threshold_ms))
+        if sample_rate is not None:
+            self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        settings = {"enabled": self.enabled, "threshold_ms": self.threshold_ms, "sample_rate": self.sample_rate}
+        os.makedirs(self.directory, exist_ok=True)
+        atomic_write(self.control_path, lambda f: f.write(json.dumps(settings).encode()))
+        self._control_mtime = os.stat(self.control_path).st_mtime_ns
+        logger.info(f"Profiler settings changed: {settings}")
+        return settings
+
+    def reset(self):
+        """Remove the control file, so processes started from now on use the environment settings."""
+        try:
+            os.remove(self.control_path)
+        except FileNotFoundError:
+            pass
+
+    def _ensure_started(self):
+        # The sampler thread belongs to the process serving requests, so start it lazily after fork
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._active.clear()
+                threading.Thread(target=self._sample_loop, name="profiler", daemon=True).start()
+
+    def begin(self, label):
+        """Start sampling the calling thread, if enabled and picked for sampling."""
+        self._refresh()
+        if not self.enabled or random.random() >= self.sample_rate:
+            return
+        self._ensure_started()
+        with self._lock:
+            self._active[threading.get_ident()] = Profile(label)
+            self._wake.set()
+
+    def end(self):
+        """Stop sampling the calling thread; write its profile if it was slow."""
+        if not self._active:
+            return
+        with self._lock:
+            profile = self._active.pop(threading.get_ident(), None)
+        if profile is None:
+            return
+        self.profiled += 1
+        elapsed_ms = (time.perf_counter() - profile.started) * 1000
+        if elapsed_ms >= self.threshold_ms and profile.stacks:
+            self._write(profile, elapsed_ms)
+
+    @contextmanager
+    def track(self, label):
+        """Profile the enclosed block like a request."""
+        self.begin(label)
+        try:
+            yield
+        finally:
+            self.end()
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._wake.clear()
+            self._wake.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, profile in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None and ident != own:
+                        profile.stacks[collapse(frame)] += 1
+            del frames
+
+    def _write(self, profile, elapsed_ms, reason=None):
+        label = re.sub(r"[^A-Za-z0-9]+", "_", profile.label).strip("_")[:80]
+        name = f"{time.time_ns()}_{os.getpid()}_{label}_{int(elapsed_ms)}ms"
+        if reason:
+            name += f"_{reason}"
+        path = os.path.join(self.directory, name + PROFILE_SUFFIX)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            atomic_write(path, lambda f: f.write(profile.collapsed().encode()))
+            self.written += 1
+            self._trim()
+        except OSError as e:
+            logger.warning(f"Could not write profile {path}: {e}")
+            return None
+        logger.info(f"Profiled slow {profile.label} ({elapsed_ms:.0f} ms): {path}")
+        return path
+
+    def _trim(self):
+        for name in self.profiles()[self.keep:]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass  # Removed by another process
+
+    def dump_active(self, reason):
+        """Write the profiles of all requests still running, whatever their duration.
+
+        Called when gunicorn aborts a worker that timed out, which would
+        otherwise take the evidence of the slow request with it.
+        """
+        with self._lock:
+            active = list(self._active.values())
+        now = time.perf_counter()
+        return [self._write(profile, (now - profile.started) * 1000, reason) for profile in active if profile.stacks]
+
+    def profiles(self):
+        """Names of the stored profiles, newest first."""
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith(PROFILE_SUFFIX)]
+        except FileNotFoundError:
+            return []
+        return sorted(names, reverse=True)
+
+    def profile_path(self, name):
+        """Path of a stored profile, or None if name is not one."""
+        if os.path.basename(name) != name or name not in self.profiles():
+            return None
+        return os.path.join(self.directory, name)
+
+    def stats(self):
+        self._refresh()
+        with self._lock:
+            active = len(self._active)
+        return {
+            "enabled": self.enabled,
+            "threshold_ms": self.threshold_ms,
+            "sample_rate": self.sample_rate,
+            "interval_ms": self.interval * 1000,
+            "active": active,
+            "profiled": self.profiled,
+            "written": self.written,
+            "directory": self.directory,
+        }
+
+
+# One per process: API workers profile requests, render processes their render jobs
+profiler = SlowRequestProfiler()
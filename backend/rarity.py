@@ -0,0 +1,107 @@
+import os
+import sys
+import json
+import random
+import logging
+import threading
+from itertools import accumulate
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+RARITIES_DIR = "./rarities"
+# Compiled models kept per (period, d); d varies with each token's mint parameters
+RARITY_CACHE_SIZE = 1024
+
+_rarities = {}
+_rarities_lock = threading.Lock()
+
+
+def rarities_path(period):
+    #bypassing for now
+    return os.path.join(RARITIES_DIR, "rarities_4.json")
+
+
+def load_rarities(period):
+    """Return the parsed rarities file for a period, read from disk only once.
+
+    The returned dict is shared and must not be modified.
+    """
+    path = rarities_path(period)
+    rarities = _rarities.get(path)
+    if rarities is None:
+        with _rarities_lock:
+            if path not in _rarities:
+                with open(path, "r") as f:
+                    _rarities[path] = json.load(f)
+            rarities = _rarities[path]
+    return rarities
+
+
+class LayerSampler:
+    """Trait files of one layer with cumulative weights for random.choices.
+
+    Passing cum_weights skips the per-call accumulate but performs the exact same
+    bisect on the exact same floats, so selections match weights= bit for bit.
+    """
+
+    __slots__ = ("files", "cum_weights")
+
+    def __init__(self, options, d):
+        self.files = [item["file"] for item in options]
+        weights = [item["weight"] ** (-d) if item["weight"] > 0 else 0.0 for item in options]
+        self.cum_weights = list(accumulate(weights))
+
+    def choice(self, rng):
+        return rng.choices(self.files, cum_weights=self.cum_weights, k=1)[0]
+
+
+@lru_cache(maxsize=RARITY_CACHE_SIZE)
+def compile_rarity(period, d):
+    """Samplers for every layer of a period's rarities, with weights discounted by d.
+
+    Returns {layer: LayerSampler} in the rarities file's layer order.
+    """
+    return {layer: LayerSampler(options, d) for layer, options in load_rarities(period).items()}
+
+
+def reference_choice(rng, options, d):
+    """The original per-call selection, kept to check compiled samplers against."""
+    adjusted_options = []
+    for item in options:
+        original_weight = item['weight']
+        if original_weight <= 0:
+            adjusted_weight = 0.0
+        else:
+            adjusted_weight = original_weight ** (-d)
+        adjusted_item = item.copy()
+        adjusted_item['weight'] = adjusted_weight
+        adjusted_options.append(adjusted_item)
+    choices = [item['file'] for item in adjusted_options]
+    weights = [item['weight'] for item in adjusted_options]
+    return rng.choices(choices, weights=weights, k=1)[0]
+
+
+def check_determinism(samples=5000, period=0):
+    """Draw every layer for many seeds and discounts with both the compiled
+    samplers and the reference path. Returns the number of differing draws."""
+    mismatches = 0
+    for token_id in range(samples):
+        d = (token_id % 50) / 100.0
+        seed = f"{token_id}_{token_id * 7919}_check"
+        compiled_rng = random.Random(seed)
+        reference_rng = random.Random(seed)
+        for layer, sampler in compile_rarity(period, d).items():
+            expected = reference_choice(reference_rng, load_rarities(period)[layer], d)
+            if sampler.choice(compiled_rng) != expected:
+                mismatches += 1
+                logger.error(f"Token {token_id} layer {layer} differs at d={d}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    mismatches = check_determinism(samples)
+    logger.info(f"Checked {samples} tokens: {mismatches} mismatched draws")
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,176 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from metrics import RATE_LIMITED
+
+logger = logging.getLogger(__name__)
+
+# Shared counters; the limiter keeps working on local buckets alone if Redis is down
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+SYNC_INTERVAL = 1.0  # Seconds between batched pushes of local counts to Redis
+WINDOW = 60  # Seconds per shared counting window
+MAX_CLIENTS = 100000  # Buckets kept per budget, least recently seen dropped first
+
+# rate: requests per second per client, burst: requests allowed at once
+Budget = namedtuple("Budget", ["rate", "burst"])
+
+BUDGETS = {
+    # Anything served from memory or disk
+    "default": Budget(float(os.getenv("RATE_LIMIT_RATE", "20")), int(os.getenv("RATE_LIMIT_BURST", "100"))),
+    # Requests that need a mint check and a render
+    "cold": Budget(float(os.getenv("RATE_LIMIT_COLD_RATE", "1")), int(os.getenv("RATE_LIMIT_COLD_BURST", "10"))),
+}
+
+
+class TokenBucket:
+    """Allows `rate` events per second with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def pause(self, seconds):
+        """Stop handing out tokens for a while (e.g. after a 429)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def take(self):
+        """Take a token if one is available, else return the seconds until one is (0 on success)."""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def wait(self):
+        """Block until a token is available and take it."""
+        while True:
+            delay = self.take()
+            if not delay:
+                return
+            time.sleep(delay)
+
+
+class RateLimiter:
+    """Per-client token buckets decided in process, shared through Redis in the background.
+
+    hit() never touches the network: it takes a token from the client's local
+    bucket and counts the request. A background thread pushes the counts of all
+    clients to Redis every SYNC_INTERVAL in one pipelined batch, adding them to
+    fixed WINDOW counters shared by every worker. A client whose shared count
+    exceeds its budget for the window is paused locally until the window ends,
+    so all workers together enforce roughly one budget, at most one sync late.
+    """
+
+    def __init__(self, budgets=BUDGETS, redis_url=RATE_LIMIT_REDIS_URL, sync_interval=SYNC_INTERVAL, redis_client=None):
+        self.budgets = budgets
+        self.redis_url = redis_url
+        self.sync_interval = sync_interval
+        self._redis = redis_client
+        self._buckets = {name: OrderedDict() for name in budgets}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._redis_down = False
+        self.allowed = 0
+        self.limited = 0
+
+    def hit(self, client, budget="default"):
+        """Count a request. Returns 0 if allowed, else the seconds to wait before retrying."""
+        self._ensure_started()
+        limits = self.budgets[budget]
+        with self._lock:
+            buckets = self._buckets[budget]
+            bucket = buckets.get(client)
+            if bucket is None:
+                bucket = buckets[client] = TokenBucket(limits.rate, limits.burst)
+                if len(buckets) > MAX_CLIENTS:
+                    buckets.popitem(last=False)
+            else:
+                buckets.move_to_end(client)
+            delay = bucket.take()
+            if delay:
+                self.limited += 1
+                RATE_LIMITED.labels(budget).inc()
+                return delay
+            self.allowed += 1
+            key = (budget, client)
+            self._pending[key] = self._pending.get(key, 0) + 1
+            return 0.0
+
+    def _ensure_started(self):
+        # The sync thread belongs to the process that serves requests, so start it lazily after fork
+        if self._pid == os.getpid() or self.sync_interval is None:
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pending.clear()
+                self._thread = threading.Thread(target=self._sync_loop, name="rate-limit-sync", daemon=True)
+                self._thread.start()
+
+    def _client(self):
+        if self._redis is None:
+            import redis
+
+            self._redis = redis.Redis.from_url(self.redis_url, socket_timeout=1, socket_connect_timeout=1)
+        return self._redis
+
+    def sync(self):
+        """Push pending counts to Redis and pause clients over their shared budget."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        window = int(time.time() // WINDOW)
+        window_left = (window + 1) * WINDOW - time.time()
+        keys = list(pending)
+        pipe = self._client().pipeline(transaction=False)
+        for budget, client in keys:
+            name = f"ratelimit:{budget}:{client}:{window}"
+            pipe.incrby(name, pending[(budget, client)])
+            pipe.expire(name, WINDOW * 2)
+        totals = pipe.execute()[::2]
+
+        with self._lock:
+            for (budget, client), total in zip(keys, totals):
+                limits = self.budgets[budget]
+                if total > limits.rate * WINDOW + limits.burst:
+                    bucket = self._buckets[budget].get(client)
+                    if bucket is not None:
+                        bucket.pause(window_left)
+        return len(keys)
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self.sync()
+                if self._redis_down:
+                    logger.info("Rate limit counters syncing to Redis again")
+                    self._redis_down = False
+            except Exception as e:
+                # Counts of this interval are dropped; local buckets keep limiting
+                if not self._redis_down:
+                    logger.warning(f"Rate limit sync to Redis failed, limiting per process only: {e}")
+                    self._redis_down = True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": {name: len(buckets) for name, buckets in self._buckets.items()},
+                "allowed": self.allowed,
+                "limited": self.limited,
+                "redis": not self._redis_down,
+            }
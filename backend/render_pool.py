@@ -0,0 +1,168 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from concurrent.futures.process import BrokenProcessPool
+from metrics import MULTIPROC_DIR, RENDER_QUEUE_DEPTH, RENDER_QUEUE_WAIT, RENDER_REJECTED
+from profiler import profiler
+
+logger = logging.getLogger(__name__)
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))  # Render processes per API worker
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", "4"))  # Jobs queued or running per API worker
+RENDER_TIMEOUT = 20  # Seconds a request waits for its render, below gunicorn's timeout
+RETRY_AFTER = 5  # Seconds clients are told to wait when the pool is saturated
+
+
+class RenderQueueFull(Exception):
+    """The render queue is at capacity; the caller should shed the request."""
+
+
+def init_render_worker():
+    """Warm the layer cache once per render process."""
+    from generate import preload_layers
+
+    if MULTIPROC_DIR:
+        # Drop this process's live gauges from /metrics when it exits
+        from multiprocessing.util import Finalize
+        from prometheus_client import multiprocess
+
+        Finalize(None, multiprocess.mark_process_dead, args=(os.getpid(),), exitpriority=0)
+    preload_layers()
+
+
+def _run_job(fn, args):
+    # Runs in the render process; timestamps let the parent measure queue wait
+    started = time.time()
+    with profiler.track(f"render {fn.__name__}"):
+        result = fn(*args)
+    return started, time.time(), result
+
+
+class RenderPool:
+    """Separate render processes fed by a bounded job queue.
+
+    Request threads only wait on a future, so requests served from cache never
+    queue behind CPU-bound renders. At most queue_size jobs are admitted at once;
+    beyond that run() raises RenderQueueFull immediately so the API can answer
+    503 instead of piling up requests until gunicorn kills the worker.
+    """
+
+    def __init__(self, workers=RENDER_WORKERS, queue_size=RENDER_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = None
+        self._warmups = []
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.render_total = 0.0
+
+    def start(self):
+        """Create the render processes (otherwise done on first use)."""
+        with self._lock:
+            if self._executor is None:
+                # forkserver: never fork the threaded API worker itself
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                    initializer=init_render_worker,
+                )
+                # Processes are spawned on demand; one trivial job each starts them all now
+                self._warmups = [self._executor.submit(os.getpid) for _ in range(self.workers)]
+            return self._executor
+
+    def wait_ready(self, timeout=None):
+        """Block until every render process has preloaded its layers."""
+        self.start()
+        wait(self._warmups, timeout)
+
+    def _finished(self, future, submitted):
+        RENDER_QUEUE_DEPTH.dec()
+        with self._lock:
+            self.in_flight -= 1
+            try:
+                started, finished, _ = future.result()
+            except Exception:
+                self.failed += 1
+            else:
+                self.completed += 1
+                wait = max(started - submitted, 0.0)
+                RENDER_QUEUE_WAIT.observe(wait)
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+                self.render_total += finished - started
+        self._slots.release()
+
+    def run(self, fn, *args, timeout=RENDER_TIMEOUT):
+        """Run fn(*args) in a render process and wait for its result.
+
+        Raises RenderQueueFull when the queue is at capacity, TimeoutError when
+        the job is not done within timeout (the job itself keeps running) and
+        BrokenProcessPool when a render process died.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            RENDER_REJECTED.inc()
+            raise RenderQueueFull(f"Render queue full ({self.queue_size} jobs)")
+
+        executor = self.start()
+        submitted = time.time()
+        try:
+            future = executor.submit(_run_job, fn, args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._discard(executor)
+            raise
+        RENDER_QUEUE_DEPTH.inc()
+        with self._lock:
+            self.in_flight += 1
+            self.submitted += 1
+        future.add_done_callback(lambda f: self._finished(f, submitted))
+
+        try:
+            _, _, result = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise TimeoutError(f"Render not finished after {timeout}s")
+        except BrokenProcessPool:
+            # A render process died during this job
+            self._discard(executor)
+            raise
+        return result
+
+    def _discard(self, executor):
+        """Replace a pool whose render process died, so the next job gets a fresh one."""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "queue_depth": self.in_flight,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.wait_total / self.completed * 1000, 1) if self.completed else 0.0,
+                "max_wait_ms": round(self.wait_max * 1000, 1),
+                "avg_render_ms": round(self.render_total / self.completed * 1000, 1) if self.completed else 0.0,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,152 @@
+import time
+import logging
+import threading
+from collections import namedtuple
+from eth_abi import encode, decode
+from eth_utils import function_signature_to_4byte_selector
+from chain import CONTRACT_ADDRESS, RPC_MAX_ATTEMPTS, RPC_TIMEOUT, provider_pool
+
+logger = logging.getLogger(__name__)
+
+# Tokens per JSON-RPC batch (two eth_calls each); many public RPCs cap batch size
+BATCH_MAX_TOKENS = 50
+# How long the first caller waits for other lookups to join its batch
+BATCH_WINDOW = 0.01
+# How long callers who joined a batch wait for its leader: every failover attempt, plus slack
+BATCH_TIMEOUT = RPC_TIMEOUT * RPC_MAX_ATTEMPTS + 5
+
+OWNER_OF = function_signature_to_4byte_selector("ownerOf(uint256)")
+GET_TOKEN_DATA = function_signature_to_4byte_selector("getTokenData(uint256)")
+TOKEN_DATA_TYPES = ["uint256", "uint256", "uint256", "uint16", "uint16"]
+
+# On-chain state of a minted token
+TokenInfo = namedtuple("TokenInfo", ["owner", "seed", "period_id", "extraMints", "curveSteepness", "maxRebate"])
+
+
+class BatchRPCError(Exception):
+    """The endpoint failed the batch as a whole (not a per-call revert)."""
+
+
+def _eth_call(request_id, selector, token_id):
+    data = selector + encode(["uint256"], [token_id])
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "method": "eth_call",
+        "params": [{"to": CONTRACT_ADDRESS, "data": "0x" + data.hex()}, "latest"],
+    }
+
+
+def _is_revert(error):
+    # Nodes report reverts as code 3, or -32000/-32015 with "revert" in the message
+    return error.get("code") == 3 or "revert" in str(error.get("message", "")).lower()
+
+
+def _post_batch(endpoint, token_ids):
+    """Send ownerOf + getTokenData for every token as one JSON-RPC batch request."""
+    payload = []
+    for i, token_id in enumerate(token_ids):
+        payload.append(_eth_call(2 * i, OWNER_OF, token_id))
+        payload.append(_eth_call(2 * i + 1, GET_TOKEN_DATA, token_id))
+
+    response = endpoint.session.post(endpoint.url, json=payload, timeout=RPC_TIMEOUT)
+    response.raise_for_status()
+    replies = response.json()
+    if not isinstance(replies, list):
+        raise BatchRPCError(f"Batch requests not supported: {str(replies)[:200]}")
+
+    by_id = {reply.get("id"): reply for reply in replies}
+    results = {}
+    for i, token_id in enumerate(token_ids):
+        owner_reply = by_id.get(2 * i)
+        data_reply = by_id.get(2 * i + 1)
+        if owner_reply is None or data_reply is None:
+            raise BatchRPCError(f"Incomplete batch response for token {token_id}")
+
+        if "error" in owner_reply:
+            if not _is_revert(owner_reply["error"]):
+                raise BatchRPCError(f"ownerOf({token_id}) failed: {owner_reply['error']}")
+            results[token_id] = None  # ownerOf reverts for tokens that do not exist
+            continue
+        if "error" in data_reply:
+            raise BatchRPCError(f"getTokenData({token_id}) failed: {data_reply['error']}")
+
+        (owner,) = decode(["address"], bytes.fromhex(owner_reply["result"][2:]))
+        token_data = decode(TOKEN_DATA_TYPES, bytes.fromhex(data_reply["result"][2:]))
+        results[token_id] = TokenInfo(owner, *token_data)
+    return results
+
+
+def lookup_tokens(token_ids):
+    """Fetch owner and token data for many tokens in as few round trips as possible.
+
+    Returns {token_id: TokenInfo, or None if the token is not minted}.
+    """
+    token_ids = list(dict.fromkeys(token_ids))
+    results = {}
+    for i in range(0, len(token_ids), BATCH_MAX_TOKENS):
+        chunk = token_ids[i:i + BATCH_MAX_TOKENS]
+        results.update(provider_pool.call_endpoint(lambda endpoint: _post_batch(endpoint, chunk)))
+    return results
+
+
+class _PendingBatch:
+    def __init__(self):
+        self.token_ids = set()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class TokenBatcher:
+    """Coalesces concurrent single-token lookups into shared JSON-RPC batches.
+
+    The first caller opens a batch, waits BATCH_WINDOW for others to join, then
+    sends it; everyone who joined shares the result. Callers who joined raise
+    TimeoutError if the batch is not answered within timeout seconds.
+    """
+
+    def __init__(self, window=BATCH_WINDOW, max_tokens=BATCH_MAX_TOKENS, timeout=BATCH_TIMEOUT):
+        self.window = window
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def lookup(self, token_id):
+        """Return TokenInfo for a token, or None if it is not minted."""
+        with self._lock:
+            batch = self._pending
+            leader = batch is None
+            if leader:
+                batch = self._pending = _PendingBatch()
+            batch.token_ids.add(token_id)
+            if len(batch.token_ids) >= self.max_tokens:
+                self._pending = None  # Full: later callers open a new batch
+
+        if not leader:
+            if not batch.done.wait(self.timeout):
+                raise TimeoutError(f"RPC batch for token {token_id} not answered after {self.timeout}s")
+        else:
+            time.sleep(self.window)
+            with self._lock:
+                if self._pending is batch:
+                    self._pending = None
+            try:
+                batch.results = lookup_tokens(batch.token_ids)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[token_id]
+
+
+# Shared by every request in this process
+token_batcher = TokenBatcher()
+
+def lookup_token(token_id):
+    """Owner and token data for one token in a single (shared) round trip."""
+    return token_batcher.lookup(token_id)
@@ -0,0 +1,105 @@
+import os
+import time
+import zlib
+import fcntl
+import tempfile
+import threading
+
+# Where the cross-process lock files live
+LOCK_DIR = os.getenv("SINGLEFLIGHT_LOCK_DIR", os.path.join(tempfile.gettempdir(), "chanclas_locks"))
+# Keys are hashed onto a fixed set of lock files so the directory never grows
+LOCK_STRIPES = 256
+# Give up before gunicorn's 30s worker timeout
+SINGLEFLIGHT_TIMEOUT = 25
+
+
+class _Call:
+    """An in-flight call that other threads can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run at most one call per key at a time, across threads and processes.
+
+    Threads in the same process that ask for a key already in flight wait for the
+    leader and share its result (or exception). Leaders in different processes are
+    serialized by an flock on a striped lock file, so the work function should first
+    check whether another process already finished the job while it was waiting.
+    A work function that leaves part of the job in the background calls hold() so
+    other processes keep waiting until it is done.
+    """
+
+    def __init__(self, lock_dir=LOCK_DIR, timeout=SINGLEFLIGHT_TIMEOUT):
+        self.lock_dir = lock_dir
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(lock_dir, exist_ok=True)
+
+    def do(self, key, fn):
+        """Call fn() unless a call for key is already running, then share its result."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(self.timeout):
+                raise TimeoutError(f"Timed out waiting for in-flight call {key}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            lock_file = self._acquire(key)
+            outer, self._local.hold = getattr(self._local, "hold", None), None
+            try:
+                call.result = fn()
+            finally:
+                hold, self._local.hold = self._local.hold, outer
+                if hold is None:
+                    self._release(lock_file)
+                else:
+                    hold.add_done_callback(lambda _: self._release(lock_file))
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def hold(self, future):
+        """Called from the work function: keep the cross-process lock until future is done.
+
+        Threads of this process get the result as soon as the work function
+        returns; other processes wait for the lock, then find the job finished.
+        """
+        self._local.hold = future
+
+    def _acquire(self, key):
+        path = os.path.join(self.lock_dir, f"{zlib.crc32(str(key).encode()) % LOCK_STRIPES}.lock")
+        deadline = time.monotonic() + self.timeout
+        lock_file = open(path, "a")
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock_file
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    lock_file.close()
+                    raise TimeoutError(f"Timed out waiting for lock on {key}")
+                time.sleep(0.05)
+
+    def _release(self, lock_file):
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            lock_file.close()
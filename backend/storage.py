@@ -0,0 +1,386 @@
+import os
+import sys
+import hashlib
+import logging
+import tempfile
+import argparse
+import threading
+from collections import OrderedDict
+from metrics import cache_counters, stage
+
+logger = logging.getLogger(__name__)
+
+# Where rendered images, metadata and variants are kept: "local" or "s3"
+ARTIFACT_STORAGE = os.getenv("ARTIFACT_STORAGE", "local")
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "./output")
+SHARD_LEVELS = int(os.getenv("ARTIFACT_SHARD_LEVELS", "2"))  # Directory levels of 256 entries each
+
+# S3-compatible bucket (AWS, MinIO, R2, ...) shared by several API nodes
+S3_BUCKET = os.getenv("S3_BUCKET", "chanclas")
+S3_PREFIX = os.getenv("S3_PREFIX", "tokens/")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # None means AWS
+
+# Read-through tiers in front of a remote backend
+ARTIFACT_CACHE_MB = int(os.getenv("ARTIFACT_CACHE_MB", "64"))
+ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR", "./artifact_cache")
+MAX_MEMORY_OBJECT = 1024 * 1024  # Larger artifacts (full-size PNGs) only go to the disk tier
+
+CONTENT_TYPES = {".png": "image/png", ".webp": "image/webp", ".json": "application/json"}
+
+MEMORY_HITS, MEMORY_MISSES = cache_counters("artifact_memory")
+DISK_HITS, DISK_MISSES = cache_counters("artifact_disk")
+
+
+def image_key(token_id):
+    return f"{token_id}.png"
+
+
+def metadata_key(token_id):
+    return f"{token_id}.json"
+
+
+def token_stored(storage, token_id):
+    """A token is done once both its metadata and image are stored."""
+    return storage.exists(metadata_key(token_id)) and storage.exists(image_key(token_id))
+
+
+def content_type(key):
+    return CONTENT_TYPES.get(os.path.splitext(key)[1], "application/octet-stream")
+
+
+def content_etag(data):
+    """HTTP validator of an artifact: the SHA-1 of its bytes."""
+    return hashlib.sha1(data).hexdigest()
+
+
+def atomic_write(path, write):
+    """Write a file through write(f) so readers only ever see the complete content."""
+    directory = os.path.dirname(path) or "."
+    with tempfile.NamedTemporaryFile(dir=directory, prefix=".tmp_", delete=False) as f:
+        try:
+            write(f)
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    os.chmod(f.name, 0o644)  # Temp files are created private
+    os.replace(f.name, path)
+
+
+class LocalStorage:
+    """Artifacts as files under root, spread over hashed subdirectories.
+
+    All artifacts of a token ({id}.png, {id}.json, {id}_256.webp, ...) share one
+    directory, picked from the hash of the token ID, so no directory grows past a
+    few thousand entries however large the collection gets. Each file has an
+    .etag sidecar holding its content hash. Writes are atomic.
+    """
+
+    name = "local"
+
+    def __init__(self, root=ARTIFACT_DIR, levels=SHARD_LEVELS):
+        # Absolute, so send_file() does not resolve it against the app directory
+        self.root = os.path.abspath(root)
+        self.levels = levels
+
+    def shard(self, key):
+        token = key.partition(".")[0].partition("_")[0]
+        digest = hashlib.sha1(token.encode()).hexdigest()
+        return os.path.join(*(digest[2 * i:2 * i + 2] for i in range(self.levels))) if self.levels else ""
+
+    def path(self, key):
+        return os.path.join(self.root, self.shard(key), key)
+
+    def local_path(self, key):
+        """Path of the file to serve with send_file(), or None if it does not exist."""
+        path = self.path(key)
+        return path if os.path.exists(path) else None
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def get(self, key):
+        try:
+            with open(self.path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data, etag=None):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # ETag first, so whoever sees the artifact also finds its ETag
+        atomic_write(path + ".etag", lambda f: f.write((etag or content_etag(data)).encode()))
+        atomic_write(path, lambda f: f.write(data))
+
+    def etag(self, key):
+        """Content hash of an artifact, from its sidecar or hashed once; None if missing."""
+        path = self.path(key)
+        try:
+            with open(path + ".etag", "r") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            pass
+        # Artifact written before ETags were stored: hash it and keep the result
+        data = self.get(key)
+        if data is None:
+            return None
+        etag = content_etag(data)
+        atomic_write(path + ".etag", lambda f: f.write(etag.encode()))
+        return etag
+
+    def stats(self):
+        return {"backend": self.name, "root": self.root, "shard_levels": self.levels}
+
+
+class S3Storage:
+    """Artifacts as objects in an S3-compatible bucket, shared by every API node.
+
+    The content hash is stored as object metadata so nodes serve the same
+    ETags. boto3 is only imported when the backend is used; pass client= to use
+    another S3 client, e.g. a fake in tests.
+    """
+
+    name = "s3"
+
+    def __init__(self, bucket=S3_BUCKET, prefix=S3_PREFIX, endpoint_url=S3_ENDPOINT_URL, client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self._s3 = client
+        self._pid = os.getpid() if client is not None else None
+
+    def _client(self):
+        # Clients hold connection pools, which must not be shared across fork
+        if self._s3 is None or self._pid != os.getpid():
+            import boto3
+
+            self._s3 = boto3.client("s3", endpoint_url=self.endpoint_url)
+            self._pid = os.getpid()
+        return self._s3
+
+    def _is_missing(self, error):
+        response = getattr(error, "response", None) or {}
+        return response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+    def local_path(self, key):
+        return None
+
+    def exists(self, key):
+        return self._head(key) is not None
+
+    def _head(self, key):
+        try:
+            return self._client().head_object(Bucket=self.bucket, Key=self.prefix + key)
+        except Exception as e:
+            if self._is_missing(e):
+                return None
+            raise
+
+    def get(self, key):
+        try:
+            with stage("storage_read"):
+                response = self._client().get_object(Bucket=self.bucket, Key=self.prefix + key)
+                return response["Body"].read()
+        except Exception as e:
+            if self._is_missing(e):
+                return None
+            raise
+
+    def put(self, key, data, etag=None):
+        with stage("storage_write"):
+            self._client().put_object(
+                Bucket=self.bucket, Key=self.prefix + key, Body=data, ContentType=content_type(key),
+                Metadata={"etag": etag or content_etag(data)},
+            )
+
+    def etag(self, key):
+        head = self._head(key)
+        if head is None:
+            return None
+        return head.get("Metadata", {}).get("etag") or head.get("ETag", "").strip('"')
+
+    def stats(self):
+        return {"backend": self.name, "bucket": self.bucket, "prefix": self.prefix, "endpoint": self.endpoint_url}
+
+
+class TieredStorage:
+    """Read-through memory and local-disk tiers in front of a shared backend.
+
+    Reads try a byte-bounded in-memory LRU (small artifacts only), then a local
+    disk mirror, then the backend, and fill the faster tiers on the way back.
+    Writes go to the backend first, so other nodes see them, then to the local
+    tiers. Artifacts never change once written, so cached copies need no
+    invalidation; only hits are cached, since another node may store a missing
+    artifact at any time.
+    """
+
+    def __init__(self, backend, memory_bytes=ARTIFACT_CACHE_MB * 1024 * 1024, disk=None):
+        self.backend = backend
+        self.name = backend.name
+        self.memory_bytes = memory_bytes
+        self.disk = disk
+        self.size_bytes = 0
+        self._entries = OrderedDict()  # key -> (data, etag)
+        self._lock = threading.Lock()
+
+    def _remember(self, key, data, etag):
+        if len(data) > MAX_MEMORY_OBJECT or len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size_bytes -= len(old[0])
+            self._entries[key] = (data, etag)
+            self.size_bytes += len(data)
+            while self.size_bytes > self.memory_bytes and self._entries:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size_bytes -= len(evicted)
+
+    def _recall(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        (MEMORY_HITS if entry is not None else MEMORY_MISSES).inc()
+        return entry
+
+    def _fetch(self, key):
+        """(data, etag) from the disk tier or the backend, filling the local tiers; None if missing."""
+        if self.disk is not None:
+            data = self.disk.get(key)
+            (DISK_HITS if data is not None else DISK_MISSES).inc()
+            if data is not None:
+                return data, self.disk.etag(key)
+        data = self.backend.get(key)
+        if data is None:
+            return None
+        etag = self.backend.etag(key) or content_etag(data)
+        if self.disk is not None:
+            self.disk.put(key, data, etag)
+        return data, etag
+
+    def get(self, key):
+        entry = self._recall(key)
+        if entry is None:
+            entry = self._fetch(key)
+            if entry is None:
+                return None
+            self._remember(key, *entry)
+        return entry[0]
+
+    def exists(self, key):
+        if self._recall(key) is not None:
+            return True
+        if self.disk is not None and self.disk.exists(key):
+            return True
+        return self.backend.exists(key)
+
+    def put(self, key, data, etag=None):
+        etag = etag or content_etag(data)
+        self.backend.put(key, data, etag)
+        if self.disk is not None:
+            self.disk.put(key, data, etag)
+        self._remember(key, data, etag)
+
+    def etag(self, key):
+        entry = self._recall(key)
+        if entry is not None:
+            return entry[1]
+        if self.disk is not None and self.disk.exists(key):
+            return self.disk.etag(key)
+        return self.backend.etag(key)
+
+    def local_path(self, key):
+        """A local file for send_file(), pulled into the disk tier if needed; None without one."""
+        if self.disk is None:
+            return self.backend.local_path(key)
+        path = self.disk.local_path(key)
+        if path is None and self._fetch(key) is not None:
+            path = self.disk.local_path(key)
+        return path
+
+    def stats(self):
+        with self._lock:
+            memory = {"entries": len(self._entries), "size_mb": round(self.size_bytes / 1024 / 1024, 2),
+                      "budget_mb": round(self.memory_bytes / 1024 / 1024, 2)}
+        return {
+            "backend": self.backend.stats(),
+            "memory": memory,
+            "disk": self.disk.stats() if self.disk is not None else None,
+        }
+
+
+def open_storage(backend=ARTIFACT_STORAGE, directory=None):
+    """The configured artifact storage. directory overrides ARTIFACT_DIR for the local backend."""
+    if backend == "local":
+        return LocalStorage(directory or ARTIFACT_DIR)
+    if backend == "s3":
+        disk = LocalStorage(ARTIFACT_CACHE_DIR) if ARTIFACT_CACHE_DIR else None
+        return TieredStorage(S3Storage(), disk=disk)
+    raise ValueError(f"Unknown artifact storage '{backend}', expected 'local' or 's3'")
+
+
+_default_storage = None
+
+
+def default_storage():
+    """This process's storage from the environment, opened on first use (e.g. in render processes)."""
+    global _default_storage
+    if _default_storage is None:
+        _default_storage = open_storage()
+    return _default_storage
+
+
+def migrate_flat(source, storage):
+    """Move artifacts from a flat directory ({id}.png, {id}.json, ...) into storage.
+
+    Files already in a shard subdirectory are left alone, so this can run on
+    every start. Local targets get the files renamed into place; others get
+    them uploaded and then deleted.
+    """
+    moved = 0
+    try:
+        names = sorted(os.listdir(source))
+    except FileNotFoundError:
+        return 0
+    for name in names:
+        path = os.path.join(source, name)
+        if not os.path.isfile(path) or name.endswith(".etag") or name.startswith(".tmp_"):
+            continue
+        etag = None
+        if os.path.exists(path + ".etag"):
+            with open(path + ".etag", "r") as f:
+                etag = f.read().strip()
+        if isinstance(storage, LocalStorage):
+            target = storage.path(name)
+            if target == os.path.abspath(path):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if etag is not None:
+                os.replace(path + ".etag", target + ".etag")
+            os.replace(path, target)
+        else:
+            with open(path, "rb") as f:
+                storage.put(name, f.read(), etag)
+            os.remove(path)
+            if etag is not None:
+                os.remove(path + ".etag")
+        moved += 1
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move flat ./output artifacts into the configured storage")
+    parser.add_argument("--source", default=ARTIFACT_DIR, help=f"Flat directory to migrate (default {ARTIFACT_DIR})")
+    args = parser.parse_args()
+
+    storage = open_storage()
+    moved = migrate_flat(args.source, storage)
+    logger.info(f"Moved {moved} artifacts from {args.source} into {storage.name} storage")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
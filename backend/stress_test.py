@@ -1,12 +1,14 @@
+import sys
+import json
+import math
 import time
-import psutil
-import os
 import random
-from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import logging
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import argparse
+from collections import Counter
+import psutil
+import aiohttp
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -14,124 +16,356 @@ logger = logging.getLogger(__name__)
 
 # Configuration
 API_BASE_URL = "http://localhost:3000"
-NUM_REQUESTS = 50  # Total number of requests to make
-CONCURRENT_REQUESTS = 4  # Number of concurrent requests
-TOKEN_RANGE = (1, 1000)  # Range of token IDs to test
-REQUEST_TIMEOUT = 30  # Timeout for API requests
-
-def get_memory_usage():
-    """Get current memory usage in MB"""
-    process = psutil.Process(os.getpid())
-    return process.memory_info().rss / 1024 / 1024
-
-def create_session():
-    """Create a requests session with retry logic"""
-    session = requests.Session()
-    retry = Retry(
-        total=3,
-        backoff_factor=0.1,
-        status_forcelist=[500, 502, 503, 504]
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
-    return session
-
-def make_api_request(token_id, session):
-    """Make a request to the API for a specific token"""
-    start_time = time.time()
-    try:
-        # First get metadata
-        metadata_response = session.get(
-            f"{API_BASE_URL}/test/generate/{token_id}",
-            timeout=REQUEST_TIMEOUT
-        )
-        metadata_time = time.time() - start_time
-        
-        if metadata_response.status_code == 200:
-            # Then get image
-            image_start = time.time()
-            image_response = session.get(
-                f"{API_BASE_URL}/test/image/{token_id}",
-                timeout=REQUEST_TIMEOUT
-            )
-            image_time = time.time() - image_start
-            
-            return {
-                'token_id': token_id,
-                'metadata_status': metadata_response.status_code,
-                'metadata_time': metadata_time,
-                'image_status': image_response.status_code,
-                'image_time': image_time,
-                'success': True
-            }
-        else:
-            return {
-                'token_id': token_id,
-                'metadata_status': metadata_response.status_code,
-                'metadata_time': metadata_time,
-                'success': False
+SCHEDULE = "10:30,25:30,50:30"  # requests/s:seconds steps
+MIX = "hot=0.8,cold=0.1,unminted=0.1"  # Share of each traffic profile
+HOT_IDS = (0, 100)  # Tokens fetched before the run, then served from cache
+COLD_START = 1000  # First token ID used for new mints; each is requested once
+UNMINTED_START = 10 ** 9  # Probed IDs are drawn above this
+IMAGE_FRACTION = 0.5  # Share of hot and cold requests that ask for the image instead of metadata
+CLIENTS = 256  # Distinct client IPs sent in CF-Connecting-IP, as through the tunnel
+MAX_CONNECTIONS = 512  # Open connections at most; further requests wait for one (and that wait is counted)
+REQUEST_TIMEOUT = 30  # Same as gunicorn's worker timeout
+SAMPLE_INTERVAL = 1.0  # Seconds between server RSS/CPU samples
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram:
+    """Latencies in microseconds, bucketed to three significant digits.
+
+    Like an HdrHistogram: memory is bounded by the value range, not the sample
+    count, and every percentile, including the tail, is reported at most 1% above
+    the true latency (the upper bound of its bucket).
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds):
+        micros = max(1, int(seconds * 1_000_000))
+        # Keep the three leading digits, so buckets widen with the value
+        scale = 10 ** max(0, len(str(micros)) - 3)
+        self.counts[(micros // scale + 1) * scale] += 1
+        self.total += 1
+        self.max = max(self.max, micros)
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """Upper bound, in milliseconds, of the bucket holding the given percentile."""
+        if not self.total:
+            return None
+        rank = max(1, math.ceil(self.total * percent / 100))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(bucket, self.max) / 1000
+        return self.max / 1000
+
+    def summary(self):
+        result = {f"p{percent:g}_ms": self.percentile(percent) for percent in PERCENTILES}
+        result["max_ms"] = self.max / 1000 if self.total else None
+        return result
+
+
+class Stats:
+    """Outcome of the requests of one schedule step, per traffic profile."""
+
+    def __init__(self):
+        self.latency = {}  # Profile -> LatencyHistogram, from the scheduled send time
+        self.service = {}  # Profile -> LatencyHistogram, from the actual send time
+        self.statuses = {}  # Profile -> Counter of status codes and error names
+        self.late = 0  # Requests the generator itself sent over 10 ms behind schedule
+
+    def record(self, profile, status, latency, service):
+        self.latency.setdefault(profile, LatencyHistogram()).record(latency)
+        self.service.setdefault(profile, LatencyHistogram()).record(service)
+        self.statuses.setdefault(profile, Counter())[str(status)] += 1
+
+    def summary(self, duration):
+        profiles = {}
+        total = LatencyHistogram()
+        for profile, histogram in sorted(self.latency.items()):
+            total.merge(histogram)
+            profiles[profile] = {
+                "requests": histogram.total,
+                "statuses": dict(self.statuses[profile]),
+                "latency": histogram.summary(),
+                "service": self.service[profile].summary(),
             }
-    except Exception as e:
         return {
-            'token_id': token_id,
-            'error': str(e),
-            'success': False
+            "requests": total.total,
+            "achieved_rps": round(total.total / duration, 2) if duration else None,
+            "late_sends": self.late,
+            "latency": total.summary(),
+            "profiles": profiles,
         }
 
-def run_stress_test():
-    """Run the stress test"""
-    logger.info("Starting API stress test...")
-    logger.info(f"Initial memory usage: {get_memory_usage():.2f} MB")
-    
-    start_time = time.time()
-    results = []
-    
-    # Generate random token IDs
-    token_ids = [random.randint(TOKEN_RANGE[0], TOKEN_RANGE[1]) for _ in range(NUM_REQUESTS)]
-    
-    # Run concurrent requests
-    with ThreadPoolExecutor(max_workers=CONCURRENT_REQUESTS) as executor:
-        # Create a session for each worker to simulate different clients
-        sessions = [create_session() for _ in range(CONCURRENT_REQUESTS)]
-        
-        # Submit requests using different sessions to simulate different clients
-        futures = [
-            executor.submit(make_api_request, token_id, sessions[i % CONCURRENT_REQUESTS])
-            for i, token_id in enumerate(token_ids)
-        ]
-        
-        for future in futures:
-            result = future.result()
-            results.append(result)
-            
-            # Log progress
-            if result['success']:
-                logger.info(
-                    f"Token {result['token_id']}: "
-                    f"Metadata={result['metadata_time']:.2f}s, "
-                    f"Image={result['image_time']:.2f}s"
-                )
-            else:
-                logger.error(f"Token {result['token_id']} failed: {result.get('error', 'Unknown error')}")
-    
-    # Calculate statistics
-    total_time = time.time() - start_time
-    successful_requests = sum(1 for r in results if r['success'])
-    failed_requests = NUM_REQUESTS - successful_requests
-    
-    metadata_times = [r['metadata_time'] for r in results if r['success']]
-    image_times = [r['image_time'] for r in results if r['success']]
-    
-    logger.info("\nStress Test Results:")
-    logger.info(f"Total time: {total_time:.2f} seconds")
-    logger.info(f"Successful requests: {successful_requests}")
-    logger.info(f"Failed requests: {failed_requests}")
-    if metadata_times:
-        logger.info(f"Average metadata time: {sum(metadata_times)/len(metadata_times):.2f} seconds")
-    if image_times:
-        logger.info(f"Average image time: {sum(image_times)/len(image_times):.2f} seconds")
-    logger.info(f"Final memory usage: {get_memory_usage():.2f} MB")
+
+class TrafficMix:
+    """Picks the next request (profile, path) according to the mix."""
+
+    def __init__(self, mix, hot_ids, cold_start, unminted_start, image_fraction, rng):
+        self.profiles = list(mix)
+        self.weights = [mix[profile] for profile in self.profiles]
+        self.hot_ids = hot_ids
+        self.next_cold = cold_start
+        self.unminted_start = unminted_start
+        self.image_fraction = image_fraction
+        self.rng = rng
+
+    def _resource(self):
+        return "image" if self.rng.random() < self.image_fraction else "id"
+
+    def next(self):
+        profile = self.rng.choices(self.profiles, weights=self.weights, k=1)[0]
+        if profile == "hot":
+            return profile, f"/{self._resource()}/{self.rng.choice(self.hot_ids)}"
+        if profile == "cold":
+            token_id, self.next_cold = self.next_cold, self.next_cold + 1
+            return profile, f"/{self._resource()}/{token_id}"
+        if profile == "unminted":
+            return profile, f"/id/{self.unminted_start + self.rng.randrange(10 ** 9)}"
+        raise ValueError(f"Unknown traffic profile '{profile}'")
+
+
+def parse_schedule(text):
+    """'10:30,50:60' -> [(10.0, 30.0), (50.0, 60.0)]: rate in requests/s and duration in seconds."""
+    steps = []
+    for step in text.split(","):
+        rate, duration = step.split(":")
+        steps.append((float(rate), float(duration)))
+    return steps
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        profile, share = part.split("=")
+        mix[profile.strip()] = float(share)
+    return mix
+
+
+def find_gunicorn_pid():
+    """PID of the gunicorn master serving the API, or None."""
+    for process in psutil.process_iter(["pid", "ppid", "cmdline"]):
+        cmdline = " ".join(process.info["cmdline"] or [])
+        if "gunicorn" in cmdline and "api:app" in cmdline:
+            try:
+                parent = psutil.Process(process.info["ppid"])
+                if "gunicorn" in " ".join(parent.cmdline()):
+                    continue
+            except psutil.Error:
+                pass
+            return process.info["pid"]
+    return None
+
+
+class ServerSampler:
+    """Samples RSS and CPU of the gunicorn master and all its descendants.
+
+    Workers and render processes come and go (max_requests recycling), so the
+    process tree is walked again on every sample.
+    """
+
+    def __init__(self, pid, interval=SAMPLE_INTERVAL):
+        self.root = psutil.Process(pid)
+        self.interval = interval
+        self.samples = []
+        self._processes = {}
+
+    def _tree(self):
+        processes = [self.root] + self.root.children(recursive=True)
+        current = {}
+        for process in processes:
+            # Keep the same Process objects so cpu_percent() measures since the last sample
+            current[process.pid] = self._processes.get(process.pid, process)
+        self._processes = current
+        return current.values()
+
+    def sample(self):
+        rss, cpu, count = 0, 0.0, 0
+        for process in self._tree():
+            try:
+                with process.oneshot():
+                    rss += process.memory_info().rss
+                    cpu += process.cpu_percent()
+                count += 1
+            except psutil.Error:
+                continue
+        self.samples.append({"time": time.time(), "rss_mb": round(rss / 1024 / 1024, 1),
+                             "cpu_percent": round(cpu, 1), "processes": count})
+
+    async def run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def summary(self, since, until):
+        window = [s for s in self.samples if since <= s["time"] <= until][1:]  # First CPU sample is always 0
+        if not window:
+            return None
+        return {
+            "rss_mb_max": max(s["rss_mb"] for s in window),
+            "rss_mb_mean": round(sum(s["rss_mb"] for s in window) / len(window), 1),
+            "cpu_percent_max": max(s["cpu_percent"] for s in window),
+            "cpu_percent_mean": round(sum(s["cpu_percent"] for s in window) / len(window), 1),
+            "processes_max": max(s["processes"] for s in window),
+        }
+
+
+async def send(session, base_url, profile, path, client, scheduled, stats):
+    started = time.perf_counter()
+    try:
+        async with session.get(base_url + path, headers={"CF-Connecting-IP": client}) as response:
+            await response.read()
+            status = response.status
+    except asyncio.TimeoutError:
+        status = "timeout"
+    except aiohttp.ClientError as e:
+        status = type(e).__name__
+    finished = time.perf_counter()
+    stats.record(profile, status, finished - scheduled, finished - started)
+
+
+async def run_step(session, base_url, rate, duration, mix, clients, poisson, rng):
+    """Send requests at the given rate for duration seconds, whatever the responses take.
+
+    Each request is started at its scheduled time regardless of how many are
+    still in flight, and its latency is measured from that time, so a server
+    falling behind shows up as latency instead of as fewer requests sent.
+    """
+    stats = Stats()
+    tasks = set()
+    start = time.perf_counter()
+    scheduled = start
+    while scheduled < start + duration:
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif delay < -0.01:
+            stats.late += 1
+        profile, path = mix.next()
+        task = asyncio.create_task(send(session, base_url, profile, path, rng.choice(clients), scheduled, stats))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        scheduled += rng.expovariate(rate) if poisson else 1 / rate
+    if tasks:
+        await asyncio.wait(tasks)
+    return stats
+
+
+async def warm_hot_ids(session, base_url, hot_ids, image_fraction, clients):
+    """Request every hot ID once so the run measures cached responses."""
+    resources = ["id"] + (["image"] if image_fraction > 0 else [])
+    semaphore = asyncio.Semaphore(4)
+    statuses = Counter()
+
+    async def fetch(path, client):
+        async with semaphore:
+            async with session.get(base_url + path, headers={"CF-Connecting-IP": client}) as response:
+                await response.read()
+                statuses[response.status] += 1
+
+    paths = [f"/{resource}/{token_id}" for token_id in hot_ids for resource in resources]
+    # Spread over the clients like the run itself, so warming is not rate limited
+    await asyncio.gather(*(fetch(path, clients[i % len(clients)]) for i, path in enumerate(paths)))
+    return statuses
+
+
+def log_summary(label, summary):
+    latency = summary["latency"]
+    logger.info(
+        f"{label}: {summary['requests']} requests at {summary['achieved_rps']}/s, "
+        f"p50 {latency['p50_ms']} ms, p99 {latency['p99_ms']} ms, p99.9 {latency['p99.9_ms']} ms, "
+        f"max {latency['max_ms']} ms, {summary['late_sends']} late sends"
+    )
+    for profile, result in summary["profiles"].items():
+        latency = result["latency"]
+        logger.info(
+            f"  {profile:9} {result['requests']:7} requests  p50 {latency['p50_ms']} ms  "
+            f"p99 {latency['p99_ms']} ms  p99.9 {latency['p99.9_ms']} ms  statuses {result['statuses']}"
+        )
+    if summary.get("server"):
+        server = summary["server"]
+        logger.info(
+            f"  server    RSS max {server['rss_mb_max']} MB (mean {server['rss_mb_mean']}), "
+            f"CPU max {server['cpu_percent_max']}% (mean {server['cpu_percent_mean']}%), "
+            f"{server['processes_max']} processes"
+        )
+
+
+async def run_stress_test(args):
+    """Run the schedule step by step and return the report."""
+    rng = random.Random(args.seed)
+    hot_ids = list(range(*args.hot_ids))
+    mix = TrafficMix(parse_mix(args.mix), hot_ids, args.cold_start, args.unminted_start, args.image_fraction, rng)
+    clients = [f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}" for i in range(args.clients)]
+
+    pid = args.pid or find_gunicorn_pid()
+    sampler = ServerSampler(pid) if pid else None
+    if sampler is None:
+        logger.warning("No gunicorn process found, server RSS/CPU will not be sampled (use --pid)")
+
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=args.connections)
+    report = {"config": vars(args), "gunicorn_pid": pid, "steps": []}
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        if hot_ids and not args.no_warm:
+            logger.info(f"Warming {len(hot_ids)} hot tokens")
+            statuses = await warm_hot_ids(session, args.url, hot_ids, args.image_fraction, clients)
+            logger.info(f"Warm-up responses: {dict(statuses)}")
+
+        sampling = asyncio.create_task(sampler.run()) if sampler else None
+        for rate, duration in parse_schedule(args.schedule):
+            logger.info(f"Sending {rate:g} requests/s for {duration:g} s")
+            since = time.time()
+            step_started = time.perf_counter()
+            stats = await run_step(session, args.url, rate, duration, mix, clients, args.poisson, rng)
+            summary = stats.summary(time.perf_counter() - step_started)
+            summary["target_rps"] = rate
+            summary["server"] = sampler.summary(since, time.time()) if sampler else None
+            log_summary(f"{rate:g} requests/s", summary)
+            report["steps"].append(summary)
+        if sampling:
+            sampling.cancel()
+
+    if sampler:
+        report["server_samples"] = sampler.samples
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load test of the API with latency percentiles")
+    parser.add_argument("--url", default=API_BASE_URL)
+    parser.add_argument("--schedule", default=SCHEDULE, help=f"rate:seconds steps (default {SCHEDULE})")
+    parser.add_argument("--poisson", action="store_true", help="Exponential gaps between requests instead of even spacing")
+    parser.add_argument("--mix", default=MIX, help=f"Traffic profile shares (default {MIX})")
+    parser.add_argument("--hot-ids", type=int, nargs=2, default=HOT_IDS, metavar=("START", "END"))
+    parser.add_argument("--cold-start", type=int, default=COLD_START, help="First token ID requested as a new mint")
+    parser.add_argument("--unminted-start", type=int, default=UNMINTED_START)
+    parser.add_argument("--image-fraction", type=float, default=IMAGE_FRACTION)
+    parser.add_argument("--clients", type=int, default=CLIENTS, help="Distinct client IPs to spread requests over")
+    parser.add_argument("--connections", type=int, default=MAX_CONNECTIONS)
+    parser.add_argument("--no-warm", action="store_true", help="Do not request the hot tokens before the run")
+    parser.add_argument("--pid", type=int, help="gunicorn master PID to sample (found automatically by default)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", "-o", help="Write the report, with every server sample, as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_stress_test(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Report written to {args.output}")
+    return 0
+
 
 if __name__ == "__main__":
-    run_stress_test() 
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,142 @@
+import sys
+import json
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from eth_abi import encode
+from eth_utils import keccak
+
+logger = logging.getLogger(__name__)
+
+# Tokens 0..STUB_MINTED-1 exist on the stub chain
+STUB_MINTED = 100000
+STUB_HEAD_BLOCK = 10_000_000
+STUB_OWNER = "0x" + "11" * 20
+# Minted event topic, as in indexer.py
+MINTED_TOPIC = "0x" + keccak(text="Minted(address,uint256,uint256,uint256)").hex()
+
+SELECTORS = {
+    keccak(text=signature)[:4].hex(): signature
+    for signature in ("ownerOf(uint256)", "getTokenData(uint256)", "currentTokenId()")
+}
+
+
+def stub_token_data(token_id):
+    """Deterministic (seed, period_id, extraMints, curveSteepness, maxRebate) of a stub token."""
+    return 1000 + token_id * 7919, 0, token_id % 7, 1 + token_id % 3, (token_id % 5) * 10
+
+
+class StubChain:
+    """Answers the JSON-RPC calls the backend makes, for benchmarks and load tests.
+
+    Covers eth_call of ownerOf/getTokenData/currentTokenId (ownerOf reverts for
+    unminted tokens like the real contract), eth_blockNumber, eth_chainId and
+    eth_getLogs of Minted events (one mint per block from block 1000), single or
+    batched. Nothing here is signed or checked; it is not a node.
+    """
+
+    def __init__(self, minted=STUB_MINTED, head_block=STUB_HEAD_BLOCK):
+        self.minted = minted
+        self.head_block = head_block
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def mint_block(self, token_id):
+        return 1000 + token_id
+
+    def eth_call(self, data):
+        selector, argument = data[2:10], bytes.fromhex(data[10:])
+        signature = SELECTORS.get(selector)
+        if signature == "currentTokenId()":
+            return "0x" + encode(["uint256"], [self.minted]).hex()
+        token_id = int.from_bytes(argument[:32], "big")
+        if signature == "ownerOf(uint256)":
+            if token_id >= self.minted:
+                # ERC721NonexistentToken(uint256)
+                error = "0x7e273289" + encode(["uint256"], [token_id]).hex()
+                return {"code": 3, "message": "execution reverted", "data": error}
+            return "0x" + encode(["address"], [STUB_OWNER]).hex()
+        if signature == "getTokenData(uint256)":
+            data = stub_token_data(token_id) if token_id < self.minted else (0, 0, 0, 0, 0)
+            return "0x" + encode(["uint256", "uint256", "uint256", "uint16", "uint16"], list(data)).hex()
+        return {"code": -32000, "message": f"Unknown selector {selector}"}
+
+    def get_logs(self, log_filter):
+        start, end = int(log_filter["fromBlock"], 16), int(log_filter["toBlock"], 16)
+        first = max(start - self.mint_block(0), 0)
+        last = min(end - self.mint_block(0), self.minted - 1)
+        return [
+            {
+                "blockNumber": hex(self.mint_block(token_id)),
+                "topics": [MINTED_TOPIC, "0x" + "00" * 12 + STUB_OWNER[2:], "0x%064x" % token_id],
+                "data": "0x",
+            }
+            for token_id in range(first, last + 1)
+        ]
+
+    def handle(self, request):
+        with self._lock:
+            self.requests += 1
+        method, params = request.get("method"), request.get("params") or []
+        if method == "eth_chainId":
+            result = "0x2105"  # Base
+        elif method == "eth_blockNumber":
+            result = hex(self.head_block)
+        elif method == "eth_call":
+            result = self.eth_call(params[0].get("data") or params[0].get("input"))
+        elif method == "eth_getLogs":
+            result = self.get_logs(params[0])
+        else:
+            result = {"code": -32601, "message": f"Method {method} not found"}
+        if isinstance(result, dict):
+            return {"jsonrpc": "2.0", "id": request.get("id"), "error": result}
+        return {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+
+
+def make_handler(chain):
+    class StubRPCHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if isinstance(body, list):
+                response = [chain.handle(request) for request in body]
+            else:
+                response = chain.handle(body)
+            data = json.dumps(response).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return StubRPCHandler
+
+
+def start_stub_rpc(chain=None, host="127.0.0.1", port=0):
+    """Serve a StubChain from a background thread. Returns (url, server)."""
+    chain = chain or StubChain()
+    server = ThreadingHTTPServer((host, port), make_handler(chain))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-rpc", daemon=True).start()
+    return f"http://{host}:{server.server_address[1]}", server
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Serve a stub Chanclas chain over JSON-RPC")
+    parser.add_argument("--port", type=int, default=8545)
+    parser.add_argument("--minted", type=int, default=STUB_MINTED, help="Number of minted tokens")
+    args = parser.parse_args()
+
+    url, server = start_stub_rpc(StubChain(args.minted), port=args.port)
+    logger.info(f"Stub RPC with {args.minted} minted tokens at {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
@@ -0,0 +1,20 @@
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The backend modules import each other by name and read Chanclas_ABI.json and
+# rarities/ from the working directory, as they do under gunicorn
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)
+
+# Keep the state files of modules imported by the tests out of the working tree
+STATE_DIR = tempfile.mkdtemp(prefix="chanclas_tests_")
+for name, filename in (("ARTIFACT_DIR", "output"), ("ARTIFACT_CACHE_DIR", "artifact_cache"),
+                       ("TOKEN_INDEX_DB", "token_index.db"), ("OPENSEA_QUEUE_DB", "opensea_queue.db"),
+                       ("PROFILE_DIR", "profiles")):
+    os.environ[name] = os.path.join(STATE_DIR, filename)
+atexit.register(shutil.rmtree, STATE_DIR, ignore_errors=True)
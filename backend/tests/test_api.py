@@ -0,0 +1,287 @@
+import io
+import json
+import hashlib
+import random
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
+import api
+import storage as storage_module
+from generate import RenderedToken, render_token
+from metadata_cache import MetadataCache
+from rate_limit import BUDGETS, RateLimiter
+from render_pool import RETRY_AFTER, RenderQueueFull
+from rpc_batch import TokenInfo
+from storage import LocalStorage, content_etag
+from token_index import NEGATIVE_TTL, TokenIndex
+
+MINTED, NOT_MINTED = 7, 8
+IMAGE_SIZE = (600, 400)
+IMMUTABLE = {"public", "max-age=31536000", "immutable"}
+
+
+@pytest.fixture
+def client():
+    return api.app.test_client()
+
+
+def fake_render(token_id, *args):
+    """A render of token_id without the artwork: noise of IMAGE_SIZE and a small metadata dict."""
+    rng = random.Random(token_id)
+    image = Image.frombytes("RGBA", IMAGE_SIZE, rng.randbytes(IMAGE_SIZE[0] * IMAGE_SIZE[1] * 4))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    png = buffer.getvalue()
+    return RenderedToken(token_id, png, content_etag(png), {"name": f"Chanclas #{token_id}"})
+
+
+@pytest.fixture
+def token_api(tmp_path, monkeypatch):
+    """The API on a fresh storage and token index, where MINTED is minted and NOT_MINTED is not.
+
+    Renders and variant encodes run in this process.
+    """
+    def run(fn, *args):
+        return fake_render(*args) if fn is render_token else fn(*args)
+
+    artifacts = LocalStorage(str(tmp_path / "output"))
+    index = TokenIndex(str(tmp_path / "token_index.db"))
+    index.put_many({MINTED: TokenInfo("0xabc", 1234, 0, 1, 2, 30), NOT_MINTED: None})
+    monkeypatch.setattr(api, "storage", artifacts)
+    monkeypatch.setattr(storage_module, "_default_storage", artifacts)
+    monkeypatch.setattr(api, "token_index", index)
+    monkeypatch.setattr(api, "metadata_cache", MetadataCache())
+    monkeypatch.setattr(api, "rate_limiter", RateLimiter(BUDGETS, sync_interval=None))
+    monkeypatch.setattr(api.render_pool, "run", run)
+    api.artifact_etag.cache_clear()
+    yield api.app.test_client()
+    wait_for_writes()
+    api.artifact_etag.cache_clear()
+
+
+def wait_for_writes():
+    with api.pending_lock:
+        writes = [write for _, write in api.pending_writes.values()]
+    for write in writes:
+        write.result()
+
+
+def cache_control(response):
+    return {directive.strip() for directive in response.headers["Cache-Control"].split(",")}
+
+
+@pytest.mark.parametrize("path", ["/test/generate/5", "/test/image/5"])
+@pytest.mark.parametrize("error", [RenderQueueFull("4 renders queued"), TimeoutError("Render not finished after 20s"),
+                                   BrokenProcessPool("A child process terminated abruptly")])
+def test_test_endpoints_shed_load_like_the_real_ones(client, monkeypatch, path, error):
+    def busy_run(*args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(api.render_pool, "run", busy_run)
+    response = client.get(path)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(RETRY_AFTER)
+
+
+def bulk_lines(response):
+    return [json.loads(line) for line in response.data.splitlines()]
+
+
+@pytest.mark.parametrize("query, cursor", [
+    ("start=10&end=20", 9),
+    ("start=10&end=20&cursor=14", 14),
+    ("ids=3,10,12", 9),
+])
+def test_bulk_deferral_on_first_token_resumes_there(client, monkeypatch, query, cursor):
+    def busy(token_id, client=None):
+        raise RenderQueueFull("4 renders queued")
+
+    monkeypatch.setattr(api, "stored_metadata", lambda token_id: None if token_id >= 10 else b"{}")
+    monkeypatch.setattr(api, "ensure_token_generated", busy)
+    lines = bulk_lines(client.get(f"/bulk/metadata?{query}&generate=1"))
+
+    assert lines[-1] == {"cursor": cursor, "retry_after": RETRY_AFTER}
+
+
+def test_open_ended_bulk_ranges_end_at_the_newest_token(client, monkeypatch):
+    monkeypatch.setattr(api, "_newest_token", (0.0, None))
+    monkeypatch.setattr(api, "get_current_token_id", lambda: 25)  # Tokens 0..24 minted
+    monkeypatch.setattr(api, "stored_metadata", lambda token_id: b'{"name": "Chanclas #%d"}' % token_id)
+
+    first = bulk_lines(client.get("/bulk/metadata?start=10&limit=10"))
+    assert [line["token_id"] for line in first[:-1]] == list(range(10, 20))
+    assert first[-1] == {"cursor": 19}
+
+    last = bulk_lines(client.get("/bulk/metadata?start=10&limit=10&cursor=19"))
+    assert [line["token_id"] for line in last[:-1]] == list(range(20, 25))
+    assert last[-1] == {"cursor": None}
+
+    assert bulk_lines(client.get("/bulk/metadata?cursor=999999")) == [{"cursor": None}]
+
+
+def test_open_ended_bulk_ranges_without_chain_use_the_index(client, monkeypatch):
+    def unreachable():
+        raise ConnectionError("No RPC endpoints available")
+
+    monkeypatch.setattr(api, "_newest_token", (0.0, None))
+    monkeypatch.setattr(api, "get_current_token_id", unreachable)
+    monkeypatch.setattr(api.token_index, "max_token_id", lambda: 3)
+    monkeypatch.setattr(api, "stored_metadata", lambda token_id: b"{}")
+
+    lines = bulk_lines(client.get("/bulk/metadata"))
+    assert [line.get("token_id") for line in lines] == [0, 1, 2, 3, None]
+    assert lines[-1] == {"cursor": None}
+
+    monkeypatch.setattr(api.token_index, "max_token_id", lambda: None)
+    response = client.get("/bulk/metadata")
+    assert response.status_code == 503
+
+
+LOCAL_ONLY_PATHS = ["/status/render", "/metrics", "/status/storage", "/status/rate-limit", "/status/profiler",
+                    "/test/generate/5"]
+
+
+@pytest.mark.parametrize("path", LOCAL_ONLY_PATHS)
+@pytest.mark.parametrize("header", ["CF-Connecting-IP", "CF-Ray", "X-Forwarded-For"])
+def test_tunnel_requests_cannot_reach_local_endpoints(client, path, header):
+    # cloudflared connects from 127.0.0.1 like a local client, but adds its headers
+    response = client.get(path, headers={header: "203.0.113.7"})
+    assert response.status_code == 403
+
+
+def test_tunnel_requests_cannot_change_the_profiler(client, monkeypatch):
+    configure = []
+    monkeypatch.setattr(api.profiler, "configure", lambda **settings: configure.append(settings))
+    response = client.post("/status/profiler", data={"enabled": "1"}, headers={"CF-Connecting-IP": "203.0.113.7"})
+    assert response.status_code == 403
+    assert configure == []
+
+
+def test_remote_clients_cannot_reach_local_endpoints(client):
+    response = client.get("/status/render", environ_base={"REMOTE_ADDR": "203.0.113.7"})
+    assert response.status_code == 403
+
+
+@pytest.mark.parametrize("path", ["/status/render", "/status/rate-limit", "/status/storage"])
+def test_local_requests_reach_local_endpoints(client, path):
+    assert client.get(path).status_code == 200
+
+
+@pytest.mark.parametrize("stored", [False, True], ids=["fresh", "stored"])
+def test_metadata_etag_and_caching(token_api, stored):
+    token_api.get(f"/id/{MINTED}")
+    if stored:
+        wait_for_writes()
+        api.metadata_cache.invalidate(MINTED)
+
+    response = token_api.get(f"/id/{MINTED}")
+    assert response.status_code == 200
+    assert response.json == {"name": f"Chanclas #{MINTED}"}
+    assert response.headers["ETag"] == f'"{hashlib.sha1(response.data).hexdigest()}"'
+    assert cache_control(response) == IMMUTABLE
+
+    revalidated = token_api.get(f"/id/{MINTED}", headers={"If-None-Match": response.headers["ETag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b""
+    assert revalidated.headers["ETag"] == response.headers["ETag"]
+
+    changed = token_api.get(f"/id/{MINTED}", headers={"If-None-Match": '"0000"'})
+    assert changed.status_code == 200
+
+
+@pytest.mark.parametrize("stored", [False, True], ids=["fresh", "stored"])
+def test_image_etag_and_caching(token_api, stored):
+    png = fake_render(MINTED).png
+    token_api.get(f"/id/{MINTED}")
+    if stored:
+        wait_for_writes()
+
+    response = token_api.get(f"/image/{MINTED}")
+    assert response.status_code == 200
+    assert response.mimetype == "image/png"
+    assert response.data == png
+    assert response.headers["ETag"] == f'"{hashlib.sha1(png).hexdigest()}"'
+    assert cache_control(response) == IMMUTABLE
+
+    revalidated = token_api.get(f"/image/{MINTED}", headers={"If-None-Match": response.headers["ETag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b""
+
+
+@pytest.mark.parametrize("path", [f"/id/{NOT_MINTED}", f"/image/{NOT_MINTED}"])
+def test_not_minted_is_cached_briefly(token_api, path):
+    response = token_api.get(path)
+    assert response.status_code == 404
+    assert cache_control(response) == {"public", f"max-age={NEGATIVE_TTL}"}
+    assert "ETag" not in response.headers
+
+
+def image(response):
+    with Image.open(io.BytesIO(response.data)) as decoded:
+        return decoded.format, decoded.size
+
+
+@pytest.mark.parametrize("stored", [False, True], ids=["fresh", "stored"])
+def test_webp_is_negotiated_from_accept(token_api, stored):
+    token_api.get(f"/id/{MINTED}")
+    if stored:
+        wait_for_writes()
+
+    response = token_api.get(f"/image/{MINTED}", headers={"Accept": "image/avif,image/webp,*/*"})
+    assert response.status_code == 200
+    assert response.mimetype == "image/webp"
+    assert image(response) == ("WEBP", IMAGE_SIZE)
+    assert "Accept" in response.vary
+    assert cache_control(response) == IMMUTABLE
+
+    # Clients that do not name WebP get the PNG, which also varies on Accept
+    response = token_api.get(f"/image/{MINTED}", headers={"Accept": "*/*"})
+    assert response.mimetype == "image/png"
+    assert "Accept" in response.vary
+
+
+def test_format_query_skips_negotiation(token_api):
+    token_api.get(f"/id/{MINTED}")
+
+    response = token_api.get(f"/image/{MINTED}?format=png", headers={"Accept": "image/webp"})
+    assert response.mimetype == "image/png"
+    assert image(response)[0] == "PNG"
+    assert "Accept" not in response.vary
+
+    response = token_api.get(f"/image/{MINTED}?format=WebP")
+    assert response.mimetype == "image/webp"
+    assert "Accept" not in response.vary
+
+
+@pytest.mark.parametrize("size, width", [(128, 128), (200, 256), (512, 512), (4000, IMAGE_SIZE[0])])
+@pytest.mark.parametrize("fmt", ["png", "webp"])
+def test_thumbnails_have_the_requested_width(token_api, size, width, fmt):
+    response = token_api.get(f"/image/{MINTED}?size={size}&format={fmt}")
+
+    assert response.status_code == 200
+    assert image(response) == (fmt.upper(), (width, round(IMAGE_SIZE[1] * width / IMAGE_SIZE[0])))
+    etag = response.headers["ETag"]
+    assert token_api.get(f"/image/{MINTED}?size={size}&format={fmt}", headers={"If-None-Match": etag}).status_code == 304
+
+
+@pytest.mark.parametrize("query", ["format=gif", "format=", "size=0", "size=-128", "size=big"])
+def test_unknown_variants_are_rejected(token_api, monkeypatch, query):
+    def no_generation(*args, **kwargs):
+        raise AssertionError("Generated a token for an invalid variant")
+
+    monkeypatch.setattr(api, "ensure_token_generated", no_generation)
+    response = token_api.get(f"/image/{MINTED}?{query}")
+    assert response.status_code == 400
+    assert "error" in response.json
+
+
+@pytest.mark.parametrize("path", [f"/id/{MINTED}", f"/image/{MINTED}", f"/image/{MINTED}?size=128"])
+def test_dead_render_process_answers_busy(token_api, monkeypatch, path):
+    def broken(*args, **kwargs):
+        raise BrokenProcessPool("A child process terminated abruptly")
+
+    monkeypatch.setattr(api.render_pool, "run", broken)
+    response = token_api.get(path)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(RETRY_AFTER)
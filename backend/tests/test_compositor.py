@@ -0,0 +1,151 @@
+import random
+import pytest
+from PIL import Image
+from compositor import NumpyCompositor, PILCompositor, edge_case_stacks
+
+SIZE = (48, 40)
+
+
+def composite_both(images):
+    """RGBA bytes of a stack from the PIL reference and from the NumPy backend."""
+    numpy_compositor = NumpyCompositor()
+    expected = PILCompositor().composite(images)
+    result = numpy_compositor.composite([numpy_compositor.prepare(image) for image in images])
+    assert result.mode == "RGBA" and result.size == expected.size
+    return expected.tobytes(), result.tobytes()
+
+
+def random_layer(rng, size=SIZE):
+    """A layer of one of the shapes real artwork has: opaque, translucent, sparse or empty."""
+    width, height = size
+    kind = rng.choice(("opaque", "translucent", "patch", "pixels", "blank"))
+    if kind == "blank":
+        return Image.new("RGBA", size)
+    if kind == "opaque":
+        alpha = lambda: 255
+    elif kind == "translucent":
+        alpha = lambda: rng.randrange(256)
+    else:
+        alpha = lambda: rng.choice((0, 1, 128, 254, 255))
+    data = bytearray()
+    for _ in range(width * height):
+        data += bytes((rng.randrange(256), rng.randrange(256), rng.randrange(256), alpha()))
+    image = Image.frombytes("RGBA", size, bytes(data))
+    if kind in ("opaque", "translucent"):
+        return image
+    layer = Image.new("RGBA", size)
+    if kind == "patch":
+        left, top = rng.randrange(width), rng.randrange(height)
+        box = (left, top, rng.randrange(left, width) + 1, rng.randrange(top, height) + 1)
+        layer.paste(image.crop(box), box[:2])
+    else:
+        for _ in range(rng.randrange(1, 6)):
+            xy = (rng.randrange(width), rng.randrange(height))
+            layer.putpixel(xy, image.getpixel(xy))
+    return layer
+
+
+@pytest.mark.parametrize("index", range(len(edge_case_stacks())))
+def test_edge_case_stacks_match_pil(index):
+    expected, result = composite_both(edge_case_stacks()[index])
+    assert result == expected
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_random_stacks_match_pil(seed):
+    rng = random.Random(seed)
+    images = [random_layer(rng) for _ in range(rng.randrange(1, 7))]
+    expected, result = composite_both(images)
+    assert result == expected
+
+
+def layer(pixels, size=SIZE):
+    """A transparent canvas with the given {(x, y): rgba} pixels set."""
+    image = Image.new("RGBA", size)
+    for xy, rgba in pixels.items():
+        image.putpixel(xy, rgba)
+    return image
+
+
+def edges(size=SIZE):
+    width, height = size
+    return {
+        (0, 0): (200, 10, 30, 128), (width - 1, 0): (10, 200, 30, 255),
+        (0, height - 1): (30, 10, 200, 1), (width - 1, height - 1): (90, 90, 90, 254),
+        (width // 2, 0): (1, 2, 3, 77), (0, height // 2): (4, 5, 6, 200),
+    }
+
+
+def noise(seed, alpha, size=SIZE):
+    rng = random.Random(seed)
+    image = Image.frombytes("RGBA", size, rng.randbytes(size[0] * size[1] * 4))
+    image.putalpha(alpha)
+    return image
+
+
+def test_fully_transparent_layers_are_empty_and_change_nothing():
+    blank, hidden = Image.new("RGBA", SIZE), noise(1, 0)
+    assert NumpyCompositor().prepare(blank).rgba.size == 0
+    for images in ([noise(2, 255), blank], [noise(2, 255), hidden, blank], [blank, noise(3, 90)], [blank, blank]):
+        expected, result = composite_both(images)
+        assert result == expected
+
+
+def test_layers_touching_the_canvas_edges_keep_their_edge_pixels():
+    width, height = SIZE
+    touching = layer(edges())
+    prepared = NumpyCompositor().prepare(touching)
+    assert prepared.rgba.shape[:2] == (height, width)
+
+    right_bottom = Image.new("RGBA", SIZE)
+    right_bottom.paste(noise(4, 180).crop((0, 0, 10, 7)), (width - 10, height - 7))
+    prepared = NumpyCompositor().prepare(right_bottom)
+    assert (prepared.top, prepared.left, prepared.rgba.shape[:2]) == (height - 7, width - 10, (7, 10))
+
+    for images in ([noise(5, 255), touching], [noise(5, 255), right_bottom, touching], [touching, right_bottom]):
+        expected, result = composite_both(images)
+        assert result == expected
+
+
+def test_sparse_base_layer_leaves_the_rest_of_the_canvas_transparent():
+    base = Image.new("RGBA", SIZE)
+    base.paste(noise(6, 255).crop((0, 0, 5, 4)), (20, 11))
+    prepared = NumpyCompositor().prepare(base)
+    assert prepared.rgba.shape[:2] == (4, 5)
+
+    compositor = NumpyCompositor()
+    # Run a full-canvas stack first, so reused buffers hold stale pixels
+    compositor.composite([compositor.prepare(noise(7, 255))])
+    for images in ([base], [base, layer(edges())], [base, noise(8, 60)]):
+        expected = PILCompositor().composite(images)
+        result = compositor.composite([compositor.prepare(image) for image in images])
+        assert result.tobytes() == expected.tobytes()
+
+
+def test_atlas_layers_match_uncropped_pil(tmp_path):
+    from layer_atlas import LayerAtlas, build_atlas
+
+    sparse = Image.new("RGBA", SIZE)
+    sparse.paste(noise(9, 140).crop((0, 0, 13, 6)), (30, 30))
+    images = {"base.png": noise(10, 255), "sparse.png": sparse, "edges.png": layer(edges()),
+              "blank.png": Image.new("RGBA", SIZE), "translucent.png": noise(11, 33)}
+    paths = {}
+    for name, image in images.items():
+        paths[name] = str(tmp_path / name)
+        image.save(paths[name])
+    atlas_path = str(tmp_path / "layers.atlas")
+    build_atlas(list(paths.values()), atlas_path)
+    atlas = LayerAtlas(atlas_path)
+    assert len(atlas) == len(images)
+    assert atlas.get(paths["sparse.png"]).rgba.shape[:2] == (6, 13)
+    assert atlas.get(paths["blank.png"]).rgba.size == 0
+
+    for names in (["base.png", "sparse.png", "edges.png", "translucent.png"], ["sparse.png", "blank.png", "edges.png"],
+                  ["blank.png", "translucent.png"], ["base.png", "blank.png"]):
+        decoded = []
+        for name in names:
+            with Image.open(paths[name]) as image:
+                decoded.append(image.convert("RGBA"))
+        expected = PILCompositor().composite(decoded)
+        result = NumpyCompositor().composite([atlas.get(paths[name]) for name in names])
+        assert result.tobytes() == expected.tobytes(), names
@@ -0,0 +1,45 @@
+import pytest
+import generate
+from benchmark import make_fixtures
+from compositor import get_compositor
+from layer_atlas import LayerAtlas, build_atlas
+from layer_cache import LayerCache, layer_paths_by_weight
+
+SIZE = 96  # Fixture layer width and height
+
+
+@pytest.fixture(scope="module")
+def workspace(tmp_path_factory):
+    """Synthetic layers for every file in the rarities, built once for the module."""
+    path = str(tmp_path_factory.mktemp("generate"))
+    make_fixtures(path, SIZE)
+    return path
+
+
+@pytest.fixture(params=["pil", "numpy", "numpy+atlas"])
+def layers(request, workspace, monkeypatch):
+    """Point generate at the fixture layers through a fresh compositor and layer
+    cache, optionally backed by an atlas of every layer."""
+    monkeypatch.chdir(workspace)
+    name, _, atlas = request.param.partition("+")
+    compositor = get_compositor(name)
+    layer_atlas = None
+    if atlas:
+        build_atlas(layer_paths_by_weight(generate.directories), "layers.atlas")
+        layer_atlas = LayerAtlas("layers.atlas")
+    cache = LayerCache(64 * 1024 * 1024, compositor, layer_atlas)
+    monkeypatch.setattr(generate, "compositor", compositor)
+    monkeypatch.setattr(generate, "layer_cache", cache)
+    return cache
+
+
+def test_concurrent_generation_matches_serial(layers):
+    assert generate.check_thread_safety(tokens=60, threads=8, rounds=2) == 0
+    if layers.atlas is not None:
+        # Every layer came from the atlas, none was decoded
+        assert len(layers.atlas) > 0 and layers.misses == 0
+
+
+def test_generations_differ_between_tokens(layers):
+    digests = {generate.generation_digest(token_id, token_id * 7919 + 1) for token_id in range(20)}
+    assert len(digests) > 1
@@ -0,0 +1,84 @@
+import pytest
+import chain
+import rpc_batch
+import indexer
+from chain import ProviderPool
+from indexer import MintIndexer
+from storage import LocalStorage
+from stub_rpc import StubChain, start_stub_rpc
+from token_index import TokenIndex
+
+
+class RangeLimitedChain(StubChain):
+    """A stub whose eth_getLogs refuses ranges over max_range blocks, or fails outright."""
+
+    def __init__(self, max_range, error=None, **kwargs):
+        super().__init__(**kwargs)
+        self.max_range = max_range
+        self.error = error
+        self.ranges = []
+
+    def handle(self, request):
+        if request.get("method") == "eth_getLogs":
+            log_filter = request["params"][0]
+            start, end = int(log_filter["fromBlock"], 16), int(log_filter["toBlock"], 16)
+            self.ranges.append((start, end))
+            error = self.error
+            if error is None and end - start + 1 > self.max_range:
+                error = {"code": -32005, "message": f"query exceeds max block range {self.max_range}"}
+            if error is not None:
+                return {"jsonrpc": "2.0", "id": request.get("id"), "error": error}
+        return super().handle(request)
+
+
+@pytest.fixture
+def make_indexer(tmp_path, monkeypatch):
+    servers = []
+
+    def make(stub):
+        url, server = start_stub_rpc(stub)
+        servers.append(server)
+        pool = ProviderPool([url])
+        monkeypatch.setattr(chain, "provider_pool", pool)
+        monkeypatch.setattr(rpc_batch, "provider_pool", pool)
+        monkeypatch.setattr(indexer, "START_BLOCK", 900)
+        index = TokenIndex(str(tmp_path / "token_index.db"))
+        return MintIndexer(index, LocalStorage(str(tmp_path / "output")), render=False), index
+
+    yield make
+    for server in servers:
+        server.shutdown()
+
+
+def test_refused_ranges_shrink_the_page(make_indexer):
+    stub = RangeLimitedChain(max_range=300, minted=40, head_block=1200)
+    mint_indexer, index = make_indexer(stub)
+
+    assert mint_indexer.run_once() == 40
+    assert mint_indexer.page_size <= indexer.LOG_PAGE_SIZE
+    assert all(end - start + 1 <= 300 for start, end in stub.ranges[-3:])
+    assert index.get(39).seed == 1000 + 39 * 7919
+    assert mint_indexer.checkpoint() == 1200 - indexer.CONFIRMATIONS
+
+
+def test_other_errors_keep_the_page_size(make_indexer):
+    stub = RangeLimitedChain(max_range=10_000, error={"code": -32000, "message": "header not found"},
+                             minted=40, head_block=1200)
+    mint_indexer, index = make_indexer(stub)
+
+    with pytest.raises(RuntimeError, match="header not found"):
+        mint_indexer.run_once()
+    assert mint_indexer.page_size == indexer.LOG_PAGE_SIZE
+    assert mint_indexer.checkpoint() == 899
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("query returned more than 10000 results", True),
+    ("block range is too wide", True),
+    ("eth_getLogs is limited to a 10,000 range", True),
+    ("Log response size exceeded.", True),
+    ("Read timed out. (read timeout=10)", False),
+    ("getTokenData(3) failed: {'code': -32000, 'message': 'header not found'}", False),
+])
+def test_is_range_error(message, expected):
+    assert indexer.is_range_error(RuntimeError(message)) is expected
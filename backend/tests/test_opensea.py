@@ -0,0 +1,133 @@
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import opensea
+from opensea import OpenSeaNotifier, RefreshQueue
+
+
+class FakeOpenSea:
+    """Local refresh endpoint answering from a script of (status, headers) replies, then 200."""
+
+    def __init__(self, replies=()):
+        self.replies = list(replies)
+        self.requests = []  # (monotonic time, path, api key)
+        self._lock = threading.Lock()
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                with fake._lock:
+                    fake.requests.append((time.monotonic(), self.path, self.headers.get("x-api-key")))
+                    status, headers = fake.replies.pop(0) if fake.replies else (200, {})
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+        return Handler
+
+
+@pytest.fixture
+def opensea_server(monkeypatch):
+    servers = []
+
+    def start(replies=()):
+        fake = FakeOpenSea(replies)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), fake.handler())
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        monkeypatch.setattr(opensea, "OPENSEA_API_URL", f"http://127.0.0.1:{server.server_address[1]}")
+        monkeypatch.setattr(opensea, "OPENSEA_API_KEY", "test-key")
+        return fake
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+@pytest.fixture
+def refresh_queue(tmp_path):
+    return RefreshQueue(str(tmp_path / "opensea_queue.db"))
+
+
+def drain(notifier):
+    while notifier.process_one():
+        pass
+
+
+def test_repeated_refreshes_are_coalesced(opensea_server, refresh_queue):
+    fake = opensea_server()
+    for token_id in (7, 7, 8, 7):
+        refresh_queue.enqueue(token_id)
+    assert len(refresh_queue) == 2
+
+    drain(OpenSeaNotifier(refresh_queue, rate=100, burst=10))
+
+    paths = sorted(path for _, path, _ in fake.requests)
+    assert [path.rsplit("/", 2)[-2] for path in paths] == ["7", "8"]
+    assert {key for _, _, key in fake.requests} == {"test-key"}
+    assert len(refresh_queue) == 0
+
+
+def test_rate_limit_pauses_everything_for_retry_after(opensea_server, refresh_queue):
+    fake = opensea_server([(429, {"Retry-After": "0.5"})])
+    refresh_queue.enqueue(1)
+    refresh_queue.enqueue(2)
+    notifier = OpenSeaNotifier(refresh_queue, rate=100, burst=10)
+
+    assert notifier.process_one()
+    # The rate-limited refresh is kept without using up one of its attempts
+    assert refresh_queue._connect().execute("SELECT attempts FROM refresh_queue WHERE token_id = 1").fetchone() == (0,)
+    started = time.monotonic()
+    while len(refresh_queue):
+        if not notifier.process_one():
+            time.sleep(0.05)
+
+    assert len(fake.requests) == 3
+    assert fake.requests[1][0] - fake.requests[0][0] >= 0.45
+    assert time.monotonic() - started >= 0.45
+
+
+def test_failures_are_retried_with_backoff(opensea_server, refresh_queue, monkeypatch):
+    monkeypatch.setattr(opensea, "RETRY_BASE_DELAY", 60)
+    fake = opensea_server([(500, {})])
+    refresh_queue.enqueue(3)
+    notifier = OpenSeaNotifier(refresh_queue, rate=100, burst=10)
+
+    assert notifier.process_one()
+    assert not notifier.process_one()  # Not due again for 30-90 s
+    token_id, attempts, next_attempt_at = refresh_queue._connect().execute(
+        "SELECT token_id, attempts, next_attempt_at FROM refresh_queue").fetchone()
+    assert (token_id, attempts) == (3, 1)
+    assert 29 <= next_attempt_at - time.time() <= 91
+    assert len(fake.requests) == 1
+
+
+def test_refreshes_are_sent_at_the_bucket_rate(opensea_server, refresh_queue):
+    fake = opensea_server()
+    for token_id in range(6):
+        refresh_queue.enqueue(token_id)
+
+    drain(OpenSeaNotifier(refresh_queue, rate=10, burst=2))
+
+    times = [sent for sent, _, _ in fake.requests]
+    assert len(times) == 6
+    # Two back to back, then one every 0.1 s
+    assert times[-1] - times[0] >= 0.35
+    assert times[1] - times[0] < 0.08
+
+
+def test_no_refreshes_without_api_key(monkeypatch, refresh_queue):
+    monkeypatch.setattr(opensea, "OPENSEA_API_KEY", "")
+    refresh_queue.enqueue(1)
+    # Returns at once instead of draining the queue
+    OpenSeaNotifier(refresh_queue).run_forever()
+    assert len(refresh_queue) == 1
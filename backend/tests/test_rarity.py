@@ -0,0 +1,36 @@
+import os
+import random
+import pytest
+import rarity
+from rarity import RARITIES_DIR, check_determinism, compile_rarity, load_rarities, reference_choice
+
+PERIODS = sorted(int(name[len("rarities_"):-len(".json")]) for name in os.listdir(RARITIES_DIR)
+                 if name.startswith("rarities_") and name.endswith(".json"))
+
+
+@pytest.fixture(params=PERIODS)
+def period(request, monkeypatch):
+    """Each period's own rarities file, even while rarities_path() maps every period to one file."""
+    monkeypatch.setattr(rarity, "rarities_path", lambda period: os.path.join(RARITIES_DIR, f"rarities_{period}.json"))
+    compile_rarity.cache_clear()
+    yield request.param
+    compile_rarity.cache_clear()
+
+
+def test_compiled_samplers_match_reference(period):
+    # 1000 tokens with d from 0 to 0.49
+    assert check_determinism(1000, period) == 0
+
+
+@pytest.mark.parametrize("d", [0.0, 0.5, 1.0, 2.5])
+def test_compiled_samplers_match_reference_for_large_discounts(period, d):
+    rarities = load_rarities(period)
+    for token_id in range(0, 5000, 25):
+        seed = f"{token_id}_{token_id * 104729}"
+        compiled_rng, reference_rng = random.Random(seed), random.Random(seed)
+        for layer, sampler in compile_rarity(period, d).items():
+            assert sampler.choice(compiled_rng) == reference_choice(reference_rng, rarities[layer], d), (token_id, layer)
+
+
+def test_rarities_files_found():
+    assert PERIODS and PERIODS[0] == 0
@@ -0,0 +1,120 @@
+import time
+import pytest
+import rate_limit
+from rate_limit import Budget, RateLimiter, TokenBucket
+
+BUDGETS = {"default": Budget(rate=1, burst=3), "cold": Budget(rate=0.5, burst=1)}
+
+
+class FakeRedis:
+    """The pipelined INCRBY/EXPIRE subset of redis.Redis the limiter uses."""
+
+    def __init__(self):
+        self.counters = {}
+        self.expiry = {}
+        self.pipelines = 0
+        self.down = False
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def incrby(self, name, amount):
+        self.commands.append(("incrby", name, amount))
+
+    def expire(self, name, seconds):
+        self.commands.append(("expire", name, seconds))
+
+    def execute(self):
+        if self.redis.down:
+            raise ConnectionError("Error 111 connecting to localhost:6379. Connection refused.")
+        self.redis.pipelines += 1
+        results = []
+        for command, name, value in self.commands:
+            if command == "incrby":
+                self.redis.counters[name] = self.redis.counters.get(name, 0) + value
+                results.append(self.redis.counters[name])
+            else:
+                self.redis.expiry[name] = value
+                results.append(True)
+        return results
+
+
+@pytest.fixture
+def redis():
+    return FakeRedis()
+
+
+@pytest.fixture
+def limiter(redis):
+    return RateLimiter(BUDGETS, sync_interval=None, redis_client=redis)
+
+
+def window_key(budget, client):
+    return f"ratelimit:{budget}:{client}:{int(time.time() // rate_limit.WINDOW)}"
+
+
+def test_each_client_has_its_own_bucket(limiter):
+    assert [limiter.hit("1.1.1.1") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert 0.9 < limiter.hit("1.1.1.1") <= 1.0
+    # Another client is not affected
+    assert limiter.hit("2.2.2.2") == 0.0
+    assert limiter.stats()["allowed"] == 4
+    assert limiter.stats()["limited"] == 1
+
+
+def test_cold_budget_is_separate_and_tighter(limiter):
+    assert limiter.hit("1.1.1.1", "cold") == 0.0
+    assert 1.9 < limiter.hit("1.1.1.1", "cold") <= 2.0
+    # Cached requests of the same client still pass
+    assert limiter.hit("1.1.1.1") == 0.0
+    assert limiter.stats()["clients"] == {"default": 1, "cold": 1}
+
+
+def test_sync_pushes_counts_in_one_pipeline(limiter, redis):
+    limiter.hit("1.1.1.1")
+    limiter.hit("1.1.1.1")
+    limiter.hit("2.2.2.2", "cold")
+
+    assert limiter.sync() == 2
+    assert redis.pipelines == 1
+    assert redis.counters == {window_key("default", "1.1.1.1"): 2, window_key("cold", "2.2.2.2"): 1}
+    assert set(redis.expiry.values()) == {2 * rate_limit.WINDOW}
+    # Counts are only pushed once, and nothing is sent without new requests
+    assert limiter.sync() == 0
+    assert redis.pipelines == 1
+
+
+def test_clients_over_the_shared_budget_are_paused(limiter, redis):
+    # Other workers already counted a full window's budget for this client
+    redis.counters[window_key("default", "1.1.1.1")] = 1 * rate_limit.WINDOW + 3
+    limiter.hit("1.1.1.1")
+    limiter.hit("2.2.2.2")
+    limiter.sync()
+
+    window_left = (int(time.time() // rate_limit.WINDOW) + 1) * rate_limit.WINDOW - time.time()
+    assert limiter.hit("1.1.1.1") == pytest.approx(window_left, abs=1)
+    assert limiter.hit("2.2.2.2") == 0.0
+
+
+def test_buckets_keep_limiting_while_redis_is_down(limiter, redis):
+    redis.down = True
+    limiter.hit("1.1.1.1")
+    with pytest.raises(ConnectionError):
+        limiter.sync()
+    assert [limiter.hit("1.1.1.1") for _ in range(2)] == [0.0, 0.0]
+    assert limiter.hit("1.1.1.1") > 0
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.take() == 0.0
+    assert bucket.take() == 0.0
+    assert 0.05 < bucket.take() <= 0.1
+    bucket.pause(1)
+    assert 0.9 < bucket.take() <= 1.0
@@ -0,0 +1,37 @@
+import os
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+from render_pool import RenderPool, RenderQueueFull
+
+
+@pytest.fixture
+def pool():
+    pool = RenderPool(workers=1, queue_size=2)
+    yield pool
+    pool.shutdown()
+
+
+def test_runs_jobs_in_render_processes(pool):
+    assert pool.run(os.getpid) != os.getpid()
+    assert pool.stats()["completed"] >= 1
+
+
+def test_dead_render_process_fails_only_its_own_job(pool):
+    pool.run(os.getpid)
+    with pytest.raises(BrokenProcessPool):
+        pool.run(os._exit, 1)
+    # The next job gets a fresh pool instead of the broken one
+    assert pool.run(abs, -3) == 3
+    assert pool.stats()["queue_depth"] == 0
+
+
+def test_full_queue_is_rejected(pool):
+    for _ in range(pool.queue_size):
+        pool._slots.acquire()
+    try:
+        with pytest.raises(RenderQueueFull):
+            pool.run(os.getpid)
+    finally:
+        for _ in range(pool.queue_size):
+            pool._slots.release()
+    assert pool.stats()["rejected"] == 1
@@ -0,0 +1,92 @@
+import time
+import threading
+import pytest
+import rpc_batch
+from chain import ProviderPool
+from rpc_batch import TokenBatcher
+from stub_rpc import STUB_OWNER, StubChain, start_stub_rpc, stub_token_data
+
+
+@pytest.fixture
+def stub_pool(monkeypatch):
+    """Route rpc_batch through a stub chain with 5 minted tokens, behind an endpoint that is down."""
+    url, server = start_stub_rpc(StubChain(minted=5))
+    pool = ProviderPool(["http://127.0.0.1:9", url])
+    monkeypatch.setattr(rpc_batch, "provider_pool", pool)
+    batches = []
+    post_batch = rpc_batch._post_batch
+
+    def counting_post_batch(endpoint, token_ids):
+        batches.append(list(token_ids))
+        return post_batch(endpoint, token_ids)
+
+    monkeypatch.setattr(rpc_batch, "_post_batch", counting_post_batch)
+    yield batches
+    server.shutdown()
+
+
+def lookup_concurrently(batcher, token_ids):
+    results, errors = {}, {}
+    start = threading.Barrier(len(token_ids))
+
+    def lookup(token_id):
+        start.wait()
+        try:
+            results[token_id] = batcher.lookup(token_id)
+        except Exception as e:
+            errors[token_id] = e
+
+    threads = [threading.Thread(target=lookup, args=(token_id,)) for token_id in token_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_lookups_share_one_batch(stub_pool):
+    token_ids = [0, 3, 4, 7, 12]  # 5 and above are not minted
+    results, errors = lookup_concurrently(TokenBatcher(window=0.2), token_ids)
+
+    assert errors == {}
+    # One batch for everyone, possibly sent twice if the dead endpoint was picked first
+    assert {tuple(sorted(batch)) for batch in stub_pool} == {tuple(token_ids)}
+    for token_id in (0, 3, 4):
+        assert results[token_id] == (STUB_OWNER.lower(), *stub_token_data(token_id))
+    assert results[7] is None
+    assert results[12] is None
+
+
+def test_lookup_tokens_chunks_large_requests(stub_pool, monkeypatch):
+    monkeypatch.setattr(rpc_batch, "BATCH_MAX_TOKENS", 2)
+    results = rpc_batch.lookup_tokens([4, 5, 4, 1, 2])
+
+    assert sorted(results) == [1, 2, 4, 5]
+    assert results[5] is None
+    assert results[2].seed == stub_token_data(2)[0]
+    assert all(len(batch) <= 2 for batch in stub_pool)
+
+
+def test_batch_error_reaches_every_caller(monkeypatch):
+    def failing_lookup(token_ids):
+        raise rpc_batch.BatchRPCError("getTokenData(1) failed")
+
+    monkeypatch.setattr(rpc_batch, "lookup_tokens", failing_lookup)
+    results, errors = lookup_concurrently(TokenBatcher(window=0.2), [1, 2, 3])
+
+    assert results == {}
+    assert sorted(errors) == [1, 2, 3]
+    assert all(isinstance(error, rpc_batch.BatchRPCError) for error in errors.values())
+
+
+def test_joined_callers_time_out_on_a_stuck_batch(monkeypatch):
+    def slow_lookup(token_ids):
+        time.sleep(1)
+        return {token_id: None for token_id in token_ids}
+
+    monkeypatch.setattr(rpc_batch, "lookup_tokens", slow_lookup)
+    results, errors = lookup_concurrently(TokenBatcher(window=0.2, timeout=0.3), [1, 2])
+
+    # The leader sends the batch itself; whoever joined it gives up
+    assert len(errors) == 1
+    assert isinstance(next(iter(errors.values())), TimeoutError)
@@ -0,0 +1,60 @@
+import time
+import multiprocessing
+from rpc_batch import TokenInfo
+from token_index import TokenIndex
+
+TOKEN_ID = 42
+
+
+def serve_token(renders_path, rendered_event, start_after, results):
+    """One API worker: generate TOKEN_ID with a counted fake render and a slow artifact write."""
+    import api
+    from generate import RenderedToken
+    from storage import content_etag
+
+    def fake_render(render, token_id, *args):
+        with open(renders_path, "a") as f:
+            f.write(f"{token_id}\n")
+        png = f"png of {token_id}".encode()
+        return RenderedToken(token_id, png, content_etag(png), {"name": f"Chanclas #{token_id}"})
+
+    save_token = api.save_token
+
+    def slow_save(rendered, storage):
+        time.sleep(1)
+        save_token(rendered, storage)
+
+    api.render_pool.run = fake_render
+    api.save_token = slow_save
+
+    if start_after is not None:
+        start_after.wait(10)
+    results.put(api.ensure_token_generated(TOKEN_ID))
+    rendered_event.set()
+    api.flush_writes()
+
+
+def test_workers_render_a_token_once(tmp_path, monkeypatch):
+    monkeypatch.setenv("ARTIFACT_DIR", str(tmp_path / "output"))
+    monkeypatch.setenv("TOKEN_INDEX_DB", str(tmp_path / "token_index.db"))
+    monkeypatch.setenv("SINGLEFLIGHT_LOCK_DIR", str(tmp_path / "locks"))
+    TokenIndex(str(tmp_path / "token_index.db")).put_many({TOKEN_ID: TokenInfo("0xabc", 1234, 0, 1, 2, 30)})
+    renders_path = str(tmp_path / "renders")
+
+    context = multiprocessing.get_context("spawn")
+    first_done, second_done = context.Event(), context.Event()
+    results = context.Queue()
+    # The second worker asks once the first has answered from memory, while its files are still being written
+    workers = [
+        context.Process(target=serve_token, args=(renders_path, first_done, None, results)),
+        context.Process(target=serve_token, args=(renders_path, second_done, first_done, results)),
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+
+    assert [worker.exitcode for worker in workers] == [0, 0]
+    assert [results.get(timeout=1) for _ in workers] == [True, True]
+    with open(renders_path) as f:
+        assert f.read().split() == [str(TOKEN_ID)]
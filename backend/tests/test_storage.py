@@ -0,0 +1,157 @@
+import io
+import pytest
+from storage import LocalStorage, S3Storage, TieredStorage, content_etag, migrate_flat, token_stored
+
+
+class ClientError(Exception):
+    """Shaped like botocore's ClientError: the error code sits in response["Error"]["Code"]."""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeS3:
+    """In-memory bucket with the head/get/put calls S3Storage makes."""
+
+    def __init__(self):
+        self.objects = {}  # key -> (body, metadata)
+        self.calls = []
+
+    def head_object(self, Bucket, Key):
+        self.calls.append(("head", Key))
+        if Key not in self.objects:
+            raise ClientError("404")
+        body, metadata = self.objects[Key]
+        return {"Metadata": metadata, "ETag": '"md5"', "ContentLength": len(body)}
+
+    def get_object(self, Bucket, Key):
+        self.calls.append(("get", Key))
+        if Key not in self.objects:
+            raise ClientError("NoSuchKey")
+        return {"Body": io.BytesIO(self.objects[Key][0])}
+
+    def put_object(self, Bucket, Key, Body, ContentType, Metadata):
+        self.calls.append(("put", Key))
+        self.objects[Key] = (Body, Metadata)
+
+
+@pytest.fixture
+def s3():
+    return FakeS3()
+
+
+def node(s3, tmp_path, name, memory_bytes=1024 * 1024):
+    """One API node: the shared bucket behind this node's memory and disk tiers."""
+    return TieredStorage(S3Storage(bucket="chanclas", prefix="tokens/", client=s3), memory_bytes,
+                         disk=LocalStorage(str(tmp_path / name)))
+
+
+def test_s3_storage(s3):
+    storage = S3Storage(bucket="chanclas", prefix="tokens/", client=s3)
+    storage.put("5.json", b'{"name": "Chanclas #5"}')
+
+    assert s3.objects["tokens/5.json"][1] == {"etag": content_etag(b'{"name": "Chanclas #5"}')}
+    assert storage.exists("5.json")
+    assert not storage.exists("6.json")
+    assert storage.get("5.json") == b'{"name": "Chanclas #5"}'
+    assert storage.get("6.json") is None
+    assert storage.etag("5.json") == content_etag(b'{"name": "Chanclas #5"}')
+    assert storage.etag("6.json") is None
+    assert storage.local_path("5.json") is None
+
+
+def test_s3_errors_other_than_missing_are_raised(s3):
+    def denied(Bucket, Key):
+        raise ClientError("AccessDenied")
+
+    s3.head_object = s3.get_object = denied
+    storage = S3Storage(client=s3)
+    with pytest.raises(ClientError):
+        storage.exists("5.json")
+    with pytest.raises(ClientError):
+        storage.get("5.json")
+
+
+def test_nodes_share_artifacts_through_the_bucket(s3, tmp_path):
+    first, second = node(s3, tmp_path, "first"), node(s3, tmp_path, "second")
+    first.put("5.png", b"png of 5", etag="etag-of-5")
+    first.put("5.json", b"{}")
+
+    assert token_stored(second, 5)
+    assert not token_stored(second, 6)
+    assert second.get("5.json") == b"{}"
+    assert second.get("6.json") is None
+    assert second.etag("5.png") == first.etag("5.png") == "etag-of-5"
+    assert second.etag("6.png") is None
+
+
+def test_reads_are_served_from_the_local_tiers(s3, tmp_path):
+    node(s3, tmp_path, "first").put("5.json", b"{}")
+    second = node(s3, tmp_path, "second")
+
+    assert second.get("5.json") == b"{}"
+    downloads = [call for call in s3.calls if call[0] == "get"]
+    assert second.get("5.json") == b"{}"
+    assert second.etag("5.json") == content_etag(b"{}")
+    assert second.exists("5.json")
+    assert [call for call in s3.calls if call[0] == "get"] == downloads == [("get", "tokens/5.json")]
+
+    # A node that restarted finds it on its disk tier
+    restarted = node(s3, tmp_path, "second")
+    calls = len(s3.calls)
+    assert restarted.get("5.json") == b"{}"
+    assert len(s3.calls) == calls
+
+
+def test_local_path_pulls_artifacts_into_the_disk_tier(s3, tmp_path):
+    node(s3, tmp_path, "first").put("5.png", b"png of 5")
+    second = node(s3, tmp_path, "second", memory_bytes=0)
+
+    path = second.local_path("5.png")
+    assert path.startswith(str(tmp_path / "second"))
+    with open(path, "rb") as f:
+        assert f.read() == b"png of 5"
+    assert second.local_path("6.png") is None
+    # Without a disk tier there is nothing to hand to send_file()
+    assert TieredStorage(S3Storage(client=s3), disk=None).local_path("5.png") is None
+
+
+def test_memory_tier_stays_within_its_budget(s3, tmp_path):
+    storage = node(s3, tmp_path, "first", memory_bytes=10)
+    for token_id in range(5):
+        storage.put(f"{token_id}.json", b"1234")
+
+    assert storage.size_bytes <= 10
+    assert storage.stats()["memory"]["entries"] == 2
+
+
+def test_local_storage_shards_by_token(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    storage.put("5.png", b"png")
+    storage.put("5_256.webp", b"webp")
+
+    assert storage.path("5.png") != str(tmp_path / "5.png")
+    assert (tmp_path / storage.shard("5.png") / "5_256.webp").exists()
+    assert storage.local_path("5.png") == storage.path("5.png")
+    assert storage.local_path("6.png") is None
+    assert storage.etag("5.png") == content_etag(b"png")
+
+
+def test_flat_output_is_migrated(s3, tmp_path):
+    flat = tmp_path / "output"
+    flat.mkdir()
+    (flat / "1.png").write_bytes(b"png")
+    (flat / "1.png.etag").write_text("abc")
+    (flat / "1.json").write_bytes(b"{}")
+
+    local = LocalStorage(str(flat))
+    assert migrate_flat(str(flat), local) == 2
+    assert migrate_flat(str(flat), local) == 0
+    assert local.etag("1.png") == "abc"
+
+    (flat / "2.json").write_bytes(b"{}")
+    remote = TieredStorage(S3Storage(client=s3), disk=None)
+    assert migrate_flat(str(flat), remote) == 1
+    assert remote.get("2.json") == b"{}"
+    assert not (flat / "2.json").exists()
@@ -0,0 +1,61 @@
+import time
+import sqlite3
+from rpc_batch import TokenInfo
+from token_index import NOT_MINTED, TokenIndex, resolve_token
+
+# The tokens table as written before unminted IDs were stored
+OLD_SCHEMA = """
+CREATE TABLE tokens (
+    token_id INTEGER PRIMARY KEY,
+    owner TEXT,
+    seed TEXT NOT NULL,
+    period_id INTEGER NOT NULL,
+    extra_mints INTEGER NOT NULL,
+    curve_steepness INTEGER NOT NULL,
+    max_rebate INTEGER NOT NULL,
+    block_number INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+SEED = 2 ** 200 + 7
+
+
+def test_old_index_is_migrated(tmp_path):
+    path = str(tmp_path / "token_index.db")
+    db = sqlite3.connect(path)
+    db.executescript(OLD_SCHEMA)
+    now = time.time()
+    db.execute("INSERT INTO tokens VALUES (5, '0xabc', ?, 1, 2, 3, 40, 1234, ?, ?)", (str(SEED), now, now))
+    db.execute("INSERT INTO meta VALUES ('last_indexed_block', '1234')")
+    db.commit()
+    db.close()
+
+    index = TokenIndex(path)
+    assert index.get(5) == TokenInfo("0xabc", SEED, 1, 2, 3, 40)
+    assert index.get_meta("last_indexed_block") == "1234"
+    assert index.token_ids() == [5]
+    # Unminted IDs can be stored once the table is migrated
+    index.put_many({6: None})
+    assert index.get(6) is NOT_MINTED
+    assert index.max_token_id() == 5
+
+    # Opening it again leaves it alone
+    assert TokenIndex(path).get(5).seed == SEED
+
+
+def test_ids_outside_sqlite_range_are_not_minted(tmp_path, monkeypatch):
+    import token_index
+
+    def lookup_token(token_id):
+        raise AssertionError(f"Asked the chain about token {token_id}")
+
+    monkeypatch.setattr(token_index, "lookup_token", lookup_token)
+    index = TokenIndex(str(tmp_path / "token_index.db"))
+    assert index.get(99999999999999999999999) is NOT_MINTED
+    assert index.get(2 ** 63) is NOT_MINTED
+    assert index.get(-1) is NOT_MINTED
+    assert resolve_token(index, 2 ** 256) is None
+    assert index.get(2 ** 63 - 1) is None
@@ -0,0 +1,190 @@
+import os
+import time
+import sqlite3
+import threading
+from rpc_batch import TokenInfo, lookup_token
+from metrics import cache_counters, stage
+
+# SQLite file shared by the indexer and the API workers
+TOKEN_INDEX_DB = os.getenv("TOKEN_INDEX_DB", "./token_index.db")
+# How long a "not minted" answer is trusted before asking the chain again
+NEGATIVE_TTL = int(os.getenv("TOKEN_NEGATIVE_TTL", "30"))
+
+# Returned by TokenIndex.get for tokens recently confirmed as not minted
+NOT_MINTED = "not_minted"
+# Token IDs that fit in an SQLite INTEGER; the contract never mints beyond them
+MAX_TOKEN_ID = 2 ** 63 - 1
+
+INDEX_HITS, INDEX_MISSES = cache_counters("token_index")
+
+TOKENS_TABLE = """
+CREATE TABLE IF NOT EXISTS tokens (
+    token_id INTEGER PRIMARY KEY,
+    minted INTEGER NOT NULL,
+    owner TEXT,
+    seed TEXT,
+    period_id INTEGER,
+    extra_mints INTEGER,
+    curve_steepness INTEGER,
+    max_rebate INTEGER,
+    block_number INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+SCHEMA = TOKENS_TABLE + """;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class TokenIndex:
+    """Local SQLite store of token state: mint status and immutable token data.
+
+    Minted tokens are cached forever since their seed and parameters never change.
+    Unminted IDs are cached for NEGATIVE_TTL seconds so crawler probes do not hit
+    the RPC every time. Safe to share between threads (one connection per thread)
+    and processes (WAL journal, so readers never block writers).
+    """
+
+    def __init__(self, path=TOKEN_INDEX_DB):
+        self.path = path
+        self._local = threading.local()
+        db = self._connect()
+        self._migrate(db)
+        db.executescript(SCHEMA)
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _migrate(self, db):
+        """Upgrade an index written before unminted IDs were stored.
+
+        Its tokens table has no minted column and requires token data, so it is
+        rebuilt with every existing row marked as minted. Runs in an immediate
+        transaction, so only one process migrates.
+        """
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            columns = {row[1] for row in db.execute("PRAGMA table_info(tokens)")}
+            if columns and "minted" not in columns:
+                db.execute("ALTER TABLE tokens RENAME TO tokens_old")
+                db.execute(TOKENS_TABLE)
+                db.execute(
+                    """
+                    INSERT INTO tokens (token_id, minted, owner, seed, period_id, extra_mints, curve_steepness,
+                                        max_rebate, block_number, created_at, updated_at)
+                    SELECT token_id, 1, owner, seed, period_id, extra_mints, curve_steepness,
+                           max_rebate, block_number, created_at, updated_at
+                    FROM tokens_old
+                    """
+                )
+                db.execute("DROP TABLE tokens_old")
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def get(self, token_id):
+        """Return TokenInfo for a minted token, NOT_MINTED for a fresh negative
+        entry, or None if the state is unknown and the chain must be asked."""
+        if not 0 <= token_id <= MAX_TOKEN_ID:
+            return NOT_MINTED
+        row = self._connect().execute(
+            "SELECT minted, owner, seed, period_id, extra_mints, curve_steepness, max_rebate, updated_at "
+            "FROM tokens WHERE token_id = ?",
+            (token_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        minted, owner, seed, period_id, extra_mints, curve_steepness, max_rebate, updated_at = row
+        if not minted:
+            return NOT_MINTED if time.time() - updated_at < NEGATIVE_TTL else None
+        # uint256 seeds do not fit in an SQLite integer, so they are stored as text
+        return TokenInfo(owner, int(seed), period_id, extra_mints, curve_steepness, max_rebate)
+
+    def put_many(self, tokens, block_numbers=None):
+        """Store lookup results {token_id: TokenInfo or None (not minted)} in one transaction."""
+        block_numbers = block_numbers or {}
+        now = time.time()
+        minted = [
+            (token_id, token.owner, str(token.seed), token.period_id, token.extraMints,
+             token.curveSteepness, token.maxRebate, block_numbers.get(token_id), now, now)
+            for token_id, token in tokens.items() if token is not None
+        ]
+        not_minted = [(token_id, now, now) for token_id, token in tokens.items() if token is None]
+        with self._connect() as db:
+            db.executemany(
+                """
+                INSERT INTO tokens (token_id, minted, owner, seed, period_id, extra_mints, curve_steepness,
+                                    max_rebate, block_number, created_at, updated_at)
+                VALUES (?, 1, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(token_id) DO UPDATE SET
+                    minted = 1,
+                    owner = excluded.owner,
+                    seed = excluded.seed,
+                    period_id = excluded.period_id,
+                    extra_mints = excluded.extra_mints,
+                    curve_steepness = excluded.curve_steepness,
+                    max_rebate = excluded.max_rebate,
+                    block_number = COALESCE(excluded.block_number, tokens.block_number),
+                    updated_at = excluded.updated_at
+                """,
+                minted,
+            )
+            # Never let a stale "not minted" answer overwrite a minted token
+            db.executemany(
+                """
+                INSERT INTO tokens (token_id, minted, created_at, updated_at) VALUES (?, 0, ?, ?)
+                ON CONFLICT(token_id) DO UPDATE SET updated_at = excluded.updated_at WHERE tokens.minted = 0
+                """,
+                not_minted,
+            )
+
+    def token_ids(self):
+        """IDs of all minted tokens in the index."""
+        return [row[0] for row in self._connect().execute("SELECT token_id FROM tokens WHERE minted = 1 ORDER BY token_id")]
+
+    def max_token_id(self):
+        """Highest minted token ID in the index, or None if it holds none."""
+        return self._connect().execute("SELECT MAX(token_id) FROM tokens WHERE minted = 1").fetchone()[0]
+
+    def get_meta(self, key, default=None):
+        row = self._connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, str(value)),
+            )
+
+
+def resolve_token(index, token_id):
+    """Return TokenInfo for a minted token or None, asking the chain only on a cache miss.
+
+    The chain's answer (minted or not) is written back to the index.
+    """
+    token = index.get(token_id)
+    if token is NOT_MINTED:
+        INDEX_HITS.inc()
+        return None
+    if token is not None:
+        INDEX_HITS.inc()
+        return token
+    INDEX_MISSES.inc()
+
+    # Mint check and token data in one batched round trip
+    with stage("rpc_lookup"):
+        token = lookup_token(token_id)
+    index.put_many({token_id: token})
+    return token
@@ -0,0 +1,79 @@
+import io
+from PIL import Image
+from metrics import stage
+from storage import image_key, default_storage
+
+# Thumbnail widths offered through ?size=, smallest first
+VARIANT_SIZES = (128, 256, 512)
+VARIANT_FORMATS = {"png": "image/png", "webp": "image/webp"}
+WEBP_QUALITY = 85  # Lossy quality used for WebP thumbnails
+
+
+def negotiate_variant(request):
+    """Pick (size, format) for an /image request.
+
+    ?size= snaps up to the next thumbnail width (None means full size). ?format=
+    wins over the Accept header; otherwise WebP is served to clients that
+    explicitly accept it and PNG to everyone else. Raises ValueError for a size
+    that is not a positive integer or a format that is not offered.
+    """
+    size = request.args.get("size")
+    if size is not None:
+        if not size.isdigit() or int(size) <= 0:
+            raise ValueError(f"size must be a positive integer, not '{size}'")
+        size = next((s for s in VARIANT_SIZES if s >= int(size)), None)
+
+    fmt = request.args.get("format")
+    if fmt is None:
+        return size, "webp" if "image/webp" in request.accept_mimetypes.values() else "png"
+    if fmt.lower() not in VARIANT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(VARIANT_FORMATS)}, not '{fmt}'")
+    return size, fmt.lower()
+
+
+def variant_key(token_id, size, fmt):
+    """Storage key of a variant of a token's PNG; the full-size PNG is the image itself."""
+    if size is None and fmt == "png":
+        return image_key(token_id)
+    return f"{token_id}_{size or 'full'}.{fmt}"
+
+
+def encode_variant(image, size, fmt):
+    """Encode an RGBA image as a variant: full-size WebP is lossless, thumbnails
+    are resized with Lanczos and saved as lossy WebP or optimized PNG."""
+    if size is not None and size < image.width:
+        image = image.resize((size, round(image.height * size / image.width)), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    if fmt == "webp":
+        if size is None:
+            image.save(buffer, format="WEBP", lossless=True)
+        else:
+            image.save(buffer, format="WEBP", quality=WEBP_QUALITY, method=4)
+    else:
+        image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def ensure_variant(token_id, size, fmt, storage=None):
+    """Return the key of a variant, encoding it from the stored PNG on first use."""
+    storage = storage or default_storage()
+    key = variant_key(token_id, size, fmt)
+    if not storage.exists(key):
+        with stage("variant_encode"), Image.open(io.BytesIO(storage.get(image_key(token_id)))) as image:
+            data = encode_variant(image.convert("RGBA"), size, fmt)
+            storage.put(key, data)
+    return key
+
+
+def render_all_variants(token_id, storage=None):
+    """Encode every missing variant of a token up front (e.g. while pre-rendering)."""
+    storage = storage or default_storage()
+    with Image.open(io.BytesIO(storage.get(image_key(token_id)))) as image:
+        image = image.convert("RGBA")
+        for fmt in VARIANT_FORMATS:
+            for size in (None,) + VARIANT_SIZES:
+                key = variant_key(token_id, size, fmt)
+                if not storage.exists(key):
+                    data = encode_variant(image, size, fmt)
+                    storage.put(key, data)
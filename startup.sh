@@ -33,7 +33,11 @@ PROJECT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 # Start gunicorn screen session
 echo "Starting backend service..."
 echo "Using project directory: $PROJECT_DIR"
-start_screen_session "backend" "cd $PROJECT_DIR/backend && source venv/bin/activate && gunicorn -c gunicorn.conf.py api:app"
+start_screen_session "backend" "cd $PROJECT_DIR/backend && source venv/bin/activate && python layer_atlas.py && python storage.py && gunicorn -c gunicorn.conf.py api:app"
+
+# Start mint indexer screen session
+echo "Starting indexer service..."
+start_screen_session "indexer" "cd $PROJECT_DIR/backend && source venv/bin/activate && python indexer.py"
 
 # Start cloudflared screen session
 echo "Starting cloudflared service..."
@@ -45,6 +49,7 @@ screen -ls
 
 echo -e "\nTo attach to a screen session:"
 echo "  screen -r backend    # For backend service"
+echo "  screen -r indexer    # For mint indexer"
 echo "  screen -r cloudflared # For cloudflared tunnel"
 
 # If backend failed, show the error log
@@ -56,11 +61,14 @@ fi
 # Keep the script running and monitor the sessions
 while true; do
     sleep 30
-    if ! screen -list | grep -q "backend" || ! screen -list | grep -q "cloudflared"; then
+    if ! screen -list | grep -q "backend" || ! screen -list | grep -q "indexer" || ! screen -list | grep -q "cloudflared"; then
         echo "One or more screen sessions died, restarting..."
         # Restart the dead sessions
         if ! screen -list | grep -q "backend"; then
-            start_screen_session "backend" "cd $PROJECT_DIR/backend && source venv/bin/activate && gunicorn -c gunicorn.conf.py api:app"
+            start_screen_session "backend" "cd $PROJECT_DIR/backend && source venv/bin/activate && python layer_atlas.py && python storage.py && gunicorn -c gunicorn.conf.py api:app"
+        fi
+        if ! screen -list | grep -q "indexer"; then
+            start_screen_session "indexer" "cd $PROJECT_DIR/backend && source venv/bin/activate && python indexer.py"
         fi
         if ! screen -list | grep -q "cloudflared"; then
             start_screen_session "cloudflared" "cd $PROJECT_DIR && cloudflared tunnel run chanclas"